@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Fixture corpus for the parser benchmarks.
+
+`fixtures/` holds anonymized PTT pages (user ids, IPs and links are made
+up, IPs are from the documentation ranges):
+
+- short_post.html: an ordinary post with a handful of pushes
+- quote_chain.html: a reply quoting eight levels of earlier replies,
+  pushes across New Year
+- deleted_author.html: a post whose header (作者/標題/時間) is gone
+- index_pinned.html: an index page with deleted entries and 置底文
+
+Comment wars are too big to check in; `mega_thread()` builds one out of
+short_post.html.
+"""
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+POSTS = ('short_post', 'quote_chain', 'deleted_author')
+INDEXES = ('index_pinned',)
+
+
+def fixture_path(name):
+    """Path of fixture `name` (without `.html`)."""
+    return os.path.join(FIXTURES, f'{name}.html')
+
+
+def load(name):
+    """Body (bytes) of fixture `name`."""
+    with open(fixture_path(name), 'rb') as f:
+        return f.read()
+
+
+def mega_thread(comments=10000):
+    """
+    short_post.html with `comments` pushes, spread over more than a year.
+
+    Output: body <bytes>
+    """
+    html = load('short_post').decode('utf-8')
+    start = html.index('<div class="push">')
+    end = html.index('</div>\n<div id="article-polling"')
+    tags = (('hl push-tag', '推'), ('f1 hl push-tag', '噓'), ('f1 hl push-tag', '→'))
+    pushes = []
+    for i in range(comments):
+        cls, tag = tags[i % 3]
+        # 從 12/01 起每則推文晚一小時 (一個月算 28 天)，中間會跨年
+        minutes = i * 60
+        month = (12 + minutes // (28 * 24 * 60) - 1) % 12 + 1
+        day = minutes // (24 * 60) % 28 + 1
+        pushes.append(
+            f'<div class="push"><span class="{cls}">{tag} </span>'
+            f'<span class="f3 hl push-userid">user{i % 997:03d}</span>'
+            f'<span class="f3 push-content">: 第 {i} 則推文，'
+            f'這是比較長一點的推文內容 &lt;{i}&gt;</span>'
+            f'<span class="push-ipdatetime"> 203.0.113.{i % 250 + 1} '
+            f'{month:02d}/{day:02d} {minutes // 60 % 24:02d}:{i % 60:02d}\n'
+            f'</span></div>'
+        )
+    return (html[:start] + ''.join(pushes) + html[end:]).encode('utf-8')
+
+
+def post_url(name):
+    """URL to pretend fixture `name` was downloaded from."""
+    board = 'movie' if name in ('short_post', 'mega_thread') else 'Gossiping'
+    article_id = {
+        'short_post': 'M.1575796522.A.0B1',
+        'mega_thread': 'M.1575796522.A.0B1',
+        'quote_chain': 'M.1577836801.A.C3D',
+        'deleted_author': 'M.1577900000.A.1F2',
+    }[name]
+    return f'https://www.ptt.cc/bbs/{board}/{article_id}.html'
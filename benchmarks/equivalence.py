@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Side-by-side check of the single-pass post extractor against the old path.
+
+The old path is copied here verbatim from `parse_post` as it was before
+`extract_post` (PyQuery(response.text) from `PyqueryMiddleware`, clone /
+remove / html(), `MLStripper`, the 發信站 regex and the quote regex with
+`str.replace`), together with the helpers it called. Every page given on
+the command line, e.g. the output of `scrapy crawl ptt_article`, is
+parsed both ways and every field `parse_post` reads is compared,
+`content` included. `stream_post` has to agree with `extract_post`
+exactly.
+
+Intended differences (they show up as mismatches; look at them with -v):
+
+- `content`, `quote`: text in front of the first tag of `#main-content`
+  (only posts without the 作者/標題 header have any) was HTML-unescaped
+  twice by the old path; `extract_post` does it once.
+- `content`: the old path removed every quote line from the whole text
+  with `str.replace`, which also took a short quote line (e.g. ": 推")
+  out of the middle of a longer line containing it and left the rest;
+  `segment` only cuts whole lines.
+- pages without `#main-content` made the old path raise; both sides
+  give None for them here.
+
+`INTENDED` lists the fixtures which hit one of these, and the fields
+they differ on; those pages are reported but do not fail the check.
+
+    python -m benchmarks.equivalence data/movie/2019/*.html
+    python -m benchmarks.equivalence        # the fixture corpus
+"""
+import argparse
+import re
+import sys
+from html.parser import HTMLParser
+
+from pyquery import PyQuery
+
+from scraptt.spiders.parsers.index import page_tree
+from scraptt.spiders.parsers.post import extract_post, stream_post
+
+from .corpus import POSTS, fixture_path
+
+# fixture -> fields on which the two paths disagree on purpose
+INTENDED = {
+    # ": : : : : : : : " 在更長的引述行裡，被 str.replace 切掉後殘留在內文
+    'quote_chain': ['content'],
+}
+
+# --- the old path, verbatim ---------------------------------------------
+
+class MLStripper(HTMLParser):
+    """HTML tag stripper.
+
+    ref: http://stackoverflow.com/a/925630/1105489
+    """
+
+    def __init__(self):  # noqa
+        self.reset()
+        self.strict = False
+        self.convert_charrefs = True
+        self.fed = []
+
+    def handle_data(self, d):  # noqa
+        self.fed.append(d)
+
+    def get_data(self):  # noqa
+        return ''.join(self.fed)
+
+    @classmethod
+    def strip_tags(cls, html):  # noqa
+        s = cls()
+        s.feed(html)
+        return s.get_data()
+
+
+def mod_content(content):
+    """Remove unnecessary info from a PTT post."""
+    content = MLStripper.strip_tags(content)
+    content = re.sub(
+        r"※ 發信站.*|※ 文章網址.*|※ 編輯.*", '', content
+    ).strip('\r\n-')
+    return content
+
+
+def extract_ip(string):
+    """Extract IP address.
+
+    The strategy is to find as many IPs as possible, and return the last one
+    as the IP info is usually at the bottom of the content.
+    """
+    try:
+        ips = re.findall(r'\d{,3}\.\d{,3}\.\d{,3}\.\d{,3}', string)
+        if ips:
+            ip = ips[-1]
+        else:
+            ip = None
+        return ip
+    except:  # noqa: E722
+        return None
+
+
+def legacy_extract_post(html):
+    """The fields `parse_post` used to compute, the way it computed them."""
+    dom = PyQuery(html).make_links_absolute('https://www.ptt.cc/bbs/')
+
+    # 抓出主文
+    content = (
+        dom('#main-content')
+        .clone()
+        .children()
+        .remove('span[class^="article-meta-"]')
+        .remove('div.push')
+        .end()
+        .html()
+    )
+    if content is None:
+        return None
+
+    # 抓出meta: 作者/看板/標題/時間
+    meta = dict(
+        (_.text(), _.next().text())
+        for _
+        in dom('.article-meta-tag').items()
+    )
+    post = {
+        'ip': extract_ip(content),
+        'content': mod_content(content),
+        'board': dom('#topbar a.board').remove('*').text().strip(),
+    }
+    comments = [
+        (
+            _('.push-tag').text(),
+            _('.push-userid').text(),
+            _('.push-content').text(),
+            _('.push-ipdatetime').text(),
+        )
+        for _ in dom('.push').items()
+    ]
+
+    # quote
+    msg = post['content']
+    qs = re.findall('※ 引述.*|\n: .*', msg)
+    for q in qs:
+        msg = msg.replace(q, '')
+    qs = '\n'.join([i.strip('\n') for i in qs])
+    post['content'] = msg.strip('\n ')
+    return {
+        'board': post['board'],
+        'meta': meta,
+        'ip': post['ip'],
+        'content': post['content'],
+        'quote': qs,
+        'comments': comments,
+    }
+
+
+# --- the current path ---------------------------------------------------
+
+def current_extract_post(html):
+    """`extract_post`, with the fields `legacy_extract_post` returns."""
+    page = extract_post(page_tree(html))
+    if page is not None:
+        page.pop('segments')
+    return page
+
+
+def compare(html):
+    """Return the names of the fields on which both paths disagree."""
+    old = legacy_extract_post(html)
+    new = current_extract_post(html)
+    if stream_post(html.encode('utf-8'), chunk_size=4096) != extract_post(
+            page_tree(html)):
+        return ['stream_post']
+    if old is None or new is None:
+        return [] if old is new else ['page']
+    return [key for key in old if old[key] != new[key]]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare extract_post with the old PyQuery path')
+    parser.add_argument('paths', nargs='*', help='saved PTT post pages',
+                        default=[fixture_path(name) for name in POSTS])
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print both values of every mismatch')
+    args = parser.parse_args()
+    intended = {fixture_path(name): fields for name, fields in INTENDED.items()}
+
+    failed = 0
+    for path in args.paths:
+        with open(path, 'rb') as f:
+            html = f.read().decode('utf-8')
+        fields = compare(html)
+        if fields and intended.get(path) == fields:
+            print(f'INTENDED {path}: {", ".join(fields)}')
+        elif fields:
+            failed += 1
+            print(f'MISMATCH {path}: {", ".join(fields)}')
+            if args.verbose and fields[0] not in ('page', 'stream_post'):
+                old = legacy_extract_post(html)
+                new = current_extract_post(html)
+                for field in fields:
+                    print(f'  old {field}: {old[field]!r}')
+                    print(f'  new {field}: {new[field]!r}')
+    print(f'{len(args.paths) - failed}/{len(args.paths)} pages match')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Parser micro-benchmarks over the fixture corpus (see `corpus.py`).
+
+Every case is timed for at least `--min-time` seconds, then run once more
+under tracemalloc for its allocations: the peak of Python memory during
+the call and the number of blocks it allocated that are still alive
+afterwards (the result). Memory that libxml2 allocates itself is not
+seen by tracemalloc.
+
+    python -m benchmarks.run --save          # write benchmarks/baseline.json
+    python -m benchmarks.run                 # compare with it
+
+Compared with the baseline, a case regresses when it gets slower, or
+allocates more, by more than `--threshold` (default 25%); the run then
+exits with status 1.
+
+This is a local gate only. Timings only compare on the same machine, so
+the baseline is not checked in and no CI job runs it: save a baseline
+before starting a change, then compare against it on the same machine.
+
+    python -m benchmarks.run --strict        # exit 2 without a baseline
+
+With `--strict` a missing baseline, or a case missing from it, is an
+error instead of a note, for local scripts that must not pass without
+something to compare with.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from scraptt.middlewares import PttResponse
+from scraptt.spiders.parsers.comment import CommentList
+from scraptt.spiders.parsers.comment_time import YearRollover, parse_ipdatetime
+from scraptt.spiders.parsers.index import (
+    extract_topics, latest_index, page_tree
+)
+from scraptt.spiders.parsers.post import extract_post, stream_post
+from scraptt.spiders.parsers.segment import segment
+
+from . import corpus
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def _tree(body):
+    return page_tree(body.decode('utf-8'))
+
+
+def _parse_post(spider, name):
+    from scrapy.http import Request
+
+    url = corpus.post_url(name)
+    request = Request(url)
+
+    def run(body):
+        response = PttResponse(
+            url=url, body=body, encoding='utf-8', request=request)
+        return list(spider.parse_post(response))
+    return run
+
+
+def cases():
+    """List of (name, function, argument, size of the input in bytes)."""
+    from scrapy.settings import Settings
+    from scraptt import settings
+    from scraptt.spiders.ptt import PttSpider
+
+    spider = PttSpider()
+    spider.settings = Settings()
+    spider.settings.setmodule(settings)
+    bodies = {name: corpus.load(name) for name in corpus.POSTS}
+    bodies['mega_thread'] = corpus.mega_thread()
+
+    result = []
+    for name, body in bodies.items():
+        result.append((
+            f'post.extract_post/{name}',
+            lambda body: extract_post(_tree(body)), body, len(body)
+        ))
+    result.append((
+        'post.stream_post/mega_thread',
+        stream_post, bodies['mega_thread'], len(bodies['mega_thread'])
+    ))
+    for name, body in bodies.items():
+        result.append((
+            f'spider.parse_post/{name}',
+            _parse_post(spider, name), body, len(body)
+        ))
+
+    body = bodies['quote_chain']
+    text = _tree(body).get_element_by_id('main-content').text_content()
+
+    def split(text):
+        segments = segment(text)
+        return segments.content, segments.quote
+    result.append(('segment.segment/quote_chain', split, text, len(body)))
+
+    body = bodies['mega_thread']
+    page = extract_post(_tree(body))
+    ipdatetimes = [comment[3] for comment in page['comments']]
+    result.append((
+        'comment_time.parse_ipdatetime/mega_thread',
+        lambda texts: [parse_ipdatetime(text) for text in texts],
+        ipdatetimes, len(body)
+    ))
+    ips, stamps = zip(*map(parse_ipdatetime, ipdatetimes))
+
+    def resolve_all(stamps):
+        resolve = YearRollover(datetime(2019, 12, 1))
+        return [resolve(*stamp) for stamp in stamps]
+    result.append((
+        'comment_time.YearRollover/mega_thread', resolve_all, stamps, len(body)
+    ))
+
+    rows = [
+        (tag, userid, content, published, ip)
+        for (tag, userid, content, _), published, ip
+        in zip(page['comments'], resolve_all(stamps), ips)
+    ]
+
+    def fill(rows):
+        comments = CommentList()
+        for row in rows:
+            comments.append(*row)
+        return comments
+    result.append(('comment.CommentList/mega_thread', fill, rows, len(body)))
+
+    def parse_index(body):
+        root = _tree(body)
+        return extract_topics(root), latest_index(root)
+    for name in corpus.INDEXES:
+        body = corpus.load(name)
+        result.append((
+            f'index.extract_topics+latest_index/{name}', parse_index,
+            body, len(body)
+        ))
+    return result
+
+
+def measure(func, arg, min_time):
+    """Return seconds per call, peak KiB and retained blocks of one call."""
+    func(arg)   # warm-up
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        func(arg)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        result = func(arg)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        blocks = sum(
+            stat.count for stat in tracemalloc.take_snapshot().statistics('filename')
+        )
+    finally:
+        tracemalloc.stop()
+    del result
+    return elapsed / calls, peak / 1024, blocks
+
+
+def regressions(name, stats, baseline, threshold):
+    """Names of the metrics of case `name` which regressed."""
+    old = baseline.get(name)
+    if old is None:
+        return []
+    return [
+        metric for metric in ('seconds', 'peak_kib', 'blocks')
+        if old[metric] and stats[metric] > old[metric] * (1 + threshold)
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PTT parser benchmarks')
+    parser.add_argument('-k', dest='filter', default='',
+                        help='only run cases whose name contains this')
+    parser.add_argument('--min-time', dest='min_time', type=float, default=1.0,
+                        help='seconds to time each case for')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed regression, 0.25 = 25%%')
+    parser.add_argument('--save', action='store_true',
+                        help='write the results as the new baseline')
+    parser.add_argument('--strict', action='store_true',
+                        help='fail without a baseline to compare with')
+    args = parser.parse_args()
+    # deleted_author 之類的頁面每次都會 warning
+    logging.disable(logging.WARNING)
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.strict and not args.save and not baseline:
+        print(f'no baseline at {args.baseline}; run with --save on this machine first')
+        sys.exit(2)
+
+    results = {}
+    failed = []
+    print(f'{"case":<52} {"calls/s":>10} {"MB/s":>8} {"peak KiB":>10} {"blocks":>8}')
+    for name, func, arg, size in cases():
+        if args.filter not in name:
+            continue
+        seconds, peak_kib, blocks = measure(func, arg, args.min_time)
+        stats = results[name] = {
+            'seconds': seconds, 'peak_kib': round(peak_kib, 1), 'blocks': blocks
+        }
+        worse = regressions(name, stats, baseline, args.threshold)
+        line = (
+            f'{name:<52} {1 / seconds:>10.1f} {size / seconds / 1e6:>8.2f} '
+            f'{peak_kib:>10.1f} {blocks:>8}'
+        )
+        if args.strict and not args.save and name not in baseline:
+            failed.append(name)
+            line += '  NOT IN BASELINE'
+        elif worse:
+            failed.append(name)
+            line += '  REGRESSED: ' + ', '.join(
+                f'{metric} {baseline[name][metric]:.4g} -> {stats[metric]:.4g}'
+                for metric in worse
+            )
+        print(line)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'baseline written to {args.baseline}')
+    elif not baseline:
+        print(f'no baseline at {args.baseline}, run with --save first')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""On-disk Bloom filter of crawled articles."""
+import argparse
+import glob
+import json
+import math
+import os
+import struct
+from hashlib import blake2b
+
+from .exporters import open_lines
+from .ids import article_key
+
+
+def article_token(board, article_id):
+    """Key of one article in the filter, e.g. "Gossiping/M.1575882922.A.5A4"."""
+    return f'{board}/{article_id}'
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter saved as a single file.
+
+    Sized for `capacity` keys at false-positive rate `error_rate`; past
+    `capacity` the rate degrades, so size it for the whole archive.
+    A false positive means a post is skipped, never that one is crawled
+    twice.
+    """
+
+    MAGIC = b'PTTBLOOM'
+    HEADER = struct.Struct('<8sQQQ')    # magic, bits, hashes, count
+
+    def __init__(self, capacity, error_rate, path=None):
+        """__init__ method."""
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.bits = max(bits, 8)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+        self.path = path
+
+    @classmethod
+    def open(cls, path, capacity, error_rate):
+        """Load the filter at `path`, or create an empty one."""
+        if not os.path.exists(path):
+            return cls(capacity, error_rate, path)
+        with open(path, 'rb') as f:
+            magic, bits, hashes, count = cls.HEADER.unpack(
+                f.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise ValueError(f'{path} is not a bloom filter file')
+            bloom = cls.__new__(cls)
+            bloom.bits = bits
+            bloom.hashes = hashes
+            bloom.count = count
+            bloom.array = bytearray(f.read())
+            bloom.path = path
+        return bloom
+
+    def _positions(self, key):
+        # double hashing: h1 + i * h2
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def __contains__(self, key):  # noqa
+        array = self.array
+        return all(
+            array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key)
+        )
+
+    def __len__(self):  # noqa
+        return self.count
+
+    def add(self, key):
+        """Add `key`; return False if it (probably) was there already."""
+        array = self.array
+        new = False
+        for pos in self._positions(key):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not array[byte] & bit:
+                array[byte] |= bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def save(self, path=None):
+        """Write the filter to `path` (atomically replacing the old file)."""
+        path = path or self.path
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.HEADER.pack(
+                self.MAGIC, self.bits, self.hashes, self.count))
+            f.write(self.array)
+        os.replace(tmp, path)
+
+
+def rebuild(bloom, data_dir=None, jsonl_paths=()):
+    """
+    Feed `bloom` with every article already written to disk.
+
+    - HTMLFilePipeline 的輸出: <data_dir>/<board>/<year>/<date>_<time>_<id>.html
+    - JsonPipeline 的輸出: .jsonl / .jsonl.gz / .jsonl.zst (留言那幾行沒有文章 id，會被略過)
+    Output: number of articles added
+    """
+    added = 0
+    if data_dir is not None:
+        for path in glob.iglob(os.path.join(data_dir, '*', '*', '*.html')):
+            board = path.split(os.sep)[-3]
+            name = os.path.basename(path)[:-len('.html')]
+            article_id = name.split('_', 2)[-1]
+            if article_key(article_id) is not None:
+                added += bloom.add(article_token(board, article_id))
+    for path in jsonl_paths:
+        with open_lines(path) as f:
+            for line in f:
+                obj = json.loads(line)
+                if 'post_id' in obj or article_key(obj.get('id', '')) is None:
+                    continue
+                added += bloom.add(article_token(obj['board'], obj['id']))
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Rebuild the "already crawled" filter from existing outputs')
+    parser.add_argument('path', help='bloom filter file to (re)create')
+    parser.add_argument('--data-dir', dest='data_dir')
+    parser.add_argument('--jsonl', dest='jsonl', nargs='*', default=[])
+    parser.add_argument('--capacity', type=int, default=10000000)
+    parser.add_argument('--error-rate', dest='error_rate', type=float,
+                        default=0.001)
+    args = parser.parse_args()
+
+    bloom = BloomFilter(args.capacity, args.error_rate, args.path)
+    added = rebuild(bloom, data_dir=args.data_dir, jsonl_paths=args.jsonl)
+    bloom.save()
+    print(f'{added} articles -> {args.path} ({len(bloom.array)} bytes)')
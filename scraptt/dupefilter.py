@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Compact request dupefilter for PTT index / post URLs."""
+import heapq
+import itertools
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+logger = logging.getLogger(__name__)
+
+# 只有這兩種形狀的網址用整數記，其他的 (index.html、帶 query 的...) 交給 RFPDupeFilter
+PTT_URL_RE = re.compile(
+    r'https://www\.ptt\.cc/bbs/([\w\-]{1,30})/'
+    r'(?:index([1-9]\d{0,5})|([MG])\.(\d{10})\.A\.([0-9A-F]{3}))\.html'
+)
+# post key: | board id (17 bits) | timestamp (34) | M/G (1) | hex (12) |
+BOARD_BITS = 17
+POST_BITS = 47
+
+
+def post_key(board_id, kind, timestamp, suffix):
+    """64-bit key of post `kind`.`timestamp`.A.`suffix` on board `board_id`."""
+    return board_id << POST_BITS | timestamp << 13 | (kind == 'G') << 12 | suffix
+
+
+class SortedRuns:
+    """
+    Set of unsigned 64-bit integers kept as sorted runs, LSM style.
+
+    New keys go to a small set; once it holds `buffer_size` keys it is
+    sorted into an immutable run (an `array('Q')`, 8 bytes per key).
+    A new run is merged with the one before it while that one is less
+    than twice its size, so there are O(log n) runs; lookups bisect each.
+
+    With `directory`, runs are written there and memory-mapped instead,
+    leaving it to the page cache how much of them stays in RAM. The files
+    live in a temporary subdirectory removed by `close()`.
+    """
+
+    CHUNK = 64 * 1024   # keys written at a time
+
+    def __init__(self, buffer_size=65536, directory=None):
+        """__init__ method."""
+        self.buffer = set()
+        self.buffer_size = buffer_size
+        self.directory = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.directory = tempfile.mkdtemp(
+                prefix='dupefilter-', dir=directory)
+        self.runs = []      # (keys, path, mmap), oldest (largest) first
+        self.count = 0
+        self._names = itertools.count()
+
+    def __len__(self):  # noqa
+        return self.count
+
+    def __contains__(self, key):  # noqa
+        if key in self.buffer:
+            return True
+        for keys, _, _ in self.runs:
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return True
+        return False
+
+    def add(self, key):
+        """Add `key`; return False if it was there already."""
+        if key in self:
+            return False
+        self.buffer.add(key)
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Turn the buffer into a run and merge runs of similar size."""
+        if not self.buffer:
+            return
+        self.runs.append(self._store(sorted(self.buffer)))
+        self.buffer = set()
+        runs = self.runs
+        while len(runs) > 1 and len(runs[-2][0]) < 2 * len(runs[-1][0]):
+            newer = runs.pop()
+            older = runs.pop()
+            runs.append(self._store(heapq.merge(older[0], newer[0])))
+            self._release(older)
+            self._release(newer)
+
+    @property
+    def nbytes(self):  # noqa
+        return 8 * sum(len(keys) for keys, _, _ in self.runs)
+
+    def _store(self, keys):
+        if self.directory is None:
+            return array('Q', keys), None, None
+        path = os.path.join(self.directory, f'{next(self._names)}.u64')
+        with open(path, 'wb') as f:
+            chunk = array('Q')
+            for key in keys:
+                chunk.append(key)
+                if len(chunk) == self.CHUNK:
+                    chunk.tofile(f)
+                    del chunk[:]
+            chunk.tofile(f)
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast('Q'), path, mapped
+
+    @staticmethod
+    def _release(run):
+        keys, path, mapped = run
+        if mapped is not None:
+            keys.release()
+            mapped.close()
+            os.remove(path)
+
+    def close(self):
+        """Drop every run (and the files of on-disk runs)."""
+        for run in self.runs:
+            self._release(run)
+        self.runs = []
+        self.buffer = set()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class PttDupeFilter(RFPDupeFilter):
+    """
+    `RFPDupeFilter` which remembers PTT pages as integers, not SHA1 hashes.
+
+    `RFPDupeFilter` keeps a 40-character hex fingerprint (well over 100
+    bytes in a set) for every request. PTT pages are identified by their
+    URL alone, so GET requests for
+    - .../<board>/index<n>.html set bit n of a bitmap of the board
+    - .../<board>/M.<timestamp>.A.<hex>.html add a 64-bit `post_key` to
+      `SortedRuns` (about 8 bytes each)
+    Everything else goes through `RFPDupeFilter` unchanged.
+
+    `PTT_DUPEFILTER_DIR` keeps the post runs on disk, memory-mapped;
+    `PTT_DUPEFILTER_BUFFER` is the number of keys kept in memory before
+    they are sorted into a run.
+
+    Like `BoardFairScheduler`, the compact part is not saved to JOBDIR
+    (a resumed crawl would fetch those pages again), so it is not the
+    default: enable it with
+    `-s DUPEFILTER_CLASS=scraptt.dupefilter.PttDupeFilter` for crawls
+    which are not paused and resumed.
+    """
+
+    def __init__(self, path=None, debug=False, directory=None,
+                 buffer_size=65536):
+        """__init__ method."""
+        super().__init__(path, debug)
+        self.board_ids = {}     # board -> id in post keys
+        self.indexes = {}       # board -> bytearray, bit n = index n seen
+        self.posts = SortedRuns(buffer_size, directory)
+        if path:
+            logger.warning(
+                'PttDupeFilter keeps PTT index / post URLs in memory only: '
+                'they are not saved to JOBDIR and are lost on pause')
+
+    @classmethod
+    def from_settings(cls, settings):  # noqa
+        return cls(
+            job_dir(settings),
+            settings.getbool('DUPEFILTER_DEBUG'),
+            settings.get('PTT_DUPEFILTER_DIR'),
+            settings.getint('PTT_DUPEFILTER_BUFFER') or 65536
+        )
+
+    def request_seen(self, request):  # noqa
+        match = None
+        if request.method == 'GET' and not request.body:
+            match = PTT_URL_RE.fullmatch(request.url)
+        if match is None:
+            return super().request_seen(request)
+
+        board, index, kind, timestamp, suffix = match.groups()
+        if index is not None:
+            return self._index_seen(board, int(index))
+        board_id = self.board_ids.setdefault(board, len(self.board_ids))
+        if board_id >= 1 << BOARD_BITS:
+            return super().request_seen(request)
+        key = post_key(board_id, kind, int(timestamp), int(suffix, 16))
+        return not self.posts.add(key)
+
+    def _index_seen(self, board, index):
+        bitmap = self.indexes.get(board)
+        if bitmap is None:
+            bitmap = self.indexes[board] = bytearray()
+        byte, bit = index >> 3, 1 << (index & 7)
+        if byte >= len(bitmap):
+            bitmap.extend(bytes(byte - len(bitmap) + 1))
+        if bitmap[byte] & bit:
+            return True
+        bitmap[byte] |= bit
+        return False
+
+    def close(self, reason):  # noqa
+        logger.info(
+            f'dupefilter: {len(self.posts)} posts '
+            f'({self.posts.nbytes // 1024} KiB in {len(self.posts.runs)} runs), '
+            f'index pages of {len(self.indexes)} boards '
+            f'({sum(map(len, self.indexes.values())) // 1024} KiB), '
+            f'{len(self.fingerprints)} other requests'
+        )
+        self.posts.close()
+        super().close(reason)
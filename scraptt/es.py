@@ -1,7 +1,10 @@
 """Elasticsearch pipeline."""
+import logging
 import os
+import time
 
 from jseg import Jieba
+from elasticsearch.helpers import parallel_bulk
 from elasticsearch_dsl.connections import connections
 from elasticsearch_dsl import (
     Document,
@@ -10,6 +13,10 @@ from elasticsearch_dsl import (
     Date,
 )
 
+from .items import post_document, comment_documents
+
+logger = logging.getLogger(__name__)
+
 j = Jieba()
 
 # define a default connection to ES that can be used globally
@@ -85,3 +92,84 @@ class Mongo2ESDoc(Doc):
         kwargs['content'] = seg_str(kwargs['content'])
         super().__init__(*args, **kwargs)
         self.meta.id = kwargs.pop('id')
+
+
+def item_docs(item):
+    """Yield the `Mongo2ESDoc` of a post and of each of its comments."""
+    post = post_document(item)
+    post.pop('crawled')
+    yield Mongo2ESDoc(post_type=0, **post)
+    for comment in comment_documents(item):
+        comment.pop('crawled')
+        yield Mongo2ESDoc(post_type=1, board=item['board'], **comment)
+
+
+class BulkIndexer:
+    """
+    Index `Doc`s through the bulk API instead of one `save()` per document.
+
+    Documents are turned into bulk actions with `to_dict(include_meta=True)`
+    (same index / id / source as `save()`) and sent by `parallel_bulk`:
+    `chunk_size` actions per request, `thread_count` requests at a time.
+    Documents rejected with 429 (bulk queue full) are sent again after
+    `initial_backoff` seconds, doubling up to `max_backoff`, at most
+    `max_retries` times; anything else that fails is reported, not raised.
+
+    `index` blocks (bulk requests and backoff sleeps): call it from a
+    thread, not the reactor, as `ElasticsearchBulkPipeline` does.
+    """
+
+    def __init__(self, client=None, chunk_size=500, thread_count=4,
+                 max_retries=3, initial_backoff=2, max_backoff=60):
+        """__init__ method."""
+        self.client = client or connections.get_connection()
+        self.chunk_size = chunk_size
+        self.thread_count = thread_count
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.retried = 0
+
+    def index(self, docs):
+        """
+        Index `docs`.
+
+        Output: (number indexed, [{'id', 'status', 'error', 'action'} of
+        every document which failed]) <tuple>; `action` is the bulk action
+        (_index / _type / _id / _source), to index the document again
+        """
+        pending = {}
+        for doc in docs:
+            action = doc.to_dict(include_meta=True)
+            pending[action['_id']] = action
+        indexed = 0
+        failed = []
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retried += len(pending)
+                time.sleep(min(
+                    self.max_backoff, self.initial_backoff * 2 ** (attempt - 1)))
+            rejected = {}
+            results = parallel_bulk(
+                self.client, pending.values(),
+                thread_count=self.thread_count, chunk_size=self.chunk_size,
+                raise_on_error=False, raise_on_exception=False
+            )
+            for ok, result in results:
+                info = next(iter(result.values()))
+                if ok:
+                    indexed += 1
+                elif info.get('status') == 429 and attempt < self.max_retries:
+                    rejected[info['_id']] = pending[info['_id']]
+                else:
+                    failed.append({
+                        'id': info.get('_id'),
+                        'status': info.get('status'),
+                        'error': info.get('error'),
+                        'action': pending.get(info.get('_id')),
+                    })
+            if not rejected:
+                break
+            logger.debug(f'es: {len(rejected)} documents rejected (429), retrying')
+            pending = rejected
+        return indexed, failed
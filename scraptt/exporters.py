@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Compressed JSON lines exports, rotated by size / age, with a manifest."""
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+# 兩個都在 requirements.txt 裡；沒裝的開發環境照樣能跑 (json / gzip)
+try:
+    import orjson
+except ImportError:     # 沒裝 orjson 就用 json，輸出格式一樣 (只是比較慢)
+    orjson = None
+try:
+    import zstandard
+except ImportError:     # 沒裝 zstandard 只能用 gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+DEFAULT_LEVELS = {'zstd': 3, 'gzip': 6}
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """
+    One JSON line (bytes, with the trailing newline).
+
+    orjson if it is installed, json otherwise; either way UTF-8 without
+    escapes, no spaces, and datetimes as ISO 8601 ("2019-12-01T12:34:56").
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(
+        obj, ensure_ascii=False, separators=(',', ':'), default=_default
+    ) + '\n').encode('utf-8')
+
+
+def default_compression():
+    """'zstd' if zstandard is installed, else 'gzip'."""
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def open_lines(path):
+    """Text lines of a JSON lines file, compressed (.zst / .gz) or not."""
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f'zstandard is needed to read {path}')
+        f = open(path, 'rb')
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+class Segment:
+    """One compressed file of a board, written under a .tmp name until closed."""
+
+    BUFFER = 64 * 1024  # bytes of JSON handed to the compressor at a time
+
+    def __init__(self, path, compression, level):
+        """__init__ method."""
+        self.path = path
+        self.compression = compression
+        self.file = open(path + '.tmp', 'wb')
+        if compression == 'zstd':
+            self.stream = zstandard.ZstdCompressor(level=level).stream_writer(
+                self.file)
+        else:
+            self.stream = gzip.GzipFile(
+                fileobj=self.file, mode='wb', compresslevel=level)
+        self.buffer = bytearray()
+        self.records = 0
+        self.bytes = 0
+        self.opened = datetime.now()
+        self.started = time.monotonic()
+
+    def write(self, line):
+        """Append one JSON line (bytes)."""
+        self.buffer += line
+        self.records += 1
+        self.bytes += len(line)
+        if len(self.buffer) >= self.BUFFER:
+            self.stream.write(self.buffer)
+            self.buffer.clear()
+
+    def close(self):
+        """Finish the file and give it its final name; return its manifest entry."""
+        if self.buffer:
+            self.stream.write(self.buffer)
+            self.buffer.clear()
+        if self.compression == 'zstd':
+            self.stream.flush(zstandard.FLUSH_FRAME)
+        else:
+            self.stream.close()
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+        return {
+            'records': self.records,
+            'bytes': self.bytes,
+            'size': os.path.getsize(self.path),
+            'opened': self.opened,
+            'closed': datetime.now(),
+        }
+
+
+class JsonLinesExport:
+    """
+    JSON lines of every board, as compressed segments of one run.
+
+    Records of a board go to <directory>/<board>/<board>-<run>-<n>.jsonl.zst
+    (.gz with gzip); a segment is closed and the next one started once it
+    holds `max_bytes` of JSON, or is `max_seconds` old when a record comes
+    in (0 turns either off). Segments only get their final name when they
+    are closed, and every closed segment is appended to
+    <directory>/manifest-<run>.jsonl (board, path, records, bytes of JSON,
+    size on disk, opened / closed), so nothing is overwritten by the next
+    run and readers never see half-written files.
+
+    `write` may be called from several threads, but the records of one
+    board from one thread at a time.
+    """
+
+    def __init__(self, directory, run, compression=None, level=None,
+                 max_bytes=256 * 1024 * 1024, max_seconds=3600):
+        """__init__ method."""
+        compression = compression or default_compression()
+        if compression not in EXTENSIONS:
+            raise ValueError(f'unknown compression: {compression}')
+        if compression == 'zstd' and zstandard is None:
+            raise RuntimeError('zstd compression needs zstandard installed')
+        self.directory = directory
+        self.run = run
+        self.compression = compression
+        self.level = level or DEFAULT_LEVELS[compression]
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.segments = {}      # board -> open Segment
+        self.counts = {}        # board -> segments started
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, f'manifest-{run}.jsonl')
+        self.manifest_lock = threading.Lock()
+        logger.info(
+            f'JSON lines export to {directory}: {compression} level '
+            f'{self.level}, {"orjson" if orjson is not None else "json (slow)"}')
+
+    def write(self, board, obj):
+        """Append `obj` to the current segment of `board`."""
+        segment = self.segments.get(board)
+        if segment is not None and self._full(segment):
+            self._close(board, segment)
+            segment = None
+        if segment is None:
+            segment = self.segments[board] = self._open(board)
+        segment.write(dumps(obj))
+
+    def _full(self, segment):
+        if self.max_bytes and segment.bytes >= self.max_bytes:
+            return True
+        return bool(
+            self.max_seconds and
+            time.monotonic() - segment.started >= self.max_seconds)
+
+    def _open(self, board):
+        number = self.counts[board] = self.counts.get(board, 0) + 1
+        os.makedirs(os.path.join(self.directory, board), exist_ok=True)
+        name = (
+            f'{board}-{self.run}-{number:05d}.jsonl'
+            f'{EXTENSIONS[self.compression]}')
+        return Segment(
+            os.path.join(self.directory, board, name),
+            self.compression, self.level)
+
+    def _close(self, board, segment):
+        entry = segment.close()
+        entry = dict(
+            run=self.run, board=board,
+            path=os.path.relpath(segment.path, self.directory),
+            compression=self.compression, **entry)
+        with self.manifest_lock:
+            with open(self.manifest_path, 'ab') as f:
+                f.write(dumps(entry))
+        logger.debug(
+            f"{entry['path']}: {entry['records']} records, "
+            f"{entry['bytes']} -> {entry['size']} bytes")
+
+    def close(self):
+        """Close the open segment of every board."""
+        segments, self.segments = self.segments, {}
+        for board, segment in segments.items():
+            self._close(board, segment)
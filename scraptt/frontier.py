@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""Shared crawl frontier: (board, index range) work units leased to workers."""
+import logging
+import os
+import socket
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.misc import load_object
+from twisted.internet import defer, task
+
+from .pool import WriterPool
+
+logger = logging.getLogger(__name__)
+
+WorkUnit = namedtuple('WorkUnit', 'id board index_from index_to')
+
+
+class Frontier(ABC):
+    """
+    Interface of a frontier backend.
+
+    A work unit is an index range of one board, owned by one queue (the
+    spider name). Workers lease units for `ttl` seconds and keep the
+    lease alive with `heartbeat`. A unit whose lease expires (the worker
+    died) can be leased by anyone again.
+
+    Backends may block (network, locks): `FrontierExtension` only calls
+    them through `ThreadedFrontier`, never on the reactor thread.
+    """
+
+    @classmethod
+    @abstractmethod
+    def from_settings(cls, settings):
+        """Create the backend from Scrapy settings."""
+
+    @abstractmethod
+    def seed(self, queue, board, latest, unit_size):
+        """Split index1..`latest` of `board` into units (idempotent)."""
+
+    @abstractmethod
+    def lease(self, queue, worker, count, ttl):
+        """Lease up to `count` units, return a list of `WorkUnit`."""
+
+    @abstractmethod
+    def heartbeat(self, worker, ttl):
+        """Extend every lease held by `worker`."""
+
+    @abstractmethod
+    def complete(self, worker, unit_ids):
+        """Mark units still leased by `worker` as done."""
+
+    @abstractmethod
+    def release(self, worker):
+        """Give back the unfinished leases of `worker`."""
+
+    def close(self):
+        """Release resources."""
+
+
+class SQLiteFrontier(Frontier):
+    """
+    Frontier in a single SQLite file.
+
+    Stand-in backend: every node must see the same file (一台機器上多個
+    scrapyd，或共用的檔案系統)。
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS units (
+            id INTEGER PRIMARY KEY,
+            queue TEXT NOT NULL,
+            board TEXT NOT NULL,
+            index_from INTEGER NOT NULL,
+            index_to INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (queue, board, index_from)
+        );
+    '''
+
+    def __init__(self, path):
+        """__init__ method."""
+        # autocommit; lease() opens its own write transaction
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.executescript(self.schema)
+
+    @classmethod
+    def from_settings(cls, settings):  # noqa
+        return cls(settings.get('FRONTIER_DB'))
+
+    def seed(self, queue, board, latest, unit_size):  # noqa
+        # units are aligned on `unit_size`; only the tail unit can grow,
+        # and a grown tail unit goes back to pending (a worker still
+        # holding it cannot complete it any more, see `complete`)
+        rows = [
+            (queue, board, start, min(start + unit_size - 1, latest))
+            for start in range(1, latest + 1, unit_size)
+        ]
+        self.conn.executemany(
+            '''
+            INSERT INTO units (queue, board, index_from, index_to)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (queue, board, index_from) DO UPDATE SET
+                index_to = excluded.index_to,
+                state = 'pending', worker = NULL, expires = NULL
+            WHERE excluded.index_to > units.index_to
+            ''',
+            rows
+        )
+
+    def lease(self, queue, worker, count, ttl):  # noqa
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self.conn.execute(
+                '''
+                SELECT id, board, index_from, index_to FROM units
+                WHERE queue = ? AND (
+                    state = 'pending' OR (state = 'leased' AND expires < ?)
+                )
+                ORDER BY attempts, id
+                LIMIT ?
+                ''',
+                (queue, now, count)
+            ).fetchall()
+            self.conn.executemany(
+                '''
+                UPDATE units
+                SET state = 'leased', worker = ?, expires = ?,
+                    attempts = attempts + 1
+                WHERE id = ?
+                ''',
+                [(worker, now + ttl, row[0]) for row in rows]
+            )
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return [WorkUnit(*row) for row in rows]
+
+    def heartbeat(self, worker, ttl):  # noqa
+        self.conn.execute(
+            "UPDATE units SET expires = ? WHERE worker = ? AND state = 'leased'",
+            (time.time() + ttl, worker)
+        )
+
+    def complete(self, worker, unit_ids):  # noqa
+        self.conn.executemany(
+            '''
+            UPDATE units SET state = 'done', worker = NULL, expires = NULL
+            WHERE id = ? AND worker = ? AND state = 'leased'
+            ''',
+            [(unit_id, worker) for unit_id in unit_ids]
+        )
+
+    def release(self, worker):  # noqa
+        self.conn.execute(
+            '''
+            UPDATE units SET state = 'pending', worker = NULL, expires = NULL
+            WHERE worker = ? AND state = 'leased'
+            ''',
+            (worker,)
+        )
+
+    def close(self):  # noqa
+        self.conn.close()
+
+
+class ThreadedFrontier:
+    """
+    A `Frontier` backend run in its own thread; every method returns a Deferred.
+
+    The backend is created by `frontier_cls.from_settings(settings)` on
+    the first call, in that thread, and all calls run there one at a
+    time, in order (a `WriterPool` with one thread). A locked database
+    then holds up the frontier, not the reactor.
+    """
+
+    def __init__(self, frontier_cls, settings):
+        """__init__ method."""
+        self.frontier_cls = frontier_cls
+        self.settings = settings
+        self.backend = None
+        self.pool = WriterPool(1, 1)
+
+    def _run(self, name, *args):
+        if self.backend is None:
+            self.backend = self.frontier_cls.from_settings(self.settings)
+        return getattr(self.backend, name)(*args)
+
+    def _call(self, name, *args):
+        return self.pool.run(None, self._run, name, *args)
+
+    def seed(self, queue, board, latest, unit_size):
+        """Deferred of `Frontier.seed`."""
+        return self._call('seed', queue, board, latest, unit_size)
+
+    def lease(self, queue, worker, count, ttl):
+        """Deferred of `Frontier.lease`."""
+        return self._call('lease', queue, worker, count, ttl)
+
+    def heartbeat(self, worker, ttl):
+        """Deferred of `Frontier.heartbeat`."""
+        return self._call('heartbeat', worker, ttl)
+
+    def complete(self, worker, unit_ids):
+        """Deferred of `Frontier.complete`."""
+        return self._call('complete', worker, unit_ids)
+
+    def release(self, worker):
+        """Deferred of `Frontier.release`."""
+        return self._call('release', worker)
+
+    @defer.inlineCallbacks
+    def close(self):
+        """Close the backend (after the calls so far) and stop the thread."""
+        try:
+            if self.backend is not None:
+                yield self._call('close')
+        finally:
+            self.pool.close()
+
+
+class FrontierExtension:
+    """
+    Feed spiders with work units from the shared frontier.
+
+    Active for spiders with `use_frontier = True`. The backend, wrapped in
+    a `ThreadedFrontier`, is exposed as `spider.frontier` (for seeding;
+    its methods return Deferreds). Whenever the spider runs out of
+    requests, the units it was working on are completed and the next
+    `FRONTIER_LEASE_BATCH` units are leased, in the frontier thread; the
+    spider is kept open meanwhile and closes once a lease comes back
+    empty. `spider.frontier_requests(unit)` turns each unit into requests.
+    Leases are kept alive by a heartbeat; on an unclean shutdown they are
+    given back.
+    """
+
+    def __init__(self, crawler):  # noqa
+        self.crawler = crawler
+        self.settings = crawler.settings
+        self.frontier = None
+        self.units = []
+        self.leasing = None     # Deferred of the lease in progress
+        self.exhausted = False  # the last lease found no work
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):  # noqa
+        if not getattr(spider, 'use_frontier', False):
+            return
+        frontier_cls = load_object(self.settings.get('FRONTIER_CLASS'))
+        self.frontier = ThreadedFrontier(frontier_cls, self.settings)
+        self.ttl = self.settings.getfloat('FRONTIER_LEASE_TTL')
+        spider.frontier = self.frontier
+        self.heartbeat = task.LoopingCall(self._heartbeat)
+        self.heartbeat.start(self.ttl / 3, now=False)
+        logger.info(f'frontier worker {self.worker}')
+
+    def _heartbeat(self):
+        dfd = self.frontier.heartbeat(self.worker, self.ttl)
+        # 一次失敗不要讓 LoopingCall 停下來，下一次再試
+        dfd.addErrback(
+            lambda failure: logger.error(f'frontier heartbeat: {failure.value}'))
+        return dfd
+
+    def spider_idle(self, spider):  # noqa
+        if self.frontier is None:
+            return
+        if self.leasing is None:
+            if self.exhausted:
+                return
+            self.leasing = self._next_units(spider)
+            self.leasing.addBoth(self._leased)
+        raise DontCloseSpider
+
+    def _leased(self, _):
+        self.leasing = None
+
+    @defer.inlineCallbacks
+    def _next_units(self, spider):
+        try:
+            if self.units:
+                yield self.frontier.complete(
+                    self.worker, [unit.id for unit in self.units])
+                self.crawler.stats.inc_value(
+                    'frontier/completed', len(self.units), spider=spider)
+                self.units = []
+            self.units = yield self.frontier.lease(
+                spider.name, self.worker,
+                self.settings.getint('FRONTIER_LEASE_BATCH'), self.ttl
+            )
+        except Exception as e:
+            # 例如資料庫被鎖住太久；下一次 spider_idle 再試
+            logger.error(f'frontier lease failed: {e}')
+            return
+        if not self.units:
+            self.exhausted = True
+            return
+        self.crawler.stats.inc_value(
+            'frontier/leased', len(self.units), spider=spider)
+        for unit in self.units:
+            logger.info(
+                f'lease {unit.board} index{unit.index_from}-{unit.index_to}')
+            for request in spider.frontier_requests(unit):
+                self.crawler.engine.crawl(request, spider)
+
+    @defer.inlineCallbacks
+    def spider_closed(self, spider, reason):  # noqa
+        if self.frontier is None:
+            return
+        if self.heartbeat.running:
+            self.heartbeat.stop()
+        if self.leasing is not None:
+            yield self.leasing
+        try:
+            # 正常結束時 self.units 已在 spider_idle 完成；其他情況交還給別的 worker
+            yield self.frontier.release(self.worker)
+        finally:
+            yield self.frontier.close()
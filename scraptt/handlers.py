@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Download handler that records responses to, or replays them from, an archive."""
+import json
+import logging
+import zlib
+
+from scrapy.core.downloader.handlers.http import HTTPDownloadHandler
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.request import request_fingerprint
+from twisted.internet import defer
+
+from .store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseArchive(SQLiteStore):
+    """Responses keyed by request fingerprint, bodies zlib-compressed."""
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS responses (
+            fingerprint TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            headers TEXT NOT NULL,
+            body BLOB NOT NULL
+        );
+    '''
+    commit_every = 100
+
+    def __init__(self, path):
+        """__init__ method."""
+        super().__init__(path)
+        self._uncommitted = 0
+
+    def put(self, fingerprint, response):
+        """Store `response` under `fingerprint`."""
+        headers = {
+            key.decode('latin-1'): [v.decode('latin-1') for v in values]
+            for key, values in response.headers.items()
+        }
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses '
+            '(fingerprint, url, status, headers, body) VALUES (?, ?, ?, ?, ?)',
+            (fingerprint, response.url, response.status,
+             json.dumps(headers), zlib.compress(response.body))
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def get(self, fingerprint):
+        """Rebuild the stored response, None if it was never recorded."""
+        row = self.conn.execute(
+            'SELECT url, status, headers, body FROM responses '
+            'WHERE fingerprint = ?',
+            (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body = row
+        headers = Headers(json.loads(headers))
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(
+            url=url, status=status, headers=headers, body=body,
+            flags=['replayed']
+        )
+
+
+class ArchiveDownloadHandler:
+    """
+    HTTP(S) download handler with a record / replay switch.
+
+    - `ARCHIVE_MODE = None`: plain HTTP download
+    - `ARCHIVE_MODE = 'record'`: download, and store every response
+      (URL, status, headers, body) in `ARCHIVE_PATH`
+    - `ARCHIVE_MODE = 'replay'`: serve every request from `ARCHIVE_PATH`
+      without touching the network; unrecorded requests are ignored
+
+    Replay is meant for benchmarking parse_index / parse_post and the
+    pipelines and for re-processing old captures. Turn off the politeness
+    settings for it, e.g. `-s DOWNLOAD_DELAY=0 -s ADAPTIVE_THROTTLE_ENABLED=0`.
+
+    Scrapy creates one handler per scheme (http and https); they share one
+    `ResponseArchive` per file, so only one connection ever writes to it.
+    """
+
+    # ARCHIVE_PATH -> [ResponseArchive, number of handlers using it]
+    # 各自的連線會各自拿著寫入 transaction (commit_every)，互相 "database is locked"
+    archives = {}
+
+    def __init__(self, settings):  # noqa
+        self.mode = settings.get('ARCHIVE_MODE')
+        if self.mode not in (None, 'record', 'replay'):
+            raise ValueError(f'unknown ARCHIVE_MODE: {self.mode}')
+        self.http = None if self.mode == 'replay' else HTTPDownloadHandler(settings)
+        self.path = settings.get('ARCHIVE_PATH')
+        self.archive = (
+            self._open_archive(self.path) if self.mode is not None else None
+        )
+
+    @classmethod
+    def _open_archive(cls, path):
+        if path not in cls.archives:
+            cls.archives[path] = [ResponseArchive(path), 0]
+        cls.archives[path][1] += 1
+        return cls.archives[path][0]
+
+    @classmethod
+    def _close_archive(cls, path):
+        cls.archives[path][1] -= 1
+        if not cls.archives[path][1]:
+            cls.archives.pop(path)[0].close()
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        return cls(crawler.settings)
+
+    def download_request(self, request, spider):  # noqa
+        if self.mode == 'replay':
+            response = self.archive.get(request_fingerprint(request))
+            if response is None:
+                logger.warning(f'not in archive: {request.url}')
+                return defer.fail(IgnoreRequest(f'not in archive: {request.url}'))
+            return defer.succeed(response)
+
+        dfd = self.http.download_request(request, spider)
+        if self.mode == 'record':
+            dfd.addCallback(self._record, request)
+        return dfd
+
+    def _record(self, response, request):
+        self.archive.put(request_fingerprint(request), response)
+        return response
+
+    def close(self):  # noqa
+        if self.archive is not None:
+            self._close_archive(self.path)
+            self.archive = None
+        if self.http is not None:
+            return self.http.close()
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""PTT board names and article ids, from URLs."""
+import re
+
+BOARD_RE = re.compile(r'www\.ptt\.cc/bbs/([\w\d\-_]{1,30})/')
+TIMESTAMP_RE = re.compile(r'\.(\d{10})\.')
+ARTICLE_RE = re.compile(r'([MG])\.(\d{10})\.A\.([0-9A-Fa-f]{1,8})')
+
+
+def board_from_url(url):
+    """抽取 URL 中的版名，找不到時回傳 None。"""
+    match = BOARD_RE.search(url)
+    return match.group(1) if match else None
+
+
+def topic_timestamp(href):
+    """po文連結中的 10 位數 timestamp，例如 M.1575882922.A.5A4.html。"""
+    match = TIMESTAMP_RE.search(href)
+    return int(match.group(1)) if match else None
+
+
+def article_id_from_url(url):
+    """文章 id，例如 .../M.1575882922.A.5A4.html -> M.1575882922.A.5A4。"""
+    return url.split('/')[-1].split('.html')[0]
+
+
+def article_key(article_id):
+    """
+    Sortable key of an article id (newer articles sort higher).
+
+    Input: "M.1575882922.A.5A4"
+    Output: (1575882922, 0x5A4), None if it is not an article id
+    """
+    match = ARTICLE_RE.search(article_id)
+    if match is None:
+        return None
+    return int(match.group(2)), int(match.group(3), 16)
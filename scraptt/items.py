@@ -1,8 +1,17 @@
 # -*- coding: utf-8 -*-
 """Scrapy scraped items."""
+from hashlib import sha256
+
 import scrapy
 
 
+def serialize_comments(comments):
+    """Exporters get `PostItem.comments` as a list of dicts."""
+    if hasattr(comments, 'as_dicts'):
+        return comments.as_dicts()
+    return comments
+
+
 class PostItem(scrapy.Item):
     """Item for "POST"."""
 
@@ -14,9 +23,19 @@ class PostItem(scrapy.Item):
     content = scrapy.Field()
     ip = scrapy.Field()
     quote = scrapy.Field()
-    comments = scrapy.Field()
+    comments = scrapy.Field(serializer=serialize_comments)
     count = scrapy.Field()
 
+    def __init__(self, *args, segments=None, **kwargs):
+        """`segments` is kept as an attribute, not a field, so it is not exported."""
+        super().__init__(*args, **kwargs)
+        self._segments = segments
+
+    @property
+    def segments(self):
+        """`Segments` of the post text (None if not known), see parsers.segment."""
+        return self._segments
+
 
 class MetaItem(scrapy.Item):
     """Item for "META"."""
@@ -30,6 +49,64 @@ class MetaItem(scrapy.Item):
 class _ArticleItem(scrapy.Item):
     """Item for "META"."""
     board = scrapy.Field()
-    html_content = scrapy.Field()
+    html_body = scrapy.Field()      # 下載下來的原始 bytes，不 decode
     timestamp = scrapy.Field()
-    article_id = scrapy.Field()
\ No newline at end of file
+    article_id = scrapy.Field()
+
+
+def post_document(item):
+    """The record of a post as stored in JSON lines / MongoDB / ES."""
+    return {
+        "id": item['id'],
+        "board": item['board'],
+        "author": item['author'],
+        "published": item['time']['published'],
+        "crawled": item['time']['crawled'],
+        "title": item['title'],
+        "ip": item['ip'],
+        "content": item['content'],
+        "upvote": item['count']['推'],
+        "novote": item['count']['→'],
+        "downvote": item['count']['噓'],
+    }
+
+
+def comment_id(post_id, author, published):
+    """Stable id of a comment: post id + author + publish time, hashed."""
+    return sha256(
+        f"{post_id}{author}{published}".encode('utf-8')
+    ).hexdigest()[:16]
+
+
+def comment_documents(item):
+    """
+    Yield the record of every comment of a post.
+
+    `item['comments']` is a `CommentList` (or, from older code, a list of
+    dicts); the rows are read straight from it.
+    """
+    comments = item['comments']
+    post_id = item['id']
+    if hasattr(comments, 'as_dicts'):
+        crawled = comments.crawled
+        rows = (
+            (c.type, c.author, c.content, c.published, crawled, c.ip)
+            for c in comments
+        )
+    else:
+        rows = (
+            (c['type'], c['author'], c['content'], c['time']['published'],
+             c['time']['crawled'], c['ip'])
+            for c in comments
+        )
+    for type_, author, content, published, crawled, ip in rows:
+        yield {
+            "id": comment_id(post_id, author, published),
+            "type": type_,
+            "author": author,
+            "published": published,
+            "crawled": crawled,
+            "ip": ip,
+            "content": content,
+            "post_id": post_id,
+        }
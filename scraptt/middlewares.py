@@ -1,12 +1,223 @@
 # -*- coding: utf-8 -*-
 """Middlewares."""
+from collections import defaultdict
+from hashlib import sha1
+
 from pyquery import PyQuery
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse
+
+from .ids import article_id_from_url, article_key
+from .spiders.parsers.index import page_tree
+from .store import FingerprintStore
+
+
+class PttResponse(HtmlResponse):
+    """`HtmlResponse` whose DOM is only built on first access.
+
+    - `response.etree`: bare lxml root, links already made absolute
+    - `response.dom`: PyQuery wrapper around the very same tree
+    """
+
+    _etree = None
+    _dom = None
+
+    @property
+    def etree(self):
+        """lxml root element, for callbacks that do not need PyQuery."""
+        if self._etree is None:
+            self._etree = page_tree(self.text)
+        return self._etree
+
+    @property
+    def dom(self):
+        """PyQuery object of the page."""
+        if self._dom is None:
+            self._dom = PyQuery(self.etree)
+        return self._dom
 
 
 class PyqueryMiddleware:
-    """Inject pyquery object into Scrapy `response`."""
+    """Inject pyquery object into Scrapy `response`.
+
+    The tree is built lazily (see `PttResponse`), so callbacks which only
+    read `response.body` never pay for parsing. A spider can opt out
+    entirely with `build_dom = False`, a single request with
+    `meta={'dom': False}`; the downloader response is then passed through.
+    """
+
+    def process_response(self, request, response, spider):  # noqa
+        if not isinstance(response, HtmlResponse):
+            return response
+        if not request.meta.get('dom', getattr(spider, 'build_dom', True)):
+            return response
+        return response.replace(cls=PttResponse)
+
+
+class PostFingerprintMiddleware:
+    """Drop post responses which did not change since the last crawl.
+
+    Every post URL gets its ETag / Last-Modified and a hash of its body
+    remembered in `POST_FINGERPRINT_DB`. Later requests for the same post
+    are sent as conditional requests; a 304, or a 200 whose body hash is
+    unchanged, is dropped here so neither `parse_post` nor the pipelines
+    ever see it. Enable with `POST_FINGERPRINT_ENABLED`.
+    """
+
+    def __init__(self, store, stats):  # noqa
+        self.store = store
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        if not crawler.settings.getbool('POST_FINGERPRINT_ENABLED'):
+            raise NotConfigured
+        middleware = cls(
+            FingerprintStore.from_settings(
+                crawler.settings, 'POST_FINGERPRINT_DB'),
+            crawler.stats
+        )
+        crawler.signals.connect(
+            middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    @staticmethod
+    def is_post(url):  # noqa
+        return article_key(article_id_from_url(url)) is not None
+
+    def process_request(self, request, spider):  # noqa
+        if not self.is_post(request.url):
+            return None
+        etag, last_modified, body_hash = self.store.get(request.url)
+        request.meta['body_hash'] = body_hash
+        if etag:
+            request.headers.setdefault('If-None-Match', etag)
+        if last_modified:
+            request.headers.setdefault('If-Modified-Since', last_modified)
+        return None
 
     def process_response(self, request, response, spider):  # noqa
-        response.dom = PyQuery(response.text).make_links_absolute(
-                'https://www.ptt.cc/bbs/')
+        if 'body_hash' not in request.meta:
+            return response
+        if response.status == 304:
+            self.stats.inc_value('fingerprint/not_modified', spider=spider)
+            raise IgnoreRequest(f'not modified: {request.url}')
+        if response.status != 200:
+            return response
+
+        body_hash = sha1(response.body).hexdigest()
+        self.store.put(
+            request.url,
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+            body_hash
+        )
+        if body_hash == request.meta['body_hash']:
+            self.stats.inc_value('fingerprint/unchanged', spider=spider)
+            raise IgnoreRequest(f'unchanged: {request.url}')
+        self.stats.inc_value('fingerprint/changed', spider=spider)
         return response
+
+    def spider_closed(self, spider, reason):  # noqa
+        # 中斷的 crawl 不保留 validators，下次會重新抓那些po文
+        self.store.close(commit=reason == 'finished')
+
+
+class AdaptiveThrottleMiddleware:
+    """AIMD control of the download delay and in-flight limit per slot.
+
+    Every `ADAPTIVE_THROTTLE_WINDOW` responses of a downloader slot, the
+    latency percentiles and the error rate (`RETRY_HTTP_CODES` and
+    download exceptions) of that window are checked:
+
+    - congested (p90 over the target latency, or too many errors):
+      multiplicative decrease, i.e. halve the concurrency and double the delay
+    - healthy: additive increase, i.e. shorten the delay by one step and,
+      once it is at its minimum, allow one more request in flight
+
+    `DOWNLOAD_DELAY` is the starting point and, unless
+    `ADAPTIVE_THROTTLE_MIN_DELAY` is set, also the floor: the delay never
+    drops below the configured courtesy delay, a healthy site gets more
+    concurrency instead. The current state is kept in the
+    `adaptive_throttle/*` crawl stats.
+    """
+
+    def __init__(self, crawler):  # noqa
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.window = settings.getint('ADAPTIVE_THROTTLE_WINDOW')
+        self.target_latency = settings.getfloat(
+            'ADAPTIVE_THROTTLE_TARGET_LATENCY')
+        self.max_error_rate = settings.getfloat(
+            'ADAPTIVE_THROTTLE_MAX_ERROR_RATE')
+        min_delay = settings.get('ADAPTIVE_THROTTLE_MIN_DELAY')
+        self.min_delay = (
+            float(min_delay) if min_delay is not None
+            else settings.getfloat('DOWNLOAD_DELAY'))
+        self.max_delay = settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY')
+        self.delay_step = settings.getfloat('ADAPTIVE_THROTTLE_DELAY_STEP')
+        self.max_concurrency = settings.getint('CONCURRENT_REQUESTS')
+        self.error_codes = set(
+            int(code) for code in settings.getlist('RETRY_HTTP_CODES'))
+        self.samples = defaultdict(list)
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):  # noqa
+        self._record(
+            request, spider,
+            request.meta.get('download_latency'),
+            response.status in self.error_codes
+        )
+        return response
+
+    def process_exception(self, request, exception, spider):  # noqa
+        self._record(request, spider, None, True)
+
+    def _record(self, request, spider, latency, error):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        samples = self.samples[key]
+        samples.append((latency, error))
+        if len(samples) >= self.window:
+            self._adjust(slot, samples, spider)
+            del samples[:]
+
+    def _adjust(self, slot, samples, spider):
+        latencies = sorted(lat for lat, _ in samples if lat is not None)
+        error_rate = sum(err for _, err in samples) / len(samples)
+        p50 = latencies[len(latencies) // 2] if latencies else None
+        p90 = latencies[int(len(latencies) * 0.9)] if latencies else None
+
+        if error_rate > self.max_error_rate or (
+                p90 is not None and p90 > self.target_latency):
+            slot.concurrency = max(1, slot.concurrency // 2)
+            slot.delay = min(self.max_delay, max(
+                slot.delay * 2, self.delay_step, self.min_delay))
+            self.stats.inc_value('adaptive_throttle/decrease', spider=spider)
+        elif slot.delay > self.min_delay:
+            # 取整，不然 0.4 - 3 * 0.1 永遠比 0.1 大一點點
+            slot.delay = max(
+                self.min_delay, round(slot.delay - self.delay_step, 6))
+            self.stats.inc_value('adaptive_throttle/increase', spider=spider)
+        elif slot.concurrency < self.max_concurrency:
+            slot.concurrency += 1
+            self.stats.inc_value('adaptive_throttle/increase', spider=spider)
+
+        for name, value in (
+            ('concurrency', slot.concurrency),
+            ('delay', round(slot.delay, 3)),
+            ('latency_p50', p50),
+            ('latency_p90', p90),
+            ('error_rate', round(error_rate, 3)),
+        ):
+            self.stats.set_value(
+                f'adaptive_throttle/{name}', value, spider=spider)
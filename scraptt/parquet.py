@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Parquet datasets of posts and comments, partitioned by board and year."""
+import logging
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# 欄位跟 items.post_document / comment_documents 一樣；board 在路徑裡 (board=<board>)
+POST_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('author', pa.string()),
+    ('published', pa.timestamp('us')),
+    ('crawled', pa.timestamp('us')),
+    ('title', pa.string()),
+    ('ip', pa.string()),
+    ('content', pa.string()),
+    ('upvote', pa.int32()),
+    ('novote', pa.int32()),
+    ('downvote', pa.int32()),
+])
+COMMENT_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('type', pa.string()),
+    ('author', pa.string()),
+    ('published', pa.timestamp('us')),
+    ('crawled', pa.timestamp('us')),
+    ('ip', pa.string()),
+    ('content', pa.string()),
+    ('post_id', pa.string()),
+])
+# Hive 的慣例: 沒有值的 partition (沒有發文時間)
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+class Partition:
+    """
+    Rows of one board / year, column by column, and the file they go to.
+
+    The rows are written to <directory>/<run>-<n>.parquet, one row group
+    per `flush`; after `row_groups` row groups the file is closed (footer
+    written, .tmp name dropped) and the next flush starts file n + 1.
+    """
+
+    def __init__(self, directory, run, schema, compression, row_groups,
+                 files=0):
+        """__init__ method."""
+        self.directory = directory
+        self.run = run
+        self.schema = schema
+        self.compression = compression
+        self.max_row_groups = row_groups
+        self.columns = {name: [] for name in schema.names}
+        self.rows = 0
+        self.files = files      # opened so far, the next one is files + 1
+        self.row_groups = 0     # in the open file
+        self.path = None
+        self.writer = None
+        self.started = None     # monotonic time of the first row not in a closed file
+
+    @property
+    def idle(self):
+        """True if nothing is buffered and no file is open."""
+        return not self.rows and self.writer is None
+
+    def append(self, row):
+        """Buffer one row (a dict with every column of the schema)."""
+        if self.started is None:
+            self.started = time.monotonic()
+        for name, column in self.columns.items():
+            column.append(row[name])
+        self.rows += 1
+
+    def flush(self):
+        """Write the buffered rows as one record batch (row group)."""
+        if not self.rows:
+            return
+        batch = pa.RecordBatch.from_arrays(
+            [
+                pa.array(self.columns[field.name], type=field.type)
+                for field in self.schema
+            ],
+            schema=self.schema
+        )
+        if self.writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.files += 1
+            self.path = os.path.join(
+                self.directory, f'{self.run}-{self.files:05d}.parquet')
+            self.writer = pq.ParquetWriter(
+                self.path + '.tmp', self.schema, compression=self.compression)
+        self.writer.write_batch(batch)
+        for column in self.columns.values():
+            column.clear()
+        self.rows = 0
+        self.row_groups += 1
+        if self.row_groups >= self.max_row_groups:
+            self.roll()
+
+    def roll(self):
+        """Close the open file and give it its final name."""
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.path + '.tmp', self.path)
+            self.writer = None
+            self.row_groups = 0
+        self.started = time.monotonic() if self.rows else None
+
+    def close(self):
+        """Write what is left and close the file."""
+        self.flush()
+        self.roll()
+
+
+class PartitionedDataset:
+    """
+    One table (`schema`) as a Parquet dataset partitioned by board and year.
+
+    Rows go to <directory>/board=<board>/year=<year>/<run>-<n>.parquet
+    (Hive layout, so `pyarrow.dataset.dataset(directory, partitioning='hive')`,
+    Spark or DuckDB read board and year back from the path). The year is
+    the year of `published`. Rows are buffered per partition and written
+    as a record batch, i.e. one row group, once `batch_size` of them are
+    waiting. A file is closed, and readable, after `row_groups` row
+    groups, or by `expire()` once its first row is `max_seconds` old (0
+    turns either off), so a killed crawl loses at most that much. When more than `max_rows`
+    rows are buffered in all partitions together, the largest partitions
+    are written out early.
+
+    Not thread-safe: use it from one thread.
+    """
+
+    def __init__(self, directory, schema, run, batch_size=5000,
+                 compression='zstd', row_groups=20, max_rows=200000,
+                 max_seconds=600):
+        """__init__ method."""
+        self.directory = directory
+        self.schema = schema
+        self.run = run
+        self.batch_size = batch_size
+        self.compression = compression
+        self.row_groups = row_groups
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.partitions = {}    # (board, year) -> Partition
+        self.files = {}         # (board, year) -> files of expired partitions
+        self.rows = 0           # buffered in every partition
+
+    def append(self, board, row):
+        """Add `row` (a dict; extra keys such as 'board' are ignored)."""
+        published = row['published']
+        year = published.year if published is not None else None
+        partition = self.partitions.get((board, year))
+        if partition is None:
+            directory = os.path.join(
+                self.directory, f'board={board}',
+                f'year={NULL_PARTITION if year is None else year}')
+            partition = self.partitions[board, year] = Partition(
+                directory, self.run, self.schema, self.compression,
+                self.row_groups, self.files.get((board, year), 0))
+        partition.append(row)
+        self.rows += 1
+        if partition.rows >= self.batch_size:
+            self._flush(partition)
+        if self.max_rows and self.rows > self.max_rows:
+            # 最大的幾個先寫出去，降到上限的一半
+            for partition in sorted(
+                    self.partitions.values(), key=lambda p: -p.rows):
+                if self.rows <= self.max_rows // 2:
+                    break
+                self._flush(partition)
+
+    def _flush(self, partition):
+        rows = partition.rows
+        partition.flush()
+        self.rows -= rows
+        logger.debug(f'{partition.directory}: {rows} rows written')
+
+    def expire(self):
+        """Close the files whose first row is older than `max_seconds`."""
+        now = time.monotonic()
+        for key, partition in list(self.partitions.items()):
+            if (self.max_seconds and partition.started is not None and
+                    now - partition.started >= self.max_seconds):
+                self._flush(partition)
+                partition.roll()
+            if partition.idle:
+                # 舊的年份通常不會再有新的列，不用一直留著
+                self.files[key] = partition.files
+                del self.partitions[key]
+
+    def close(self):
+        """Write every partition and close its file."""
+        partitions, self.partitions = self.partitions, {}
+        for partition in partitions.values():
+            partition.close()
+        self.rows = 0
@@ -1,13 +1,20 @@
 """Scrapy pipeilnes."""
-from hashlib import sha256
 import logging
 import os
 
 import pymongo
 import urllib
+import time
 
 from datetime import datetime
+from pymongo.errors import BulkWriteError, PyMongoError
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet import defer, reactor, task
 # from .es import Mongo2ESDoc
+from .bloom import BloomFilter, article_token
+from .exporters import JsonLinesExport, dumps
+from .items import post_document, comment_documents
+from .pool import WriterPool
 logger = logging.getLogger(__name__)
 
 from scrapy.exporters import JsonLinesItemExporter
@@ -210,105 +217,484 @@ class MetaExportPipeline(object):
 #                 f.write(item['html_content'])
 #         return item 
 
-class HTMLFilePipeline:
+class AsyncWriterPipeline:
+    """
+    Base of pipelines which write in worker threads, not the reactor thread.
+
+    `write(item, spider)` runs in one of `ASYNC_WRITER_THREADS` threads
+    (`threads` for subclasses which need a fixed number); items with the
+    same `key(item)` are written by the same thread, in order.
+    `process_item` returns a Deferred which fires with the item once
+    `write` returned, or fails with what `write` raised (DropItem to drop
+    the item quietly): later pipelines only see items which were written.
+
+    At most `ASYNC_WRITER_QUEUE` writes are queued or running. Past that
+    the write waits, the item stays in Scrapy's scraper slot, and once
+    the slot is full (`SCRAPER_SLOT_MAX_ACTIVE_SIZE`) the engine stops
+    downloading until the storage catches up: the reactor never blocks on
+    the disk, and a slow disk slows the crawl down instead of piling
+    items up in memory.
+
+    Subclasses implement `write` and may override `open(spider)` (reactor
+    thread, before any write) and `close(spider)` (a worker thread, after
+    every write). `call(func, *args)` runs anything else, e.g. a periodic
+    flush, in the writer thread of key None. Code in the writer threads
+    records stats with `inc_stat` / `max_stat`, which hand them to the
+    reactor thread. Stats, per pipeline class: `writer/<class>/waits`
+    (items which waited for room in the queue), `writer/<class>/queued_max`
+    and `writer/<class>/errors`.
+    """
+
+    threads = None
+
+    def open_spider(self, spider):
+        settings = spider.settings
+        self.stats = spider.crawler.stats
+        self.stats_prefix = f'writer/{type(self).__name__}'
+        self.pool = WriterPool(
+            self.threads or settings.getint('ASYNC_WRITER_THREADS') or 1,
+            settings.getint('ASYNC_WRITER_QUEUE') or 100,
+        )
+        self.spider = spider
+        self.open(spider)
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        yield self.pool.drain()
+        try:
+            yield self.pool.run(None, self.close, spider)
+        finally:
+            self.pool.close()
+
     def process_item(self, item, spider):
+        if self.pool.full:
+            self.stats.inc_value(f'{self.stats_prefix}/waits', spider=spider)
+        dfd = self.pool.put(self.key(item), self.write, item, spider)
+        self.stats.max_value(
+            f'{self.stats_prefix}/queued_max', self.pool.queued, spider=spider)
+        dfd.addCallbacks(lambda _: item, self._failed)
+        return dfd
+
+    def _failed(self, failure):
+        # Scrapy 會記下這個錯誤 (DropItem 記成 dropped)，item 不會再往後傳
+        self.stats.inc_value(f'{self.stats_prefix}/errors', spider=self.spider)
+        return failure
+
+    def inc_stat(self, key, count=1):
+        """`stats.inc_value` from a writer thread."""
+        reactor.callFromThread(
+            self.stats.inc_value, key, count, spider=self.spider)
+
+    def max_stat(self, key, value):
+        """`stats.max_value` from a writer thread."""
+        reactor.callFromThread(
+            self.stats.max_value, key, value, spider=self.spider)
+
+    def call(self, func, *args):
+        """Deferred of `func(*args)` run in a writer thread."""
+        return self.pool.run(None, func, *args)
+
+    def key(self, item):
+        """Items with the same key are written by the same thread."""
+        return None
+
+    def open(self, spider):
+        """Set up, in the reactor thread."""
+
+    def write(self, item, spider):
+        """Write `item`, in a writer thread."""
+        raise NotImplementedError
+
+    def close(self, spider):
+        """Clean up, in a writer thread, once every item is written."""
+
+
+class HTMLFilePipeline(AsyncWriterPipeline):
+    """
+    Write the raw page of every `_ArticleItem` to
+    data/<board>/<year>/<date>_<time>_<id>.html.
+
+    `html_body` is written as the bytes that were downloaded: nothing is
+    decoded or re-encoded. The file only gets its final name once it is
+    complete, so an interrupted run never leaves a truncated page for
+    `python -m scraptt.bloom` to count. Files are written in
+    `ASYNC_WRITER_THREADS` threads.
+    """
+
+    def write(self, item, spider):
         board = item['board']
         article_id = item['article_id']
         timestamp = item['timestamp']
         dt = datetime.fromtimestamp(int(timestamp))
         dt_str = dt.strftime("%Y%m%d_%H%M")
         
+        logger.info(f"{board}-{dt}-{article_id}")
         try:
-            logger.info(f"{board}-{dt}-{article_id}")
             # Server
             # os.makedirs(f"/data/rawdata/{board}/{dt.year}", exist_ok=True)
-            # with open(f"/data/rawdata/{board}/{dt.year}/{dt_str}_{article_id}.html", "w+") as f:
-            #     f.write(item['html_content'])
+            # path = f"/data/rawdata/{board}/{dt.year}/{dt_str}_{article_id}.html"
             # Debug
             os.makedirs(f"data/{board}/{dt.year}", exist_ok=True)
-            with open(f"data/{board}/{dt.year}/{dt_str}_{article_id}.html", "w+") as f:
-                f.write(item['html_content'])
-        except Exception as e:
-            print(e)
-            print(f"有問題的文章: {article_id}")
-            logger.warning(e)
-            logger.warning(f"有問題的文章iD: {article_id}")
-        return item
+            path = f"data/{board}/{dt.year}/{dt_str}_{article_id}.html"
+            self.write_file(path, item['html_body'])
+        except OSError as e:
+            # 沒寫進去的文章不能往後傳 (SeenFilterPipeline 會把它當成爬過了)
+            raise DropItem(f"有問題的文章: {board}/{article_id}: {e}") from e
+
+    def write_file(self, path, body):
+        """Write `body` (bytes) to `path` via a temporary file."""
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+class JsonPipeline(AsyncWriterPipeline):
+    """
+    Posts and comments as compressed JSON lines segments of every board.
+
+    See `exporters.JsonLinesExport`: segments go to `JSONL_EXPORT_DIR`,
+    named by board and run (`JSONL_EXPORT_RUN`, the start time and pid by
+    default), compressed with `JSONL_EXPORT_COMPRESSION` ('zstd' or
+    'gzip') and rotated after
+    `JSONL_EXPORT_MAX_BYTES` of JSON or `JSONL_EXPORT_MAX_SECONDS`. One
+    thread per board.
+    """
+
+    def open(self, spider):
+        settings = spider.settings
+        run = (
+            settings.get('JSONL_EXPORT_RUN') or
+            f'{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}')
+        self.export = JsonLinesExport(
+            settings.get('JSONL_EXPORT_DIR'),
+            run,
+            settings.get('JSONL_EXPORT_COMPRESSION'),
+            settings.getint('JSONL_EXPORT_LEVEL') or None,
+            settings.getint('JSONL_EXPORT_MAX_BYTES'),
+            settings.getint('JSONL_EXPORT_MAX_SECONDS'),
+        )
+
+    def close(self, spider):
+        self.export.close()
+
+    def key(self, item):
+        return item['board']
+
+    def write(self, item, spider):
+        """Insert data into database."""
+        board = item['board']
+        self.export.write(board, post_document(item))
+        for comment_obj in comment_documents(item):
+            self.export.write(board, comment_obj)
+
+
+class MongoBulkPipeline(AsyncWriterPipeline):
+    """
+    Upsert posts and comments into MongoDB in unordered bulk writes.
+
+    The post and every comment of an item become one `UpdateOne` upsert
+    by `id` (the same records as JsonPipeline). They are buffered and sent
+    as one `bulk_write(ordered=False)` once `MONGO_BULK_SIZE` operations
+    or `MONGO_BULK_BYTES` of documents are waiting, or the oldest one has
+    waited `MONGO_BULK_INTERVAL` seconds; whatever is left is sent on
+    close. A 3,000-comment thread is then a handful of round trips
+    instead of 3,001.
+
+    Stats: `mongo/batches`, `mongo/operations`, `mongo/errors` (write
+    errors of single operations; the rest of the batch still goes in) and
+    `mongo/batch_ms_max`; the latency of every batch is logged at DEBUG,
+    at WARNING when it took over `MONGO_BULK_SLOW_MS`. Batches are built
+    and sent in one writer thread.
+    """
+
+    threads = 1
+
+    def __init__(self, uri, database, collection, size, max_bytes, interval,
+                 stats, slow_ms=1000):  # noqa
+        self.uri = uri if uri.startswith('mongodb://') else f'mongodb://{uri}'
+        self.database = database
+        self.collection_name = collection
+        self.size = size
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.stats = stats
+        self.slow_ms = slow_ms
+        self.operations = []
+        self.bytes = 0
+        self.oldest = None
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        settings = crawler.settings
+        return cls(
+            settings.get('MONGO_URI'),
+            settings.get('MONGO_DATABASE'),
+            settings.get('MONGO_COLLECTION'),
+            settings.getint('MONGO_BULK_SIZE'),
+            settings.getint('MONGO_BULK_BYTES'),
+            settings.getfloat('MONGO_BULK_INTERVAL'),
+            crawler.stats,
+            settings.getint('MONGO_BULK_SLOW_MS'),
+        )
+
+    def open(self, spider):
+        self.client = pymongo.MongoClient(self.uri)
+        self.collection = self.client[self.database][self.collection_name]
+        # upsert 是用 id 找文件，沒有 index 的話每一筆都是全表掃描
+        self.call(self.collection.create_index, 'id')
+        # 在 writer thread 裡檢查，跟 add() 不會同時動到 self.operations
+        self.timer = task.LoopingCall(self.call, self._flush_if_stale)
+        self.timer.start(self.interval / 2, now=False)
 
+    def close_spider(self, spider):
+        if self.timer.running:
+            self.timer.stop()
+        return super().close_spider(spider)
+
+    def close(self, spider):
+        self.flush()
+        self.client.close()
+
+    def write(self, item, spider):
+        self.add(post_document(item))
+        for comment_obj in comment_documents(item):
+            self.add(comment_obj)
+
+    def add(self, doc):
+        """Buffer the upsert of `doc`; flush if the batch is full."""
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        self.operations.append(
+            pymongo.UpdateOne({'id': doc['id']}, {'$set': doc}, upsert=True))
+        # 粗估文件大小就好 (字串的 UTF-8 長度，中文一個字 3 bytes)，不用真的編成 BSON
+        self.bytes += sum(
+            len(value.encode('utf-8')) if isinstance(value, str) else 8
+            for value in doc.values()
+        )
+        if len(self.operations) >= self.size or self.bytes >= self.max_bytes:
+            self.flush()
+
+    def _flush_if_stale(self):
+        if (self.oldest is not None and
+                time.monotonic() - self.oldest >= self.interval):
+            self.flush()
+
+    def flush(self):
+        """Send the buffered operations as one unordered bulk write."""
+        if not self.operations:
+            return
+        operations, self.operations = self.operations, []
+        self.bytes = 0
+        self.oldest = None
+        start = time.monotonic()
+        errors = 0
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            errors = len(write_errors)
+            for error in write_errors[:3]:
+                logger.warning(f"mongo write error: {error.get('errmsg')}")
+        except PyMongoError as e:
+            # 整批都沒寫進去 (連線斷了之類)，記下來但不要讓爬蟲停下來
+            errors = len(operations)
+            logger.error(f'mongo bulk write of {errors} operations failed: {e}')
+        elapsed = (time.monotonic() - start) * 1000
+        self.inc_stat('mongo/batches')
+        self.inc_stat('mongo/operations', len(operations))
+        if errors:
+            self.inc_stat('mongo/errors', errors)
+        self.max_stat('mongo/batch_ms_max', round(elapsed))
+        logger.log(
+            logging.WARNING if elapsed >= self.slow_ms else logging.DEBUG,
+            f'mongo: {len(operations)} operations in {elapsed:.0f} ms, '
+            f'{errors} errors')
+
+
+class ElasticsearchBulkPipeline(AsyncWriterPipeline):
+    """
+    Index posts and comments into Elasticsearch with `es.BulkIndexer`.
+
+    Documents (built like `ElasticsearchPipeline` did, by `es.item_docs`)
+    are buffered and indexed `ES_BULK_BUFFER` at a time, and on close;
+    `ES_BULK_CHUNK_SIZE`, `ES_BULK_THREADS`, `ES_BULK_MAX_RETRIES` and
+    `ES_BULK_BACKOFF` configure the indexer. Documents which could not be
+    indexed are counted in `es/failed`, the first few logged, and all of
+    them appended to `ES_BULK_FAILED_PATH` if it is set: one bulk action
+    per line (_index / _type / _id / _source, plus the status and error),
+    which `elasticsearch.helpers.bulk` takes as it is to index them again.
+    Documents are built (and segmented) and indexed in one writer thread.
+    """
+
+    threads = 1
+
+    def __init__(self, indexer, documents, buffer_size, failed_path,
+                 stats):  # noqa
+        self.indexer = indexer
+        self.documents = documents
+        self.buffer_size = buffer_size
+        self.failed_path = failed_path
+        self.stats = stats
+        self.docs = []
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        # 沒設 ELASTICSEARCH_HOST 時 import 就會失敗，只在用到的時候 import
+        from .es import BulkIndexer, item_docs
+        settings = crawler.settings
+        indexer = BulkIndexer(
+            chunk_size=settings.getint('ES_BULK_CHUNK_SIZE'),
+            thread_count=settings.getint('ES_BULK_THREADS'),
+            max_retries=settings.getint('ES_BULK_MAX_RETRIES'),
+            initial_backoff=settings.getfloat('ES_BULK_BACKOFF'),
+        )
+        return cls(
+            indexer,
+            item_docs,
+            settings.getint('ES_BULK_BUFFER'),
+            settings.get('ES_BULK_FAILED_PATH'),
+            crawler.stats
+        )
+
+    def close(self, spider):
+        self.flush()
+
+    def write(self, item, spider):
+        self.docs.extend(self.documents(item))
+        if len(self.docs) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Index the buffered documents."""
+        if not self.docs:
+            return
+        docs, self.docs = self.docs, []
+        start = time.monotonic()
+        retried = self.indexer.retried
+        indexed, failed = self.indexer.index(docs)
+        elapsed = (time.monotonic() - start) * 1000
+        self.inc_stat('es/indexed', indexed)
+        self.inc_stat('es/retried', self.indexer.retried - retried)
+        logger.debug(
+            f'es: {indexed} documents in {elapsed:.0f} ms, {len(failed)} failed')
+        if failed:
+            self.report(failed)
+
+    def report(self, failed):
+        """Count, log and (with ES_BULK_FAILED_PATH) save failed documents."""
+        self.inc_stat('es/failed', len(failed))
+        for doc in failed[:3]:
+            logger.warning(
+                f"es: {doc['id']} not indexed ({doc['status']}): {doc['error']}")
+        if self.failed_path:
+            with open(self.failed_path, 'ab') as f:
+                for doc in failed:
+                    # 有 _source 時 bulk 會忽略 status / error 這兩個 key
+                    f.write(dumps(dict(
+                        doc['action'] or {'_id': doc['id']},
+                        status=doc['status'], error=doc['error'])))
+
+
+class ParquetPipeline(AsyncWriterPipeline):
+    """
+    Posts and comments as two Parquet datasets, partitioned by board and year.
+
+    <PARQUET_DIR>/posts and <PARQUET_DIR>/comments, see
+    `parquet.PartitionedDataset`: columns as in `post_document` /
+    `comment_documents` (board and year in the path), `PARQUET_BATCH_SIZE`
+    rows per record batch, `PARQUET_COMPRESSION` for the column chunks.
+    Files are closed after `PARQUET_FILE_ROW_GROUPS` row groups or
+    `PARQUET_FILE_SECONDS`, and at most `PARQUET_MAX_BUFFERED_ROWS` rows
+    per dataset wait in memory. Every run writes its own files
+    (`PARQUET_RUN`, the start time and pid by default). Needs pyarrow;
+    without it the pipeline is disabled.
+    """
+
+    # 所有 partition 都在同一個 thread，計時器跟上限才不用加鎖
+    threads = 1
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        try:
+            from . import parquet  # noqa
+        except ImportError:
+            raise NotConfigured('ParquetPipeline needs pyarrow')
+        return cls()
+
+    def open(self, spider):
+        from .parquet import COMMENT_SCHEMA, POST_SCHEMA, PartitionedDataset
+        settings = spider.settings
+        directory = settings.get('PARQUET_DIR')
+        run = (
+            settings.get('PARQUET_RUN') or
+            f'{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}')
+        seconds = settings.getfloat('PARQUET_FILE_SECONDS')
+        options = dict(
+            batch_size=settings.getint('PARQUET_BATCH_SIZE'),
+            compression=settings.get('PARQUET_COMPRESSION'),
+            row_groups=settings.getint('PARQUET_FILE_ROW_GROUPS'),
+            max_rows=settings.getint('PARQUET_MAX_BUFFERED_ROWS'),
+            max_seconds=seconds,
+        )
+        self.posts = PartitionedDataset(
+            os.path.join(directory, 'posts'), POST_SCHEMA, run, **options)
+        self.comments = PartitionedDataset(
+            os.path.join(directory, 'comments'), COMMENT_SCHEMA, run, **options)
+        self.timer = task.LoopingCall(self.call, self._expire)
+        if seconds:
+            self.timer.start(min(seconds / 2, 60), now=False)
 
-class JsonPipeline:
-    def open_spider(self, spider):
-        self.board_to_exporter = {}
+    def close_spider(self, spider):
+        if self.timer.running:
+            self.timer.stop()
+        return super().close_spider(spider)
 
+    def close(self, spider):
+        self.posts.close()
+        self.comments.close()
 
-    def close_spider(self, spider):
-        for exporter in self.board_to_exporter.values():
-            exporter.finish_exporting()
-            exporter.file.close()
+    def _expire(self):
+        self.posts.expire()
+        self.comments.expire()
 
-    def _exporter_for_item(self, item):
+    def key(self, item):
+        return item['board']
+
+    def write(self, item, spider):
         board = item['board']
-        if board not in self.board_to_exporter:
-            # f = open('/data/rawdata/{}.jsonl'.format(board), 'wb')
-            f = open('{}.jsonl'.format(board), 'wb')
+        self.posts.append(board, post_document(item))
+        for comment_obj in comment_documents(item):
+            self.comments.append(board, comment_obj)
+
+
+class SeenFilterPipeline:
+    """
+    Record every written article in the on-disk "already crawled" filter.
 
-            exporter = CustomJsonLinesItemExporter(f)
-            exporter.start_exporting()
-            self.board_to_exporter[board] = exporter
-        return self.board_to_exporter[board]
+    Put it after the pipelines that write to disk. The filter is also
+    exposed as `spider.seen_filter`, which `skip_seen` spiders consult
+    before requesting a post.
+    """
+
+    def open_spider(self, spider):
+        settings = spider.settings
+        self.filter = BloomFilter.open(
+            settings.get('SEEN_FILTER_PATH'),
+            settings.getint('SEEN_FILTER_CAPACITY'),
+            settings.getfloat('SEEN_FILTER_ERROR_RATE'),
+        )
+        spider.seen_filter = self.filter
+
+    def close_spider(self, spider):
+        self.filter.save()
 
     def process_item(self, item, spider):
-        """Insert data into database."""
-        post_obj = {
-            "id": item['id'],
-            "board": item['board'],
-            "author": item['author'],
-            "published": item['time']['published'],
-            "crawled": item['time']['crawled'],
-            "title": item['title'],
-            "ip": item['ip'],
-            "content": item['content'],
-            "upvote": item['count']['推'],
-            "novote": item['count']['→'],
-            "downvote": item['count']['噓'],
-        }
-        # print(f"====={post_obj['published']}=====")
-        # print(item['title'])
-        # print("item['count']:\n")
-        # print(f"推: {item['count']['推']}  噓: {item['count']['噓']} →: {item['count']['→']}")
-        # print("post_obj['upvote']:\n")
-        # print(f"{post_obj['upvote']}")
-
-        # self.ptt_col.insert_one(post_obj)
-        # self.ptt_col.update_one(
-        #     {"id": post_obj["id"]},
-        #     {"$set": post_obj},
-        #     upsert=True
-        # )
-        exporter = self._exporter_for_item(item)
-        exporter.export_item(post_obj)
-
-        if len(item['comments']) == 0:
-            return item
-        else:
-            for comment in item['comments']:
-                hashid = sha256((f"{item['id']}"f"{comment['author']}"f"{comment['time']['published']}").encode('utf-8')).hexdigest()[:16]
-                comment_obj = {
-                    "id": hashid,
-                    "type": comment['type'],
-                    "author": comment['author'],
-                    "published": comment['time']['published'],
-                    "crawled": comment['time']['crawled'],
-                    "ip": comment['ip'],
-                    "content": comment['content'],
-                    "post_id": item['id'],
-                }
-                # self.ptt_col.insert_one(comment_obj)
-                # self.ptt_col.update_one(
-                #     {"id": comment_obj["id"]},
-                #     {"$set": comment_obj},
-                #     upsert=True
-                # )
-                exporter = self._exporter_for_item(item)
-                exporter.export_item(comment_obj)
+        article_id = item.get('article_id') or item.get('id')
+        self.filter.add(article_token(item['board'], article_id))
         return item
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Process / thread pools for work which should not block the reactor thread."""
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+logger = logging.getLogger(__name__)
+
+
+class ParsePool:
+    """
+    Run picklable functions in worker processes and get Deferreds back.
+
+    At most `max_pending` jobs are handed to the executor at a time; later
+    `submit` calls wait in a `DeferredSemaphore` instead of piling up in
+    the executor's queue. The responses they belong to stay in Scrapy's
+    scraper slot meanwhile, and once that slot is full
+    (`SCRAPER_SLOT_MAX_ACTIVE_SIZE`) the engine stops downloading: slow
+    parsing throttles downloads, fast parsing does not hold them back.
+    """
+
+    def __init__(self, processes, max_pending):
+        """__init__ method."""
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.semaphore = defer.DeferredSemaphore(max_pending)
+
+    def submit(self, func, *args):
+        """Deferred which fires with `func(*args)` run in a worker process."""
+        return self.semaphore.run(self._run, func, *args)
+
+    def _run(self, func, *args):
+        dfd = defer.Deferred()
+        future = self.executor.submit(func, *args)
+        # done callbacks run in the executor's thread; hop back to the reactor
+        future.add_done_callback(
+            lambda future: reactor.callFromThread(self._fire, dfd, future))
+        return dfd
+
+    @staticmethod
+    def _fire(dfd, future):
+        exception = future.exception()
+        if exception is not None:
+            dfd.errback(Failure(exception))
+        else:
+            dfd.callback(future.result())
+
+    def close(self):
+        """Wait for running jobs, then stop the workers."""
+        self.executor.shutdown(wait=True)
+
+
+class WriterPool:
+    """
+    Run blocking writes in threads and get Deferreds back.
+
+    Every thread runs its jobs one at a time, in order; jobs with the same
+    `key` always go to the same thread (jobs without one take turns), so
+    writes to one file or connection never run concurrently. At most
+    `max_pending` jobs handed over with `put` are queued or running; more
+    wait in a `DeferredSemaphore` (like `ParsePool.submit`) until one of
+    them is done.
+    """
+
+    def __init__(self, threads, max_pending):
+        """__init__ method."""
+        self.executors = [
+            ThreadPoolExecutor(max_workers=1) for _ in range(threads)
+        ]
+        self.semaphore = defer.DeferredSemaphore(max_pending)
+        self.running = set()
+        self._turns = itertools.cycle(self.executors)
+
+    @property
+    def full(self):
+        """True if `put` would have to wait."""
+        return not self.semaphore.tokens
+
+    @property
+    def queued(self):
+        """Jobs queued or running."""
+        return self.semaphore.limit - self.semaphore.tokens
+
+    def put(self, key, func, *args):
+        """Deferred which fires with `func(*args)`, counted in `max_pending`."""
+        return self.semaphore.run(self.run, key, func, *args)
+
+    def run(self, key, func, *args):
+        """Deferred which fires with `func(*args)`, not counted in `max_pending`."""
+        if key is None:
+            executor = next(self._turns)
+        else:
+            executor = self.executors[hash(key) % len(self.executors)]
+        dfd = defer.Deferred()
+        future = executor.submit(func, *args)
+        future.add_done_callback(
+            lambda future: reactor.callFromThread(ParsePool._fire, dfd, future))
+        self.running.add(dfd)
+        dfd.addBoth(self._finished, dfd)
+        return dfd
+
+    def _finished(self, result, dfd):
+        self.running.discard(dfd)
+        return result
+
+    def drain(self):
+        """Deferred which fires once every job so far is done."""
+        return defer.DeferredList(list(self.running))
+
+    def close(self):
+        """Stop the threads (after the jobs they have)."""
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+
+
+class ParsePoolExtension:
+    """
+    Give spiders a `ParsePool` as `spider.parse_pool`.
+
+    Enabled with `POST_PARSE_PROCESSES` (number of worker processes);
+    `POST_PARSE_MAX_PENDING` bounds the jobs handed to the workers at once.
+    Spiders without a `parse_pool` attribute are left alone.
+    """
+
+    def __init__(self, crawler):  # noqa
+        settings = crawler.settings
+        self.processes = settings.getint('POST_PARSE_PROCESSES')
+        if self.processes <= 0:
+            raise NotConfigured
+        self.max_pending = (
+            settings.getint('POST_PARSE_MAX_PENDING') or 2 * self.processes)
+        self.stats = crawler.stats
+        self.pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):  # noqa
+        if not hasattr(spider, 'parse_pool'):
+            return
+        self.pool = ParsePool(self.processes, self.max_pending)
+        spider.parse_pool = self.pool
+        self.stats.set_value(
+            'parse_pool/processes', self.processes, spider=spider)
+        logger.info(
+            f'parsing posts in {self.processes} processes '
+            f'({self.max_pending} jobs at a time)')
+
+    def spider_closed(self, spider):  # noqa
+        if self.pool is None:
+            return
+        spider.parse_pool = None
+        self.pool.close()
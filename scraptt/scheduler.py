@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Board-fair request scheduler."""
+import heapq
+import itertools
+import logging
+import math
+from collections import deque
+
+from scrapy.core.scheduler import Scheduler
+
+from .ids import board_from_url, topic_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class BoardVelocity:
+    """Posts per day of a board, estimated from its latest post timestamps."""
+
+    def __init__(self, size=200):
+        """__init__ method."""
+        self.stamps = deque(maxlen=size)
+
+    def observe(self, timestamp):
+        """Record the timestamp of one post request."""
+        self.stamps.append(timestamp)
+
+    @property
+    def posts_per_day(self):  # noqa
+        if len(self.stamps) < 2:
+            return 0.0
+        span = max(self.stamps) - min(self.stamps)
+        return (len(self.stamps) - 1) * 86400 / span if span else 0.0
+
+
+class BoardFairScheduler(Scheduler):
+    """
+    Round-robin requests between boards instead of one global queue.
+
+    Every board has its own priority queue. Boards take turns by weighted
+    fair queuing: each request a board sends advances its virtual time by
+    1 / weight, and the board with the smallest virtual time goes next.
+    The weight grows with the board's post velocity, 1 + log2(1 + posts per
+    day), estimated from the timestamps in its post URLs. Busy boards get
+    a larger share and small boards still finish early. While several
+    boards are waiting, none may have more than
+    `SCHEDULER_BOARD_CONCURRENCY` requests in the downloader.
+
+    Requests are kept in memory only (JOBDIR disk queues are not used), so
+    it is not the default: enable it with
+    `-s SCHEDULER=scraptt.scheduler.BoardFairScheduler` for crawls which
+    are not paused and resumed.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):  # noqa
+        scheduler = super().from_crawler(crawler)
+        scheduler.crawler = crawler
+        scheduler.board_concurrency = crawler.settings.getint(
+            'SCHEDULER_BOARD_CONCURRENCY')
+        return scheduler
+
+    def open(self, spider):  # noqa
+        self.queues = {}        # board -> heap of (-priority, seq, request)
+        self.vtime = {}         # board -> virtual time
+        self.velocity = {}      # board -> BoardVelocity
+        self.counter = itertools.count()
+        self.pending = 0
+        if self.dqdir:
+            logger.warning(
+                'BoardFairScheduler keeps requests in memory only: '
+                'the queue is not saved to JOBDIR and is lost on pause')
+        return super().open(spider)
+
+    def enqueue_request(self, request):  # noqa
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        board = board_from_url(request.url)
+        if board not in self.queues:
+            self.queues[board] = []
+            self.velocity[board] = BoardVelocity()
+        queue = self.queues[board]
+        if not queue:
+            # 剛加入 (或重新加入) 的看板從目前最小的虛擬時間開始，不能插隊
+            active = [self.vtime[b] for b, q in self.queues.items() if q]
+            self.vtime[board] = max(
+                self.vtime.get(board, 0.0), min(active, default=0.0))
+        timestamp = topic_timestamp(request.url)
+        if timestamp is not None:
+            self.velocity[board].observe(timestamp)
+        heapq.heappush(queue, (-request.priority, next(self.counter), request))
+        self.pending += 1
+        self.stats.inc_value('scheduler/enqueued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):  # noqa
+        boards = [board for board, queue in self.queues.items() if queue]
+        if not boards:
+            return None
+        if len(boards) > 1:
+            in_flight = self._in_flight()
+            boards = [
+                board for board in boards
+                if in_flight.get(board, 0) < self.board_concurrency
+            ]
+            if not boards:
+                return None
+        board = min(boards, key=self.vtime.__getitem__)
+        _, _, request = heapq.heappop(self.queues[board])
+        self.vtime[board] += 1 / self._weight(board)
+        self.pending -= 1
+        self.stats.inc_value('scheduler/dequeued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    def __len__(self):  # noqa
+        return self.pending
+
+    def has_pending_requests(self):  # noqa
+        return self.pending > 0
+
+    def _weight(self, board):
+        return 1 + math.log2(1 + self.velocity[board].posts_per_day)
+
+    def _in_flight(self):
+        counts = {}
+        for request in self.crawler.engine.downloader.active:
+            board = board_from_url(request.url)
+            counts[board] = counts.get(board, 0) + 1
+        return counts
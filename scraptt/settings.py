@@ -28,16 +28,38 @@ LOG_FILE = './scraptt.log'
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
     'scraptt.middlewares.PyqueryMiddleware': 543,
+    'scraptt.middlewares.PostFingerprintMiddleware': 560,
+    'scraptt.middlewares.AdaptiveThrottleMiddleware': 570,
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'scrapy_fake_useragent.middleware.RandomUserAgentMiddleware': 400,
 }
 
+# 錄製 / 重播下載內容 (ARCHIVE_MODE = 'record' | 'replay')，見 scraptt/handlers.py
+DOWNLOAD_HANDLERS = {
+    'http': 'scraptt.handlers.ArchiveDownloadHandler',
+    'https': 'scraptt.handlers.ArchiveDownloadHandler',
+}
+ARCHIVE_MODE = None
+ARCHIVE_PATH = 'archive.sqlite'
+
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
 EXTENSIONS = {
     'scrapy.extensions.telnet.TelnetConsole': None,
+    'scraptt.frontier.FrontierExtension': 500,
+    'scraptt.pool.ParsePoolExtension': 510,
 }
 
+# 依照延遲與錯誤率 (AIMD) 動態調整 DOWNLOAD_DELAY 與同時連線數；
+# DOWNLOAD_DELAY 是起始值也是下限 (MIN_DELAY 沒設的話)，CONCURRENT_REQUESTS 是上限
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_WINDOW = 50
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 2.0
+ADAPTIVE_THROTTLE_MAX_ERROR_RATE = 0.02
+ADAPTIVE_THROTTLE_MIN_DELAY = None     # default: DOWNLOAD_DELAY
+ADAPTIVE_THROTTLE_MAX_DELAY = 30.0
+ADAPTIVE_THROTTLE_DELAY_STEP = 0.1
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -59,7 +81,91 @@ EXTENSIONS = {
 # HTTPCACHE_IGNORE_HTTP_CODES = []
 # HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 
+# AsyncWriterPipeline (JsonPipeline / HTMLFilePipeline / Mongo / ES): 寫入在 thread 裡做，
+# 排隊的寫入超過 ASYNC_WRITER_QUEUE 筆時 item 就等著，scraper slot 滿了引擎會暫停下載
+ASYNC_WRITER_THREADS = 2
+ASYNC_WRITER_QUEUE = 200
+
 MONGO_URI = "mongo:27017"
+MONGO_DATABASE = 'ptt'
+MONGO_COLLECTION = 'ptt'
+# MongoBulkPipeline 累積的 upsert 達到任一條件就送出一批 (unordered bulk_write)
+MONGO_BULK_SIZE = 1000               # operations
+MONGO_BULK_BYTES = 4 * 1024 * 1024   # estimated size of the documents
+MONGO_BULK_INTERVAL = 5.0            # seconds since the oldest buffered operation
+MONGO_BULK_SLOW_MS = 1000            # batches slower than this are logged at WARNING
+
+# JsonPipeline: <JSONL_EXPORT_DIR>/<board>/<board>-<run>-<n>.jsonl.zst (或 .gz)，
+# 每個 run 一份 manifest-<run>.jsonl
+JSONL_EXPORT_DIR = 'jsonl'
+JSONL_EXPORT_RUN = None                     # default: start time + pid
+JSONL_EXPORT_COMPRESSION = 'zstd'           # or 'gzip'; None = zstd if zstandard is installed
+JSONL_EXPORT_LEVEL = None                   # default 3 (zstd) / 6 (gzip)
+JSONL_EXPORT_MAX_BYTES = 256 * 1024 * 1024  # JSON per segment (before compression)
+JSONL_EXPORT_MAX_SECONDS = 3600             # age of a segment, checked when writing
+
+# ParquetPipeline: <PARQUET_DIR>/{posts,comments}/board=<board>/year=<year>/<run>-<n>.parquet
+# pyarrow 是選用的，不在 requirements.txt / Docker image 裡 (pip install pyarrow==12.0.1，
+# Python 3.7 最後一版)：py3.7 沒有 Alpine (musllinux) 的 wheel，沒裝時這個 pipeline 不會啟用
+PARQUET_DIR = 'parquet'
+PARQUET_RUN = None              # default: start time + pid
+PARQUET_BATCH_SIZE = 5000       # rows per record batch (row group), per board / year
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_FILE_ROW_GROUPS = 20    # row groups per file, then the next file
+PARQUET_FILE_SECONDS = 600      # files (and buffered rows) older than this are closed
+PARQUET_MAX_BUFFERED_ROWS = 200000  # rows in memory per dataset, all board / year together
+
+# ElasticsearchBulkPipeline (ES 位址用環境變數 ELASTICSEARCH_HOST / ELASTICSEARCH_PORT)
+ES_BULK_BUFFER = 2000       # documents indexed at a time
+ES_BULK_CHUNK_SIZE = 500    # actions per bulk request
+ES_BULK_THREADS = 4         # bulk requests sent in parallel
+ES_BULK_MAX_RETRIES = 3     # retries of documents rejected with 429
+ES_BULK_BACKOFF = 2         # seconds before the first retry, doubled every time
+ES_BULK_FAILED_PATH = None  # append documents which failed here (JSON lines)
+
+# since 模式找 index 範圍時最多發出的 probe 數 (用完就保守地從較舊的一頁開始爬)
+INDEX_SEARCH_MAX_PROBES = 40
+
+# all_index 模式: 佇列 + 下載中的 request 少於 INDEX_WINDOW_LOW 時才補 index 頁，
+# 同時最多 INDEX_WINDOW_PAGES 頁還沒解析 (爬到哪一頁記在 CHECKPOINT_DB)
+INDEX_WINDOW_LOW = 500
+INDEX_WINDOW_PAGES = 10
+
+# resume 模式用的 checkpoint (每個版最大的 index 頁，與最新一篇之前都已經寫進去的文章 id)
+CHECKPOINT_DB = 'checkpoints.sqlite'
+
+# 重爬時跳過沒有變動的po文 (conditional request + body hash)
+POST_FINGERPRINT_ENABLED = False
+POST_FINGERPRINT_DB = 'fingerprints.sqlite'
+
+# 已爬過的文章 (Bloom filter)，重建: python -m scraptt.bloom seen.bloom --data-dir data
+SEEN_FILTER_PATH = 'seen.bloom'
+SEEN_FILTER_CAPACITY = 10000000
+SEEN_FILTER_ERROR_RATE = 0.001
+
+# 多個看板輪流排程 (依發文速度加權)，避免大版塞滿佇列；要用時再打開
+# (佇列只放在記憶體裡，JOBDIR 的暫停 / 繼續要用 Scrapy 預設的 scheduler)
+# SCHEDULER = 'scraptt.scheduler.BoardFairScheduler'
+SCHEDULER_BOARD_CONCURRENCY = 4
+
+# 看板 index / po文網址用整數與 bitmap 記，不存 SHA1 指紋；要用時再打開
+# (這些網址不會寫進 JOBDIR，暫停 / 繼續要用 Scrapy 預設的 dupefilter)
+# DUPEFILTER_CLASS = 'scraptt.dupefilter.PttDupeFilter'
+PTT_DUPEFILTER_DIR = None        # 目錄: po文的 key 放在磁碟上 (mmap)；None = 全放記憶體
+PTT_DUPEFILTER_BUFFER = 65536    # keys kept in a set before they are sorted into a run
+
+# 多台 scrapyd 共用的工作佇列 (-a frontier=1)；FRONTIER_DB 必須是各節點都看得到的檔案
+FRONTIER_CLASS = 'scraptt.frontier.SQLiteFrontier'
+FRONTIER_DB = 'frontier.sqlite'
+FRONTIER_UNIT_SIZE = 50          # index pages per work unit
+FRONTIER_LEASE_BATCH = 4         # units leased at a time
+FRONTIER_LEASE_TTL = 300         # seconds; renewed by a heartbeat every TTL/3
+
+# parse_post 改在 process pool 裡解析 (0 = 在 reactor thread 裡直接解析)
+POST_PARSE_PROCESSES = 0
+POST_PARSE_MAX_PENDING = 0       # jobs handed to the workers at once; 0 = 2 x processes
+# 大於這個大小 (bytes) 的po文改用串流解析，不建整棵 DOM；0 = 不使用
+POST_STREAM_SIZE = 2 * 1024 * 1024
 
 RETRY_ENABLED = True
 RETRY_HTTP_CODES = [500, 502, 503, 504, 521, 522, 524, 408, 429]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Binary search over the index pages of a board."""
+
+
+class IndexSearch:
+    """
+    Find the first index page of `board` for which `predicate` holds.
+
+    index 越大文章越新，所以只要 `predicate` 對時間單調 (前面全是 False、
+    後面全是 True)，就可以對 index 做二分搜尋，一次只需要一個 probe。
+
+    - `predicate` receives the post timestamps of one page, oldest first
+    - pages without any post (全部被刪除) count as `empty`; pick the value
+      that errs on the side of crawling a few pages too many
+    - the answer lies in [lo, hi]; `hi` means no page matched
+    - `gallop`: 答案通常靠近最新一頁時 (例如 since 模式)，先從 `hi` 往回以
+      1, 2, 4, 8... 的間距試探，夾住答案之後再二分
+    - `max_probes`: once spent, the search stops and `result` falls back to
+      the bound on the same side as `empty`
+    """
+
+    def __init__(self, board, lo, hi, predicate, empty=True, latest=None,
+                 gallop=False, max_probes=None):
+        """__init__ method."""
+        self.board = board
+        self.lo = lo
+        self.hi = hi
+        self.predicate = predicate
+        self.empty = empty
+        self.latest = latest
+        self.max_probes = max_probes
+        self.probes = 0
+        self._step = 1 if gallop else None
+
+    @property
+    def exhausted(self):
+        """True if the probe budget ran out before the range collapsed."""
+        return (
+            self.max_probes is not None and
+            self.probes >= self.max_probes and
+            self.lo < self.hi
+        )
+
+    @property
+    def done(self):
+        """True once the search range has collapsed."""
+        return self.lo >= self.hi or self.exhausted
+
+    @property
+    def result(self):
+        """First matching index (`hi` of the initial range if none)."""
+        return self.lo if self.empty else self.hi
+
+    def next_probe(self):
+        """Index page to request next."""
+        if self._step is not None:
+            return max(self.hi - self._step, self.lo)
+        return (self.lo + self.hi) // 2
+
+    def feed(self, index, stamps):
+        """Narrow the range with the timestamps found on page `index`."""
+        self.probes += 1
+        hit = self.predicate(stamps) if stamps else self.empty
+        if hit:
+            self.hi = index
+            if self._step is not None:
+                self._step *= 2
+        else:
+            self.lo = index + 1
+            self._step = None
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """PTT COMMENT parsers."""
 import re
-from collections import defaultdict
+from collections import Counter, defaultdict, namedtuple
+
+Comment = namedtuple('Comment', 'type author content published ip')
 
 
 def comment_counter(comments):
@@ -55,3 +57,67 @@ def split_ip_and_publish_time(ip_and_datetime_str):
         publish_time = ip_and_datetime_str
 
     return publish_time, ip
+
+
+class CommentList:
+    """
+    Comments of one post, stored column by column.
+
+    A Gossiping post can have tens of thousands of pushes; instead of a
+    dict (plus a `time` dict) per comment, every field is one list, the
+    crawl time is shared, and the 推/噓/→ counts are kept while filling.
+    Iterating yields `Comment` tuples; `as_dicts()` gives the old nested
+    format (what exporters see, see `PostItem.comments`).
+    """
+
+    __slots__ = (
+        'types', 'authors', 'contents', 'published', 'ips', 'crawled', 'count'
+    )
+
+    def __init__(self, crawled=None):
+        """__init__ method."""
+        self.types = []
+        self.authors = []
+        self.contents = []
+        self.published = []
+        self.ips = []
+        self.crawled = crawled
+        self.count = Counter()
+
+    def append(self, type, author, content, published, ip):  # noqa
+        self.types.append(type)
+        self.authors.append(author)
+        self.contents.append(content)
+        self.published.append(published)
+        self.ips.append(ip)
+        self.count[type] += 1
+
+    def __len__(self):  # noqa
+        return len(self.types)
+
+    def __iter__(self):  # noqa
+        return map(Comment._make, zip(
+            self.types, self.authors, self.contents, self.published, self.ips
+        ))
+
+    def __getitem__(self, i):  # noqa
+        return Comment(
+            self.types[i], self.authors[i], self.contents[i],
+            self.published[i], self.ips[i]
+        )
+
+    def as_dicts(self):
+        """Comments as the nested dicts `parse_post` used to produce."""
+        return [
+            {
+                'type': comment.type,
+                'author': comment.author,
+                'content': comment.content,
+                'time': {
+                    'published': comment.published,
+                    'crawled': self.crawled,
+                },
+                'ip': comment.ip,
+            }
+            for comment in self
+        ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""PTT COMMENT time parsers."""
+import re
+from datetime import datetime
+
+# .push-ipdatetime 的幾種形狀 (IP 不一定有，時:分也不一定有):
+# - " 111.71.127.174 11/06 22:04"
+# - " 218.166.4.106 06/22"
+# - " 05/30 18:28"
+IP_RE = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}')
+IPDATETIME_RE = re.compile(
+    r'(?:(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\s+)?'
+    r'(\d{1,2})/(\d{1,2})(?:\s+(\d{1,2}):(\d{1,2}))?\s*$'
+)
+
+
+def parse_ipdatetime(text):
+    """
+    將 .push-ipdatetime 的字串拆成 ip 與 (月, 日, 時, 分)。
+    沒有時:分的回文當作 00:00。
+
+    Input: <Str>, e.g. " 111.71.127.174 11/06 22:04"
+    Output: tuple (ip or None, (month, day, hour, minute)),
+        None if no date is found
+    """
+    # 最常見的 "MM/DD HH:MM" 直接切字串，不用 regex
+    text = text.rstrip()
+    if (
+        len(text) >= 11 and text[-3] == ':' and text[-6] == ' '
+        and text[-9] == '/'
+    ):
+        try:
+            stamp = (
+                int(text[-11:-9]), int(text[-8:-6]),
+                int(text[-5:-3]), int(text[-2:])
+            )
+        except ValueError:
+            pass
+        else:
+            ip = text[:-11].strip()
+            if not ip:
+                return None, stamp
+            if IP_RE.fullmatch(ip):
+                return ip, stamp
+
+    match = IPDATETIME_RE.search(text)
+    if match is None:
+        return None
+    ip, month, day, hour, minute = match.groups()
+    return ip, (int(month), int(day), int(hour or 0), int(minute or 0))
+
+
+class YearRollover:
+    """
+    Complete comment times, which carry no year, in a single pass.
+
+    Comments are listed in push order, starting from the publish time of
+    the post; every time the month goes backwards (12/31 -> 01/01) the
+    year moves on by one.
+
+    >>> resolve = YearRollover(datetime(2019, 12, 8, 17, 15))
+    >>> resolve(12, 31, 23, 59), resolve(1, 1, 0, 1)
+    (datetime.datetime(2019, 12, 31, 23, 59), datetime.datetime(2020, 1, 1, 0, 1))
+    """
+
+    def __init__(self, published):
+        """__init__ method."""
+        self.year = published.year
+        self.month = published.month
+
+    def __call__(self, month, day, hour, minute):
+        """Return the datetime of one comment; ValueError if it is invalid."""
+        year = self.year + 1 if month < self.month else self.year
+        published = datetime(year, month, day, hour, minute)
+        self.year, self.month = year, month
+        return published
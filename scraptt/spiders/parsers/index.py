@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""PTT INDEX parsers."""
+import re
+
+import lxml.html
+from lxml import etree
+
+from ...ids import topic_timestamp
+
+BASE_URL = 'https://www.ptt.cc/bbs/'
+INDEX_RE = re.compile(r'index(\d{1,6})\.html')
+
+# 索引頁面中的每一列 (.r-ent) 以及置底文上方的分隔線 (.r-list-sep)
+_ENTRIES = etree.XPath(
+    '//div[contains(concat(" ", @class, " "), " r-ent ")'
+    ' or contains(concat(" ", @class, " "), " r-list-sep ")]'
+)
+_TITLE_LINKS = etree.XPath(
+    './/div[contains(concat(" ", @class, " "), " title ")]//a[@href]'
+)
+_PREV_PAGE = etree.XPath(
+    '//a[contains(concat(" ", @class, " "), " wide ")'
+    ' and contains(text(), "上頁")]/@href'
+)
+
+
+def page_tree(text):
+    """lxml root of a PTT page, with every link made absolute."""
+    root = lxml.html.fromstring(text)
+    root.make_links_absolute(BASE_URL, handle_failures='ignore')
+    return root
+
+
+def index_url(board, index=None):
+    """URL of index page `index` of `board` (`index.html` when None)."""
+    if index is None:
+        return f'https://www.ptt.cc/bbs/{board}/index.html'
+    return f'https://www.ptt.cc/bbs/{board}/index{index}.html'
+
+
+def extract_topics(root):
+    """
+    Return (title, href) of every post on an index page, oldest first.
+
+    置底文 are listed below `.r-list-sep` and are skipped; deleted posts
+    have no link and are skipped as well.
+    Input: lxml root of an index page (`response.etree`)
+    Output: list of tuples (title, href)
+    """
+    topics = []
+    for entry in _ENTRIES(root):
+        if 'r-list-sep' in entry.get('class', '').split():
+            break
+        for link in _TITLE_LINKS(entry):
+            topics.append((link.text_content().strip(), link.get('href')))
+    return topics
+
+
+def topic_timestamps(root):
+    """Timestamps of every post on an index page, oldest first."""
+    stamps = (topic_timestamp(href) for _, href in extract_topics(root))
+    return [stamp for stamp in stamps if stamp is not None]
+
+
+def latest_index(root):
+    """
+    Number of the newest index page, read off `index.html`.
+
+    `index.html` 本身就是最新的一頁，其"上頁"按鈕指向 index<N-1>.html；
+    只有一頁的看板沒有"上頁"連結。
+    """
+    hrefs = _PREV_PAGE(root)
+    if not hrefs:
+        return 1
+    match = INDEX_RE.search(hrefs[0])
+    return int(match.group(1)) + 1 if match else 1
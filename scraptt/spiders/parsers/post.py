@@ -1,8 +1,21 @@
 # -*- coding: utf-8 -*-
 """PTT POST parsers."""
+import logging
 import re
+from datetime import datetime
 from html.parser import HTMLParser
 
+import dateutil.parser as dp
+from lxml import etree
+
+from .comment import CommentList
+from .comment_time import parse_ipdatetime, YearRollover
+from .index import page_tree
+from .segment import segment
+
+IP_RE = re.compile(r'\d{,3}\.\d{,3}\.\d{,3}\.\d{,3}')
+SYSTEM_LINE_RE = re.compile(r"※ 發信站.*|※ 文章網址.*|※ 編輯.*")
+
 
 class MLStripper(HTMLParser):
     """HTML tag stripper.
@@ -31,11 +44,12 @@ class MLStripper(HTMLParser):
 
 def mod_content(content):
     """Remove unnecessary info from a PTT post."""
-    content = MLStripper.strip_tags(content)
-    content = re.sub(
-        r"※ 發信站.*|※ 文章網址.*|※ 編輯.*", '', content
-    ).strip('\r\n-')
-    return content
+    return clean_content(MLStripper.strip_tags(content))
+
+
+def clean_content(text):
+    """Remove 發信站 / 文章網址 / 編輯 lines from the plain text of a post."""
+    return SYSTEM_LINE_RE.sub('', text).strip('\r\n-')
 
 
 def extract_author(string):
@@ -55,11 +69,339 @@ def extract_ip(string):
     as the IP info is usually at the bottom of the content.
     """
     try:
-        ips = re.findall(r'\d{,3}\.\d{,3}\.\d{,3}\.\d{,3}', string)
+        ips = IP_RE.findall(string)
         if ips:
             ip = ips[-1]
         else:
             ip = None
         return ip
     except:
-        return None
\ No newline at end of file
+        return None
+
+
+def _pq_text(element):
+    """Text of `element` the way `PyQuery.text()` joins it."""
+    pieces = []
+
+    def add_text(tag, no_tail=False):
+        if tag.text and isinstance(tag.tag, str):
+            pieces.append(tag.text)
+        for child in tag:
+            add_text(child)
+        if not no_tail and tag.tail:
+            pieces.append(tag.tail)
+
+    add_text(element, no_tail=True)
+    return ' '.join(t.strip() for t in pieces if t.strip())
+
+
+def _has_class(element, name):
+    return name in element.get('class', '').split()
+
+
+def _walk_content(element, texts, metas, pushes):
+    """
+    Collect the post text below `element` in one pass.
+
+    Meta spans (class^="article-meta-") and pushes (div.push) are not part
+    of the text; they are handed back in `metas` / `pushes` instead, but
+    their tail text is kept (with a leading space, like `PyQuery.remove()`).
+    """
+    for child in element:
+        removed = _walk_child(child, texts, metas, pushes)
+        _walk_tail(child, removed, texts)
+
+
+def _walk_child(child, texts, metas, pushes):
+    # `_walk_content` for a single child, without its tail;
+    # True if the child is not part of the text
+    tag = child.tag
+    if not isinstance(tag, str):
+        return False    # HTML comment / processing instruction
+    if tag == 'span' and child.get('class', '').startswith('article-meta-'):
+        if _has_class(child, 'article-meta-tag'):
+            metas.append(child)
+        return True
+    if tag == 'div' and _has_class(child, 'push'):
+        pushes.append(child)
+        return True
+    if child.text:
+        texts.append(child.text)
+    _walk_content(child, texts, metas, pushes)
+    return False
+
+
+def _walk_tail(child, removed, texts):
+    if child.tail:
+        texts.append(' ' + child.tail if removed else child.tail)
+
+
+def _meta_pair(tag):
+    """(作者, 值) of one `.article-meta-tag`; the value is the next element."""
+    value = tag.getnext()
+    while value is not None and not isinstance(value.tag, str):
+        value = value.getnext()
+    return _pq_text(tag), _pq_text(value) if value is not None else ''
+
+
+_PUSH_FIELDS = {
+    'push-tag': 0, 'push-userid': 1, 'push-content': 2, 'push-ipdatetime': 3
+}
+
+
+def _push_fields(push):
+    """(push-tag, push-userid, push-content, push-ipdatetime) of one push."""
+    fields = ['', '', '', '']
+    for element in push.iterdescendants():
+        for name in element.get('class', '').split():
+            field = _PUSH_FIELDS.get(name)
+            if field is not None and not fields[field]:
+                if len(element):
+                    fields[field] = _pq_text(element)
+                else:
+                    fields[field] = (element.text or '').strip()
+    return tuple(fields)
+
+
+def _board_name(topbar):
+    # 等同 PyQuery('#topbar a.board').remove('*').text()：只留 <a> 自己的文字
+    # 以及子元素後面的 tail
+    names = []
+    for link in topbar.iterdescendants('a'):
+        if not _has_class(link, 'board'):
+            continue
+        text = (link.text or '') + ''.join(
+            ' ' + child.tail for child in link if child.tail)
+        if text.strip():
+            names.append(text.strip())
+    return ' '.join(names).strip()
+
+
+def extract_post(root):
+    """
+    Extract everything `parse_post` needs from a post page in one traversal.
+
+    Replaces the clone / remove / html() / MLStripper / regex chain: the
+    text of `#main-content` is collected straight from the lxml tree.
+    Input: lxml root of a post page (`response.etree`)
+    Output: None if the page has no `#main-content`, else a dict
+        {
+            board: 版名,
+            meta: {"作者": ..., "標題": ..., "時間": ...},
+            ip: 發文 IP,
+            content: 清洗過、去掉引述的內文,
+            quote: 引述的內容 ('' 表示沒有),
+            segments: 內文的 `Segments` (content 與 quote 就是從這裡切出來的),
+            comments: [(push-tag, push-userid, push-content, push-ipdatetime)]
+        }
+    """
+    main = root.get_element_by_id('main-content', None)
+    if main is None:
+        return None
+
+    texts = [main.text] if main.text else []
+    metas = []
+    pushes = []
+    _walk_content(main, texts, metas, pushes)
+
+    topbar = root.get_element_by_id('topbar', None)
+    return _page(
+        _board_name(topbar) if topbar is not None else '',
+        dict(_meta_pair(tag) for tag in metas),
+        ''.join(texts),
+        [_push_fields(push) for push in pushes]
+    )
+
+
+def _page(board, meta, text, comments):
+    # 內文 / 引述 / 簽名檔 / 系統行 一次切好，content 與 quote 都從 segments 來
+    segments = segment(text)
+    return {
+        'board': board,
+        'meta': meta,
+        'ip': extract_ip(text),
+        'content': segments.content,
+        'quote': segments.quote,
+        'segments': segments,
+        'comments': comments,
+    }
+
+
+def _pull_events(body, encoding, chunk_size):
+    parser = etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+    for start in range(0, len(body), chunk_size):
+        parser.feed(body[start:start + chunk_size])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def stream_post(body, encoding='utf-8', chunk_size=64 * 1024):
+    """
+    `extract_post` for posts too big to hold as a whole tree.
+
+    The page is fed to a pull parser `chunk_size` bytes at a time. Every
+    direct child of `#main-content` (text block, push, ...) is turned
+    into text / meta / comment tuples as soon as it is complete, then
+    removed from the tree, so besides the output only the child being
+    parsed is in memory.
+    Input: page body <bytes>
+    Output: same as `extract_post`
+    """
+    main = None
+    board = ''
+    texts = []
+    meta = {}
+    comments = []
+    # 最近一個子元素的 tail 要等下一個子元素開始後才完整，先留著
+    held = None
+
+    def settle(child, removed, metas, pushes):
+        meta.update(_meta_pair(tag) for tag in metas)
+        comments.extend(_push_fields(push) for push in pushes)
+        _walk_tail(child, removed, texts)
+        main.remove(child)
+
+    def settle_until(last):
+        nonlocal held
+        for child in list(main):
+            if child is last:
+                break
+            if held is not None and child is held[0]:
+                settle(*held)
+                held = None
+            else:
+                metas, pushes = [], []
+                removed = _walk_child(child, texts, metas, pushes)
+                settle(child, removed, metas, pushes)
+
+    for event, element in _pull_events(body, encoding, chunk_size):
+        if event == 'start':
+            if main is None and element.get('id') == 'main-content':
+                main = element
+                texts.append(None)     # main.text 的位置
+            continue
+        if element.get('id') == 'topbar':
+            board = _board_name(element)
+        elif element is main:
+            texts[0] = main.text
+            settle_until(None)
+            break
+        elif main is not None and element.getparent() is main:
+            texts[0] = main.text
+            settle_until(element)
+            metas, pushes = [], []
+            removed = _walk_child(element, texts, metas, pushes)
+            held = (element, removed, metas, pushes)
+
+    if main is None:
+        return None
+    return _page(board, meta, ''.join(filter(None, texts)), comments)
+
+
+def build_post(root, url):
+    """
+    Build the fields of a `PostItem` from a post page.
+
+    Input: lxml root of the page (`response.etree`), URL of the post
+    Output: tuple (post dict or None, list of (log level, message)),
+        None when the page is not a usable post
+    """
+    # 一次走訪 #main-content，取出內文 / meta / 推文
+    return post_fields(extract_post(root), url)
+
+
+def post_fields(page, url):
+    """`build_post` from the output of `extract_post` / `stream_post`."""
+    logs = []
+    if page is None:
+        logs.append((logging.WARNING, f'no main content: {url}'))
+        return None, logs
+    meta = page['meta']
+
+    ref = {
+        '作者': 'author',
+        '時間': 'published',
+        '標題': 'title',
+    }
+
+    # 目前為止的 post 字典有 ip, content, segments, board, id
+    post = {
+        'ip': page['ip'],
+        'content': page['content'],
+        'segments': page['segments'],
+        'board': page['board'],
+        'id': url.split('/')[-1].split('.html')[0]
+    }
+
+    # 將上面抽取的 meta 放進 post 字典，也就是多加 author / title / published
+    for k in meta.keys():
+        if k in ref:
+            post[ref[k]] = meta[k].strip()
+
+    # 確認是否有作者
+    if 'author' in post:
+        # 如果確認有作者，那麼抽離出作者的id，去掉暱稱
+        post['author'] = extract_author(post['author'])
+    else:
+        # 如果確認沒有作者，那麼就不要這筆資料了
+        logs.append((logging.WARNING, f'no author found: {url}'))
+        return None, logs
+
+    post['time'] = {
+        'published': dp.parse(post.pop('published'))
+    }
+    # 整篇文章共用一個抓取時間
+    crawled = datetime.now().replace(microsecond=0)
+
+    # 處理下方推文
+    # 推文旁邊的 IP/日期/時間 不一定每條都是三個都有:
+    # - 218.166.4.106 06/22
+    # - 05/30 18:28
+    # 推文沒有年份，從發文時間開始往下推算 (月份變小就是跨年了)
+    resolve = YearRollover(post['time']['published'])
+    comments = CommentList(crawled)
+    for tag, userid, text, ipdatetime in page['comments']:
+        parsed = parse_ipdatetime(ipdatetime)
+        if parsed is None:
+            logs.append((logging.WARNING, (
+                'Unknown comment published time detected!\n'
+                f'url: {url}\n'
+                f'author: {extract_author(userid)}'
+            )))
+            continue
+        ip, stamp = parsed
+        try:
+            published = resolve(*stamp)
+        except ValueError:
+            logs.append((logging.ERROR, (
+                f"unknown format: {ipdatetime.strip()} "
+                f"(author: {extract_author(userid)} | {url} )"
+            )))
+            continue
+
+        comments.append(
+            tag, extract_author(userid), text.lstrip(' :'), published, ip)
+    post['comments'] = comments
+
+    # quote (引述的部分 extract_post 已經分離出來了)
+    if page['quote']:
+        post['quote'] = page['quote']
+    post['time']['crawled'] = crawled
+
+    # 推噓文數量 (CommentList 邊填邊算好了)
+    post['count'] = comments.count
+    return post, logs
+
+
+def parse_post_page(body, url, encoding='utf-8', stream_size=0):
+    """
+    `build_post` straight from the downloaded bytes.
+
+    Bodies larger than `stream_size` bytes (0: never) are parsed with
+    `stream_post`. Only takes and returns picklable values, so it can run
+    in a worker process (see `scraptt.pool`).
+    """
+    if stream_size and len(body) > stream_size:
+        return post_fields(stream_post(body, encoding), url)
+    return build_post(page_tree(body.decode(encoding, 'replace')), url)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""PTT POST content segmentation."""
+import re
+
+BODY = 'body'
+QUOTE = 'quote'
+SIGNATURE = 'signature'
+SYSTEM = 'system'
+
+# 系統加上的行: 發信站 / 文章網址 / 編輯 (從標記開始到行尾)
+SYSTEM_RE = re.compile(r'※ 發信站|※ 文章網址|※ 編輯')
+QUOTE_MARK = '※ 引述'
+SIGNATURE_LINE = '--'
+# PTT 的簽名檔最多 6 行；這之內再出現的 "--" 是簽名檔的一部分 (上下框)，
+# 不是新的簽名檔
+SIGNATURE_MAX_LINES = 6
+FOOTER_MARK = '※ 發信站'
+
+
+class Segments:
+    """
+    The text of a post cut into (kind, start, end) spans.
+
+    Kinds are `BODY`, `QUOTE` (引述 lines and ": " lines), `SIGNATURE`
+    (from the "--" line(s) above 發信站 down to it) and `SYSTEM`
+    (發信站 / 文章網址 / 編輯). Spans cover `text` without gaps or
+    overlaps, in order; slice `text` with them instead of searching it
+    again.
+    """
+
+    __slots__ = ('text', 'spans')
+
+    def __init__(self, text, spans):
+        """__init__ method."""
+        self.text = text
+        self.spans = spans
+
+    def __iter__(self):  # noqa
+        return iter(self.spans)
+
+    def __len__(self):  # noqa
+        return len(self.spans)
+
+    def __eq__(self, other):  # noqa
+        if not isinstance(other, Segments):
+            return NotImplemented
+        return self.text == other.text and self.spans == other.spans
+
+    def slices(self, *kinds):
+        """Yield the text of every span of the given kinds."""
+        text = self.text
+        for kind, start, end in self.spans:
+            if kind in kinds:
+                yield text[start:end]
+
+    @property
+    def content(self):
+        """內文: body and signature, without the surrounding blank lines / "--"."""
+        return ''.join(self.slices(BODY, SIGNATURE)).strip('\r\n-').strip('\n ')
+
+    @property
+    def quote(self):
+        """引述的內容, one line per quoted line ('' if there is none)."""
+        return '\n'.join(q.strip('\n') for q in self.slices(QUOTE))
+
+    def as_list(self):
+        """[[kind, text], ...]."""
+        text = self.text
+        return [[kind, text[start:end]] for kind, start, end in self.spans]
+
+
+def segment(text):
+    """
+    Classify the lines of a post's text in a single pass.
+
+    - `SYSTEM`: from a 發信站 / 文章網址 / 編輯 mark to the end of its line
+    - `QUOTE`: lines starting with ": " (with the line break in front of
+      them), and from a "※ 引述" mark to the end of its line
+    - `SIGNATURE`: body lines from the "--" line above the 發信站 line
+      down to it; a "--" line at most `SIGNATURE_MAX_LINES` lines below
+      another one closes that signature instead of starting a new one
+      ("--\n簽名檔\n--\n※ 發信站" is all signature)
+    - `BODY`: everything else, line breaks included
+    Input: text of `#main-content` <str>
+    Output: `Segments`
+    """
+    spans = []
+
+    def add(kind, start, end):
+        if start >= end:
+            return
+        if spans and spans[-1][0] == kind and spans[-1][2] == start:
+            spans[-1] = (kind, spans[-1][1], end)
+        else:
+            spans.append((kind, start, end))
+
+    signature_at = None     # len(spans) when the signature's "--" line was seen
+    signature_line = 0      # line number of that "--" line
+    line = 0
+    length = len(text)
+    start = 0
+    while start <= length:
+        eol = text.find('\n', start)
+        if eol < 0:
+            eol = length
+        system = SYSTEM_RE.search(text, start, eol)
+        cut = system.start() if system else eol
+
+        if start > 0 and text.startswith(': ', start, cut):
+            # 把前面的換行一起算進引述 (跟原本 "\n: .*" 的行為一樣)
+            kind, first, last = spans[-1]
+            if last == start and first < start:
+                spans[-1] = (kind, first, start - 1)
+                if first == start - 1:
+                    spans.pop()
+            add(QUOTE, start - 1, cut)
+        else:
+            quote = text.find(QUOTE_MARK, start, cut)
+            if quote < 0:
+                if text[start:cut].rstrip('\r') == SIGNATURE_LINE and (
+                        signature_at is None
+                        or line - signature_line - 1 > SIGNATURE_MAX_LINES):
+                    # 簽名檔從這行開始，不跟前面的內文合併
+                    signature_at = len(spans)
+                    signature_line = line
+                    spans.append((BODY, start, cut))
+                else:
+                    add(BODY, start, cut)
+            else:
+                add(BODY, start, quote)
+                add(QUOTE, quote, cut)
+
+        if system:
+            if system.group() == FOOTER_MARK and signature_at is not None:
+                spans[signature_at:] = [
+                    (SIGNATURE if kind == BODY else kind, first, last)
+                    for kind, first, last in spans[signature_at:]
+                ]
+                signature_at = None
+            add(SYSTEM, cut, eol)
+        add(BODY, eol, min(eol + 1, length))
+        line += 1
+        start = eol + 1
+    return Segments(text, spans)
@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 """Main crawler."""
-import re
 from datetime import datetime
-from itertools import groupby
+from functools import partial
 
 import scrapy
-import dateutil.parser as dp
-
-from .parsers.post import mod_content, extract_author, extract_ip
-from .parsers.comment import comment_counter, split_ip_and_publish_time
+from scrapy import signals
+
+from .parsers.post import build_post, parse_post_page
+from .parsers.index import (
+    index_url, extract_topics, topic_timestamps, latest_index
+)
+from .index_search import IndexSearch
+from .window import IndexWindows
+from ..ids import (
+    board_from_url, topic_timestamp, article_id_from_url, article_key
+)
 from ..items import PostItem
+from ..bloom import article_token
+from ..store import CheckpointStore
 
 
 class PttSpider(scrapy.Spider):
@@ -20,21 +28,34 @@ class PttSpider(scrapy.Spider):
     handle_httpstatus_list = [404]
     custom_settings = {
         'ITEM_PIPELINES': {
-           # 'scraptt.pipelines.PTTPipeline': 300,
+           # 'scraptt.pipelines.MongoBulkPipeline': 300,
            # 'scraptt.pipelines.ElasticsearchPipeline': 400,
-           'scraptt.pipelines.JsonPipeline': 500
+           'scraptt.pipelines.JsonPipeline': 500,
+           'scraptt.pipelines.SeenFilterPipeline': 900
         }
     }
+    # 由 ParsePoolExtension 設定 (POST_PARSE_PROCESSES > 0 時)
+    parse_pool = None
+    # all_index 模式的 index 頁由 IndexWindows 分批產生
+    index_windows = None
 
     def __init__(self, *args, **kwargs):
         """__init__ method.
 
         :param: boards: comma-separated board list
         :param: since: start crawling from this date (format: YYYYMMDD)
+        :param: resume: only crawl pages and posts past the saved checkpoint
+        :param: skip_seen: skip posts already in the crawled-articles filter
+        :param: frontier: pull (board, index range) work from the shared
+            frontier; `boards` is then optional and only seeds it
         """
+        self.use_frontier = True if kwargs.pop('frontier', None) is not None else False
+
         # 從 scrapy 指令參數中擷取 boards 參數
-        boards = kwargs.pop('boards')
-        if boards == '_all':
+        boards = kwargs.pop('boards', '')
+        if not boards:
+            self.boards = []
+        elif boards == '_all':
             from cockroach.db import Session, Meta
             session = Session()
             self.boards = [i[0] for i in session.query(Meta.name)]
@@ -61,7 +82,6 @@ class PttSpider(scrapy.Spider):
 
         year = kwargs.pop('year', None)
         self.year = datetime.strptime(year, '%Y').date() if year is not None else None
-        self.index = 1
         self.logger.warning(f"接收year參數: {self.year}")
 
         # # Debug 用
@@ -69,165 +89,329 @@ class PttSpider(scrapy.Spider):
         # self.logger.warning(f"接收output_path參數: {self.output_path}")
 
         self.all_index = True if kwargs.pop('all_index', None) is not None else False
+        self.resume = True if kwargs.pop('resume', None) is not None else False
+        # 跳過已經爬過的文章 (見 pipelines.SeenFilterPipeline)
+        self.skip_seen = True if kwargs.pop('skip_seen', None) is not None else False
+        # resume / all_index 模式會記錄每個版爬到哪裡 (見 closed())
+        self.checkpoints = None
+        self.resume_after = {}
 
 
     def start_requests(self):
         """
         spider首個會呼叫的方法
         """
+        if self.use_frontier:
+            # 工作由 FrontierExtension 分配，這裡只負責把看板切成工作單位
+            for board in self.boards:
+                yield scrapy.Request(
+                    index_url(board),
+                    cookies={'over18': '1'},
+                    callback=self.parse_frontier_seed,
+                    cb_kwargs=dict(board=board),
+                    dont_filter=True
+                )
+            return
+
+        if self.resume or self.all_index:
+            self.checkpoints = CheckpointStore.from_settings(
+                self.settings, 'CHECKPOINT_DB')
+            self.crawler.signals.connect(
+                self.item_scraped, signal=signals.item_scraped)
+        if self.all_index:
+            self.index_windows = IndexWindows(
+                self.crawler, self, self._window_request, self.checkpoints)
         for board in self.boards:
-            if self.since or self.all_index:
-                url = f'https://www.ptt.cc/bbs/{board}/index.html'
+            if self.resume:
+                callback = self.parse_resume_range
+            elif self.all_index:
+                callback = self.parse_index
+            elif self.since:
+                # 先從 index.html 得知最新的 index，再往回找出 since 當天所在的 index
+                callback = self.parse_since_range
             elif self.year:
-                url = f'https://www.ptt.cc/bbs/{board}/index{self.index}.html'
+                # 先從 index.html 得知最新的 index，再用二分搜尋找出目標年份的範圍
+                callback = self.parse_year_range
             else:
                 self.logger.warning(f"沒有since參數也沒有year參數")
                 return
             yield scrapy.Request(
-                url,
+                index_url(board),
                 cookies={'over18': '1'},
-                callback=self.parse_index
+                callback=callback,
+                cb_kwargs=dict(board=board)
             )
 
-    def parse_index(self, response):
+    def parse_frontier_seed(self, response, board):
+        """Split `board` into work units of the shared frontier."""
+        latest = latest_index(response.etree)
+        dfd = self.frontier.seed(
+            self.name, board, latest,
+            self.settings.getint('FRONTIER_UNIT_SIZE')
+        )
+        dfd.addCallback(self._seeded, board, latest)
+        return dfd
+
+    def _seeded(self, _, board, latest):
+        self.logger.info(f'{board}: seeded index1 - index{latest}')
+        return []
+
+    def frontier_requests(self, unit):
+        """Requests for one leased work unit (see FrontierExtension)."""
+        for index in range(unit.index_from, unit.index_to + 1):
+            yield scrapy.Request(
+                index_url(unit.board, index),
+                cookies={'over18': '1'},
+                callback=self.parse_index_2,
+                cb_kwargs=dict(board=unit.board, index=index)
+            )
+
+    def parse_resume_range(self, response, board):
         """
-        Parse index pages.
-        排除置底文
+        Request every index page of `board` past its checkpoint.
+
+        沒有 checkpoint 的版就從 index1 開始 (等同 all_index)；有的話從上次
+        最大的 index 頁開始 (那一頁當時可能還沒滿)，po文則只爬比上次最新的
+        文章更新的。
         """
-        # 索引頁面中每篇po文的連結 CSS
-        item_css = '.r-ent .title a'
+        latest = latest_index(response.etree)
+        last_index, last_article = self.checkpoints.get(board)
+        first = last_index or 1
+        if last_article is not None:
+            self.resume_after[board] = article_key(last_article)
+        self.logger.info(
+            f'{board}: resume from index{first} (latest {latest}), '
+            f'after {last_article}'
+        )
+        for index in range(first, latest + 1):
+            yield scrapy.Request(
+                index_url(board, index),
+                cookies={'over18': '1'},
+                callback=self.parse_index,
+                cb_kwargs=dict(board=board, index=index)
+            )
+        yield scrapy.Request(
+            index_url(board),
+            cookies={'over18': '1'},
+            callback=self.parse_index,
+            cb_kwargs=dict(board=board)
+        )
 
-        if response.url.endswith('index.html'):
-            # 只有在 index.html 時會需要處理置底文的情況
-            topics = response.dom('.r-list-sep').prev_all(item_css)
-        else:
-            topics = response.dom(item_css)
+    def parse_since_range(self, response, board):
+        """
+        Resolve the index pages newer than `self.since` on `board`.
 
-        list_of_topics = list(topics.items())
+        The first page is the oldest one whose newest post is not before
+        `since`. It is usually close to `index.html`, so the search gallops
+        back from the latest page before bisecting; every page from there
+        up to `index.html` is then requested at once.
+        """
+        latest = latest_index(response.etree)
+        cutoff = datetime.combine(self.since, datetime.min.time()).timestamp()
+        search = IndexSearch(
+            board, 1, latest + 1,
+            lambda stamps: max(stamps) >= cutoff,
+            empty=True, latest=latest, gallop=True,
+            max_probes=self.settings.getint('INDEX_SEARCH_MAX_PROBES')
+        )
+        return self._search(search, self._since_first_found)
 
-        if self.all_index:
-            # 找出"上頁"按鈕的連結
-            prev_url = response.dom('.btn.wide:contains("上頁")').attr('href')
-            self.logger.info(f'index link: {prev_url}')
-            latest_index = re.search(r"index(\d{1,6})\.html", prev_url).group(1)
-            self.logger.info(f'latest_index: {latest_index}')
-            latest_index = int(latest_index)
-            self.logger.info(f'response.url: {response.url}')
-            board = re.search(r"www\.ptt\.cc\/bbs\/([\w\d\-_]{1,30})\/", response.url).group(1)
-
-            for index in range(1, latest_index + 1):
-                url = f"https://www.ptt.cc/bbs/{board}/index{index}.html"
-                self.logger.info(f"index link: {url}")
+    def _since_first_found(self, search):
+        first = search.result
+        self.logger.info(
+            f'{search.board}: index{first} - index.html since {self.since} '
+            f'({search.probes} probes)'
+        )
+        for index in range(first, search.latest + 1):
+            yield scrapy.Request(
+                index_url(search.board, index),
+                cookies={'over18': '1'},
+                callback=self.parse_index
+            )
+        # 搜尋期間可能又多了新的一頁，index.html 一定是最新的
+        yield scrapy.Request(
+            index_url(search.board),
+            cookies={'over18': '1'},
+            callback=self.parse_index
+        )
 
-                yield scrapy.Request(
-                    url,
-                    cookies={'over18': '1'},
-                    callback=self.parse_index_2
-                )
+    def parse_year_range(self, response, board):
+        """
+        Resolve the index pages of `self.year` on `board` by bisection.
+
+        第一頁: newest post on the page is in (or after) the target year;
+        最後一頁: the page before the first one whose oldest post is past
+        the target year. Both are found with `IndexSearch`, then every
+        page in between is requested at once.
+        """
+        latest = latest_index(response.etree)
+        start = datetime(self.year.year, 1, 1).timestamp()
+        search = IndexSearch(
+            board, 1, latest + 1,
+            lambda stamps: max(stamps) >= start,
+            empty=True, latest=latest
+        )
+        return self._search(search, self._year_first_found)
+
+    def _year_first_found(self, search):
+        end = datetime(self.year.year + 1, 1, 1).timestamp()
+        first = search.result
+        self.logger.info(
+            f'{search.board}: first index of {self.year.year} is {first} '
+            f'({search.probes} probes)'
+        )
+        last_search = IndexSearch(
+            search.board, first, search.latest + 1,
+            lambda stamps: min(stamps) >= end,
+            empty=False, latest=search.latest
+        )
+        return self._search(last_search, partial(self._year_last_found, first))
+
+    def _year_last_found(self, first, search):
+        last = search.result - 1
+        self.logger.info(
+            f'{search.board}: index{first} - index{last} '
+            f'cover {self.year.year} ({search.probes} probes)'
+        )
+        for index in range(first, last + 1):
+            yield scrapy.Request(
+                index_url(search.board, index),
+                cookies={'over18': '1'},
+                callback=self.parse_index
+            )
 
-        elif self.since is not None: # 只有在有 since 參數的情況下，才需要
-            
-            # reverse order to conform to timeline
-            for topic in reversed(list_of_topics):
-                title = topic.text()      # po文標題
-                href = topic.attr('href') # po文連結
-                timestamp = re.search(r'(\d{10})', href).group(1)
-                post_time = datetime.fromtimestamp(int(timestamp)) # po文日期
-
-                if post_time.date() < self.since:  # 如果po文時間比我們要的最早時間還要早
-                    return
+    def _search(self, search, found):
+        """Request the next probe of `search`, or pass it on to `found`."""
+        if search.done:
+            return found(search)
+        index = search.next_probe()
+        # probe 不經過 dupefilter，之後真正爬這些 index 時才不會被濾掉
+        return [scrapy.Request(
+            index_url(search.board, index),
+            cookies={'over18': '1'},
+            callback=self.parse_probe,
+            cb_kwargs=dict(search=search, found=found, index=index),
+            dont_filter=True
+        )]
+
+    def parse_probe(self, response, search, found, index):
+        """Feed one probed index page into its `IndexSearch`."""
+        search.feed(index, topic_timestamps(response.etree))
+        return self._search(search, found)
+
+    def parse_index(self, response, board=None, index=None):
+        """
+        Parse index pages.
+        排除置底文
+        """
+        board = board or board_from_url(response.url)
+        if self.resume:
+            after = self.resume_after.get(board)
+            for title, href in extract_topics(response.etree):
+                key = article_key(article_id_from_url(href))
+                if key is None or (after is not None and key <= after):
+                    continue
+                if self._seen(board, href):
+                    continue
+                self.logger.info(f'+ {title}, {href}')
+                yield self._post_request(board, href)
+            if index is not None:
+                self.checkpoints.mark_index(board, index)
+
+        elif self.all_index:
+            # index1 - 最新一頁不一次全部送出，由 IndexWindows 隨著佇列消化分批產生
+            latest = latest_index(response.etree)
+            self.logger.info(f'{board}: latest index {latest}')
+            yield from self.index_windows.start(board, latest)
+
+        elif self.since is not None:
+            # parse_since_range 已經算好範圍，這裡只需要濾掉 since 之前的po文
+            for title, href in extract_topics(response.etree):
+                timestamp = topic_timestamp(href)
+                if timestamp is None:
+                    continue
+                post_time = datetime.fromtimestamp(timestamp)
+                if post_time.date() < self.since:
+                    continue
+                if self._seen(board, href):
+                    continue
                 self.logger.info(f'+ {title}, {href}, {post_time}')
                 yield scrapy.Request(
                     href, cookies={'over18': '1'}, callback=self.parse_post
                 )
-            # 找出"上頁"按鈕的連結
-            prev_url = response.dom('.btn.wide:contains("上頁")').attr('href')
-            self.logger.info(f'index link: {prev_url}')
-            if prev_url:
 
-                yield scrapy.Request(
-                    prev_url, cookies={'over18': '1'}, callback=self.parse_index
-                )
-        
         elif self.year is not None:
-            for topic in list_of_topics[:-1]:
-                title = topic.text()      # po文標題
-                href = topic.attr('href') # po文連結
-                timestamp = re.search(r'(\d{10})', href).group(1)
-                post_time = datetime.fromtimestamp(int(timestamp)) # po文日期
-
-                if post_time.year > self.year.year: # 如果po文年份比我們要的年份更晚
-                    break
-
-                elif post_time.year < self.year.year:
+            # parse_year_range 已經算好範圍，這裡只需要濾掉頭尾兩頁中其他年份的po文
+            for title, href in extract_topics(response.etree):
+                timestamp = topic_timestamp(href)
+                if timestamp is None:
+                    continue
+                post_time = datetime.fromtimestamp(timestamp)
+                if post_time.year != self.year.year:
+                    continue
+                if self._seen(board, href):
                     continue
-                else:
-                    self.logger.info(f'+ {title}, {href}, {post_time}')
-                    yield scrapy.Request(
-                        href,
-                        cookies={'over18': '1'},
-                        callback=self.parse_post
-                    )
-
-            last_post_in_a_index_page = list_of_topics[-1]
-            href = last_post_in_a_index_page.attr('href') # po文連結
-            timestamp = re.search(r'(\d{10})', href).group(1)
-            post_time = datetime.fromtimestamp(int(timestamp)) # po文日期
-
-            board = re.search(r"www\.ptt\.cc\/bbs\/([\w\d\-_]{1,30})\/", href).group(1)
-            self.index += 1
-            new_page_url = f"https://www.ptt.cc/bbs/{board}/index{self.index}.html"
-            self.logger.info(f"new_page_url: {new_page_url}")
-            
-            if post_time.year > self.year.year: # 如果po文年份比我們要的年份更晚
-                return
-
-            elif post_time.year < self.year.year:
-                self.logger.info('此頁最後一篇貼文年份小於目標年份，繼續爬下一個index')
-                yield scrapy.Request(
-                    new_page_url,
-                    cookies={'over18': '1'},
-                    callback=self.parse_index
-                ) 
-            else:
-                self.logger.info('等魚')
                 self.logger.info(f'+ {title}, {href}, {post_time}')
-                
                 yield scrapy.Request(
                     href,
                     cookies={'over18': '1'},
                     callback=self.parse_post
-                ) 
-                yield scrapy.Request(
-                    new_page_url,
-                    cookies={'over18': '1'},
-                    callback=self.parse_index
                 )
 
-    def parse_index_2(self, response):
-        item_css = '.r-ent .title a'
-
-        if response.url.endswith('index.html'):
-            # 只有在 index.html 時會需要處理置底文的情況
-            topics = response.dom('.r-list-sep').prev_all(item_css)
-        else:
-            topics = response.dom(item_css)
-
-        list_of_topics = list(topics.items())
-
-        for topic in list_of_topics:
-            title = topic.text()      # po文標題
-            href = topic.attr('href') # po文連結
-            timestamp = re.search(r'(\d{10})', href).group(1)
-            post_time = datetime.fromtimestamp(int(timestamp)) # po文日期
+    def _window_request(self, board, index):
+        """Request for index page `index` of `board` (see IndexWindows)."""
+        return scrapy.Request(
+            index_url(board, index),
+            cookies={'over18': '1'},
+            callback=self.parse_index_2,
+            errback=self.index_windows.failed,
+            cb_kwargs=dict(board=board, index=index),
+            meta=self.index_windows.page_meta(board, index)
+        )
 
-            self.logger.info(f'+ {title}, {href}, {post_time}')
-            yield scrapy.Request(
-                href,
-                cookies={'over18': '1'},
-                callback=self.parse_post
+    def parse_index_2(self, response, board=None, index=None):
+        """Request every post on an index page (all_index mode)."""
+        board = board or board_from_url(response.url)
+        windowed = 'index_window_page' in response.meta
+        for title, href in extract_topics(response.etree):
+            if self._seen(board, href):
+                continue
+            self.logger.info(f'+ {title}, {href}')
+            kwargs = (
+                self.index_windows.post_kwargs(board, index) if windowed else {}
             )
+            yield self._post_request(board, href, **kwargs)
+        if self.checkpoints is not None and index is not None:
+            self.checkpoints.mark_index(board, index)
+        if windowed:
+            yield from self.index_windows.parsed(board, index)
+
+
+    def _post_request(self, board, href, **kwargs):
+        """Request for a post; with checkpoints, it counts as unfinished until written."""
+        if self.checkpoints is not None:
+            article_id = article_id_from_url(href)
+            self.checkpoints.article_sent(board, article_id)
+            kwargs.setdefault('meta', {})['checkpoint_article'] = (
+                board, article_id)
+        return scrapy.Request(
+            href, cookies={'over18': '1'}, callback=self.parse_post, **kwargs
+        )
 
+    def item_scraped(self, item, response, spider):  # noqa
+        article = response.meta.get('checkpoint_article')
+        if article is not None:
+            self.checkpoints.article_done(*article)
+
+    def _seen(self, board, href):
+        """True if `skip_seen` is on and the post is already crawled."""
+        seen_filter = getattr(self, 'seen_filter', None)
+        if not self.skip_seen or seen_filter is None:
+            return False
+        if article_token(board, article_id_from_url(href)) in seen_filter:
+            self.crawler.stats.inc_value('seen_filter/skipped', spider=self)
+            return True
+        return False
 
     def parse_post(self, response):
         """
@@ -241,201 +425,79 @@ class PttSpider(scrapy.Spider):
             board: 版名
             id: 文章id
             quote: <String>                 # 如果是回文的話，此欄位存引述的內容
+            segments: Segments              # 見 parsers.segment，內文 / 引述 /
+                                            # 簽名檔 / 系統行的 (kind, start, end)；
+                                            # PostItem.segments，不會被匯出
             time: {
                 published: <Datetime>,
                 crawled: <Datatime>
             }    
-            comments: [
-                {
-                    type: "推|噓|→",
-                    author: ,
-                    content: ,
-                    time: {
-                        published: <Datetime>,
-                        crawled: <Datetime>
+            comments: CommentList          # 見 parsers.comment，匯出時是
+                [                          # 下面這種 dict 的 list
+                    {
+                        type: "推|噓|→",
+                        author: ,
+                        content: ,
+                        time: {
+                            published: <Datetime>,
+                            crawled: <Datetime>
+                        },
+                        ip: 
                     },
-                    ip: 
-                },
-                
-            count: {                       #推,噓,回文數量 <defaultdict>
+                ]
+            count: {                       #推,噓,回文數量 <Counter>
                 "推": <int>,
                 "噓": <int>,
                 "→": <int>
 
             } 
 
+        實際的解析在 parsers.post.build_post；設定 POST_PARSE_PROCESSES 時
+        改在 process pool 裡跑 (見 scraptt.pool)，回傳的是 Deferred。
+        大於 POST_STREAM_SIZE 的po文用 parsers.post.stream_post 邊讀邊解析。
         """
 
         if response.status == 404:
             self.logger.warning(f'404: {response.url}')
-            return None
-
-        # 抓出主文
-        content = (
-            response.dom('#main-content')
-            .clone()
-            .children()
-            .remove('span[class^="article-meta-"]')
-            .remove('div.push')
-            .end()
-            .html()
-        )
-
-        # 抓出meta: 作者/看板/標題/時間
-        meta = dict(
-            (_.text(), _.next().text())
-            for _
-            in response.dom('.article-meta-tag').items()
-        )
-
-        ref = {
-            '作者': 'author',
-            '時間': 'published',
-            '標題': 'title',
-        }
-
-        # 目前為止的 post 字典有 ip, content, board, id
-        post = {
-            'ip': extract_ip(content),
-            'content': mod_content(content),
-            'board': response.dom('#topbar a.board').remove('*').text().strip(),
-            'id': response.url.split('/')[-1].split('.html')[0]
-        }
-        # post = dict()
-
-        # # 抽取文章ip
-        # post['ip'] = extract_ip(content)
-
-        # # 抽取清洗過的內文
-        # post['content'] = mod_content(content)
-
-        # # 抽取版名
-        # post['board'] = (
-        #     response.dom('#topbar a.board').remove('*').text().strip()
-        # )
-
-        # # 從URI抽取文章ID
-        # post['id'] = (
-        #     response.url
-        #     .split('/')[-1]
-        #     .split('.html')[0]
-        # )
-
-
-        # 將上面抽取的 meta 放進 post 字典，也就是多加 author / title / published
-        # meta_mod = dict()
-        for k in meta.keys():
-            if k in ref:
-                post[ref[k]] = meta[k].strip()
-
-        # 確認是否有作者
-        if 'author' in post:
-            # 如果確認有作者，那麼抽離出作者的id，去掉暱稱
-            post['author'] = extract_author(post['author'])
+            return self._post_items((None, []), response)
+
+        stream_size = self.settings.getint('POST_STREAM_SIZE')
+        if self.parse_pool is not None:
+            # 交給 process pool 解析，解析完 Deferred 才帶著 items 回來
+            dfd = self.parse_pool.submit(
+                parse_post_page, response.body, response.url,
+                response.encoding, stream_size
+            )
+            dfd.addCallback(self._post_items, response)
+            return dfd
+        if stream_size and len(response.body) > stream_size:
+            # 超大的po文不建整棵 DOM (也不碰 response.text)
+            result = parse_post_page(
+                response.body, response.url, response.encoding, stream_size)
+        else:
+            result = build_post(response.etree, response.url)
+        return self._post_items(result, response)
+
+    def _post_items(self, result, response):
+        post, logs = result
+        for level, message in logs:
+            self.logger.log(level, message)
+        if post is None:
+            # 刪除的文章沒有 item，也算處理完了
+            article = response.meta.get('checkpoint_article')
+            if article is not None:
+                self.checkpoints.article_done(*article)
+            items = []
         else:
-            # 如果確認沒有作者，那麼就不要這筆資料了
-            self.logger.warning(f'no author found: {response.url}')
+            items = [PostItem(**post)]
+        if self.index_windows is not None:
+            self.index_windows.post_items(response, items)
+        return items
+
+    def closed(self, reason):
+        """Persist crawl marks, but only for crawls that ran to the end."""
+        if self.checkpoints is None:
             return
-
-
-        # 處理下方推文
-        # 推文旁邊的 IP/日期/時間 不一定每條都是三個都有:
-        # - 218.166.4.106 06/22
-        # - 05/30 18:28
-        comments = []
-        for _ in response.dom('.push').items():
-            published, ip = split_ip_and_publish_time(_('.push-ipdatetime').text())
-            if published is None and ip is None:
-            # 這種情況下，不是真的回文，而常常是樓主複製前面已出現過的回文
-                continue
-
-            comment = {
-                'type': _('.push-tag').text(),
-                'author': extract_author(_('.push-userid').text()),
-                'content': _('.push-content').text().lstrip(' :'),
-                'time': {
-                    'published': published,
-                    'crawled': datetime.now().replace(microsecond=0),
-                },
-                'ip': ip,
-            }
-            
-            # BEGIN: 找出回文發表時間
-            # 如果前面的 published is None, 還不確定是否還需要下面這一段
-            # 要再確認可不可以刪掉
-            time_cands = re.findall(
-                '\d{1,2}/\d{1,2}\s\d{1,2}:\d{1,2}',
-                comment['time']['published']
-            )
-            if time_cands:
-                comment['time']['published'] = time_cands[-1]
-                comments.append(comment)
-            else:
-                self.logger.warning(
-                    (
-                        'Unknown comment published time detected!\n'
-                        f'url: {response.url}\n'
-                        f'author: {comment["author"]}'
-                    )
-                )
-            # END: 找出回文發表時間
-
-        post['time'] = {
-            'published': dp.parse(post.pop('published'))
-        }
-        post['comments'] = comments
-
-        # Merge comments with consecutive comments with the same author.
-        con = []
-        for author, group in groupby(comments, key=lambda x: x['author']):
-            d = {}
-            for comment in group:
-                if d:
-                    d['content'] += comment['content']
-                else:
-                    d = comment
-            con.append(d)
-
-        # add YEAR to comments
-        year = post['time']['published'].year
-        latest_month = post['time']['published'].month
-        current_year = datetime.now().year
-        _comments = []
-        for comment in comments:
-            try:
-                published = dp.parse(comment['time']['published'])
-                _comments.append(comment)
-            except ValueError:
-                self.logger.error(
-                    (
-                        f"unknown format: {comment['time']['published']} "
-                        f"(author: {comment['author']} | {response.url} )"
-                    )
-                )
-                continue
-            if (
-                published.month < latest_month and
-                published.year < current_year
-            ):
-                year += 1
-            comment['time']['published'] = published.replace(year=year)
-            latest_month = published.month
-        post['comments'] = _comments
-        # quote
-        msg = post['content']
-        qs = re.findall('※ 引述.*|\n: .*', msg)
-        for q in qs:
-            msg = msg.replace(q, '')
-        qs = '\n'.join([i.strip('\n') for i in qs])
-        post['content'] = msg.strip('\n ')
-        if qs:
-            post['quote'] = qs
-        post['time']['crawled'] = datetime.now().replace(microsecond=0)
-
-        # 推噓文數量
-        post.update(
-            {'count': comment_counter(post['comments'])}
-        )
-
-
-        yield PostItem(**post)
+        if reason == 'finished':
+            self.checkpoints.save()
+        self.checkpoints.close()
@@ -2,15 +2,20 @@
 """Main crawler."""
 import re
 import os
-from datetime import datetime
 from itertools import groupby
 
 import scrapy
 import dateutil.parser as dp
+from scrapy import signals
 
 from .parsers.post import mod_content, extract_author, extract_ip
 from .parsers.comment import comment_counter, split_ip_and_publish_time
+from .parsers.index import index_url, latest_index
+from .window import IndexWindows
+from ..bloom import article_token
+from ..ids import board_from_url, article_id_from_url, article_key
 from ..items import _ArticleItem
+from ..store import CheckpointStore
 
 
 class PttSpider(scrapy.Spider):
@@ -24,8 +29,8 @@ class PttSpider(scrapy.Spider):
            # 'scraptt.pipelines.PTTPipeline': 300,
            # 'scraptt.pipelines.ElasticsearchPipeline': 400,
            # 'scraptt.pipelines.JsonPipeline': 500
-           'scraptt.pipelines.HTMLFilePipeline': 500
-
+           'scraptt.pipelines.HTMLFilePipeline': 500,
+           'scraptt.pipelines.SeenFilterPipeline': 900
         }
     }
 
@@ -34,11 +39,22 @@ class PttSpider(scrapy.Spider):
 
         :param: boards: comma-separated board list
         :param: since: start crawling from this date (format: YYYYMMDD)
+        :param: resume: only crawl pages and posts past the saved checkpoint
+        :param: skip_seen: skip posts already in the crawled-articles filter
+        :param: frontier: pull (board, index range) work from the shared
+            frontier; `boards` is then optional and only seeds it
         """
-        self.boards = kwargs.pop('boards').split(',')
+        self.use_frontier = kwargs.pop('frontier', None) is not None
+        boards = kwargs.pop('boards', '')
+        self.boards = boards.split(',') if boards else []
         self.all = kwargs.pop('all', None)
         self.index_from = kwargs.pop('index_from', None)
         self.index_to = kwargs.pop('index_to', None)
+        self.resume = kwargs.pop('resume', None)
+        self.skip_seen = kwargs.pop('skip_seen', None)
+        self.checkpoints = None
+        self.resume_after = {}
+        self.index_windows = None
 
         self.logger.info(f"boards: {self.boards}")
         self.logger.info(f"all: {self.all}")
@@ -48,13 +64,40 @@ class PttSpider(scrapy.Spider):
 
     def start_requests(self):
         """Request handler."""
-        if self.all is not None:
+        if self.use_frontier:
             for board in self.boards:
-                url = f'https://www.ptt.cc/bbs/{board}/index.html'
                 yield scrapy.Request(
-                    url,
+                    index_url(board),
+                    cookies={'over18': '1'},
+                    callback=self.parse_frontier_seed,
+                    cb_kwargs=dict(board=board),
+                    dont_filter=True
+                )
+        elif self.resume is not None:
+            self.checkpoints = CheckpointStore.from_settings(
+                self.settings, 'CHECKPOINT_DB')
+            self.crawler.signals.connect(
+                self.item_scraped, signal=signals.item_scraped)
+            for board in self.boards:
+                yield scrapy.Request(
+                    index_url(board),
                     cookies={'over18': '1'},
-                    callback=self.parse_latest_index
+                    callback=self.parse_resume_index,
+                    cb_kwargs=dict(board=board)
+                )
+        elif self.all is not None:
+            self.checkpoints = CheckpointStore.from_settings(
+                self.settings, 'CHECKPOINT_DB')
+            self.crawler.signals.connect(
+                self.item_scraped, signal=signals.item_scraped)
+            self.index_windows = IndexWindows(
+                self.crawler, self, self._window_request, self.checkpoints)
+            for board in self.boards:
+                yield scrapy.Request(
+                    index_url(board),
+                    cookies={'over18': '1'},
+                    callback=self.parse_latest_index,
+                    cb_kwargs=dict(board=board)
                 )
         else:
             board = self.boards[0]
@@ -66,7 +109,44 @@ class PttSpider(scrapy.Spider):
                     callback=self.parse_index
                 )
 
-    def parse_index(self, response):
+    def parse_frontier_seed(self, response, board):
+        """Split `board` into work units of the shared frontier."""
+        latest = latest_index(response.etree)
+        dfd = self.frontier.seed(
+            self.name, board, latest,
+            self.settings.getint('FRONTIER_UNIT_SIZE')
+        )
+        return dfd.addCallback(lambda _: [])
+
+    def frontier_requests(self, unit):
+        """Requests for one leased work unit (see FrontierExtension)."""
+        for index in range(unit.index_from, unit.index_to + 1):
+            yield scrapy.Request(
+                index_url(unit.board, index),
+                cookies={'over18': '1'},
+                callback=self.parse_index,
+                cb_kwargs=dict(board=unit.board, index=index)
+            )
+
+    def parse_resume_index(self, response, board):
+        """Request every index page of `board` past its checkpoint."""
+        latest = latest_index(response.etree)
+        last_index, last_article = self.checkpoints.get(board)
+        if last_article is not None:
+            self.resume_after[board] = article_key(last_article)
+        self.logger.info(
+            f'{board}: resume from index{last_index or 1} (latest {latest}), '
+            f'after {last_article}'
+        )
+        for index in range(last_index or 1, latest + 1):
+            yield scrapy.Request(
+                index_url(board, index),
+                cookies={'over18': '1'},
+                callback=self.parse_index,
+                cb_kwargs=dict(board=board, index=index)
+            )
+
+    def parse_index(self, response, board=None, index=None):
         """Parse index pages."""
         # exclude "置底文"
         item_css = '.r-ent .title a'
@@ -75,54 +155,94 @@ class PttSpider(scrapy.Spider):
         else:
             topics = response.dom(item_css)
 
+        board = board or board_from_url(response.url)
+        after = self.resume_after.get(board)
+        seen_filter = getattr(self, 'seen_filter', None)
+        windowed = 'index_window_page' in response.meta
         for topic in list(topics.items()):
             title = topic.text()
             href = topic.attr('href')
-            yield scrapy.Request(
-                href,
-                cookies={'over18': '1'},
-                callback=self.parse_post
+            if self.skip_seen is not None and seen_filter is not None:
+                if article_token(board, article_id_from_url(href)) in seen_filter:
+                    self.crawler.stats.inc_value(
+                        'seen_filter/skipped', spider=self)
+                    continue
+            if after is not None:
+                key = article_key(article_id_from_url(href))
+                if key is not None and key <= after:
+                    continue
+            kwargs = (
+                self.index_windows.post_kwargs(board, index) if windowed else {}
             )
-
-    def parse_latest_index(self, response):
-        """Parse index pages."""
-        # 找出"上頁"按鈕的連結
-        prev_url = response.dom('.btn.wide:contains("上頁")').attr('href')
-        self.logger.info(f'index link: {prev_url}')
-        latest_index = re.search(r"index(\d{1,6})\.html", prev_url).group(1)
-        self.logger.info(f'latest_index: {latest_index}')
-        latest_index = int(latest_index)
-        self.logger.info(f'response.url: {response.url}')
-        board = re.search(r"www\.ptt\.cc\/bbs\/([\w\d\-_]{1,30})\/", response.url).group(1)
-        print(f"board: {board}")
-        print(f"latest index: {latest_index}")
-
-        for index in range(1, latest_index + 1):
-            url = f"https://www.ptt.cc/bbs/{board}/index{index}.html"
-            self.logger.info(f"index link: {url}")
-
+            # parse_post 只讀 response.body，不需要 DOM
+            kwargs.setdefault('meta', {})['dom'] = False
+            if self.checkpoints is not None:
+                # 寫進檔案之前都算沒做完，下次 resume 會再試
+                article_id = article_id_from_url(href)
+                self.checkpoints.article_sent(board, article_id)
+                kwargs['meta']['checkpoint_article'] = (board, article_id)
             yield scrapy.Request(
-                url,
+                href,
                 cookies={'over18': '1'},
-                callback=self.parse_index
+                callback=self.parse_post,
+                **kwargs
             )
-
+        if self.checkpoints is not None and index is not None:
+            self.checkpoints.mark_index(board, index)
+        if windowed:
+            yield from self.index_windows.parsed(board, index)
+
+    def parse_latest_index(self, response, board):
+        """Start generating the index pages of `board` (all mode)."""
+        # index1 - 最新一頁不一次全部送出，由 IndexWindows 隨著佇列消化分批產生
+        latest = latest_index(response.etree)
+        self.logger.info(f'{board}: latest index {latest}')
+        return self.index_windows.start(board, latest)
+
+    def _window_request(self, board, index):
+        """Request for index page `index` of `board` (see IndexWindows)."""
+        return scrapy.Request(
+            index_url(board, index),
+            cookies={'over18': '1'},
+            callback=self.parse_index,
+            errback=self.index_windows.failed,
+            cb_kwargs=dict(board=board, index=index),
+            meta=self.index_windows.page_meta(board, index)
+        )
 
     def parse_post(self, response):
         """
+        Capture the raw page of a post.
+
+        The body stays the bytes the downloader produced: it is not
+        decoded, and no DOM is built for it (`meta={'dom': False}`).
         """
         board = re.search(r"www\.ptt\.cc\/bbs\/([\w\d\-_]{1,30})\/", response.url).group(1)
-        con = response.body.decode(response.encoding)
         timestamp = re.search(r'(\d{10})', response.url).group(1)
-        dt = datetime.fromtimestamp(int(timestamp))
-        dt_str = dt.strftime("%Y%m%d_%H%M")
         article_id = response.url.split('/')[-1].split('.html')[0]
 
         article = {
             "board": board,
-            "html_content": con,
+            "html_body": response.body,
             "timestamp": timestamp,
             "article_id": article_id
         }
 
-        yield _ArticleItem(**article)
+        item = _ArticleItem(**article)
+        if self.index_windows is not None:
+            # 寫進檔案之後這篇才算做完 (see IndexWindows.post_items)
+            self.index_windows.post_items(response, [item])
+        yield item
+
+    def item_scraped(self, item, response, spider):  # noqa
+        article = response.meta.get('checkpoint_article')
+        if article is not None:
+            self.checkpoints.article_done(*article)
+
+    def closed(self, reason):
+        """Persist crawl marks, but only for crawls that ran to the end."""
+        if self.checkpoints is None:
+            return
+        if reason == 'finished':
+            self.checkpoints.save()
+        self.checkpoints.close()
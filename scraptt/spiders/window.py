@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Lazily generated index pages for `all_index` crawls."""
+import logging
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+logger = logging.getLogger(__name__)
+
+
+class IndexWindow:
+    """
+    Index pages `first`..`last` of one board, handed out in order.
+
+    A page handed out stays open until it is parsed and every post it
+    requested is done: its items went through the item pipelines (or it
+    had none), or the request failed or was dropped as a duplicate.
+    `watermark` is the page before the oldest open one: everything up to
+    it is completely crawled, so a stopped crawl can start again from
+    `watermark + 1` without losing posts.
+    """
+
+    def __init__(self, board, first, last):
+        """__init__ method."""
+        self.board = board
+        self.next = first
+        self.last = last
+        self.open = {}          # index -> requests still out (the page + its posts)
+        self.unparsed = 0       # pages handed out but not parsed yet
+
+    @property
+    def exhausted(self):
+        """True once every page was handed out."""
+        return self.next > self.last
+
+    @property
+    def done(self):
+        """True once every page is completely crawled."""
+        return self.exhausted and not self.open
+
+    @property
+    def watermark(self):
+        """Last page up to which everything is done (first - 1 if none)."""
+        return min(self.open, default=self.next) - 1
+
+    def take(self):
+        """Hand out the next page."""
+        index = self.next
+        self.next += 1
+        self.open[index] = 1
+        self.unparsed += 1
+        return index
+
+    def post_sent(self, index):
+        """Page `index` is waiting for one more post (or item of a post)."""
+        self.open[index] += 1
+
+    def page_done(self, index):
+        """Page `index` was parsed (or could not be fetched)."""
+        self.unparsed -= 1
+        self._release(index)
+
+    def post_done(self, index):
+        """One post of page `index` is done."""
+        self._release(index)
+
+    def _release(self, index):
+        self.open[index] -= 1
+        if not self.open[index]:
+            del self.open[index]
+
+
+class IndexWindows:
+    """
+    Index pages of an `all_index` crawl, requested as the queue drains.
+
+    Requesting index1..latest of every board at once puts hundreds of
+    thousands of requests into the scheduler, as each page adds ~20 posts.
+    Pages are handed out only while fewer than `INDEX_WINDOW_LOW`
+    requests are queued or downloading and fewer than `INDEX_WINDOW_PAGES`
+    pages are waiting to be parsed, so the queue stays around
+    LOW + PAGES * 20 requests however big the boards are. Boards take
+    turns, the one with the fewest pages in flight first.
+
+    Requests for index pages come from `request(board, index)`; those
+    pages must call `post_kwargs` for every post request they send and
+    `parsed` at the end. Post callbacks pass what they parsed through
+    `post_items`: a post is done once its items are scraped, dropped or
+    failed in the item pipelines, not when it is downloaded, so a crash
+    never moves the watermark past posts that were not written.
+    With a `CheckpointStore`, the watermark of every
+    board is saved as soon as it moves and `start` continues from it; a
+    board is cleared from the store once it is completely crawled.
+    """
+
+    def __init__(self, crawler, spider, request, store=None):
+        """__init__ method."""
+        self.crawler = crawler
+        self.spider = spider
+        self.request = request
+        self.store = store
+        self.low = crawler.settings.getint('INDEX_WINDOW_LOW')
+        self.pages = crawler.settings.getint('INDEX_WINDOW_PAGES')
+        self.windows = {}
+        self.saved = {}         # board -> watermark last written to the store
+        for signal in (signals.item_scraped, signals.item_dropped,
+                       signals.item_error):
+            crawler.signals.connect(self.item_done, signal=signal)
+        crawler.signals.connect(
+            self.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(self.spider_error, signal=signals.spider_error)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+
+    def start(self, board, latest):
+        """Open the window of `board` up to `latest`; return the first requests."""
+        first = 1
+        if self.store is not None:
+            watermark = self.store.get_window(board)
+            if watermark is not None:
+                first = watermark + 1
+                self.saved[board] = watermark
+        window = self.windows[board] = IndexWindow(board, first, latest)
+        if window.done and self.store is not None:
+            self.store.clear_window(board)
+        logger.info(
+            f'{board}: index{first} - index{latest}, '
+            f'{self.pages} pages at a time')
+        return self.top_up()
+
+    def top_up(self):
+        """Requests for the next pages, as many as the limits allow."""
+        engine = self.crawler.engine
+        queued = len(engine.slot.scheduler) + len(engine.downloader.active)
+        windows = [w for w in self.windows.values() if not w.exhausted]
+        unparsed = sum(w.unparsed for w in self.windows.values())
+        requests = []
+        while windows and queued < self.low and unparsed < self.pages:
+            window = min(windows, key=lambda w: w.unparsed)
+            index = window.take()
+            requests.append(self.request(window.board, index))
+            if window.exhausted:
+                windows.remove(window)
+            queued += 1
+            unparsed += 1
+        if requests:
+            self.crawler.stats.inc_value(
+                'index_window/pages', len(requests), spider=self.spider)
+        return requests
+
+    def page_meta(self, board, index):
+        """`meta` of the request for page `index` of `board`."""
+        return {'index_window_page': (board, index)}
+
+    def post_kwargs(self, board, index):
+        """Request kwargs of a post found on page `index`; counts it as sent."""
+        self.windows[board].post_sent(index)
+        return dict(
+            meta={'index_window_post': (board, index)}, errback=self.failed)
+
+    def post_items(self, response, items):
+        """
+        Post `response` was parsed into `items`; return them.
+
+        The post is done once each of them has left the item pipelines,
+        right away if there are none (deleted posts, 404).
+        """
+        post = response.meta.get('index_window_post')
+        if post is None:
+            return items
+        response.meta['index_window_items'] = len(items)
+        if not items:
+            self._done(*post, page=False)
+            self._crawl(self.top_up())
+        for _ in items[1:]:
+            self.windows[post[0]].post_sent(post[1])
+        return items
+
+    def parsed(self, board, index):
+        """Page `index` of `board` sent all its posts; return more pages."""
+        self._done(board, index, page=True)
+        return self.top_up()
+
+    def failed(self, failure):
+        """
+        errback of index page / post requests.
+
+        Returns `failure`, so Scrapy still logs it (download errors,
+        ignored HTTP statuses) as it does for requests without errback.
+        """
+        self._request_done(failure.request)
+        self._crawl(self.top_up())
+        return failure
+
+    def item_done(self, item, response, spider):  # noqa
+        # item_scraped / item_dropped / item_error: 這篇的一個 item 處理完了
+        post = response.meta.get('index_window_post')
+        if post is not None and 'index_window_items' in response.meta:
+            self._done(*post, page=False)
+            self._crawl(self.top_up())
+
+    def request_dropped(self, request, spider):  # noqa
+        self._request_done(request)
+
+    def spider_error(self, failure, response, spider):  # noqa
+        # 解析 index 頁時出錯就不會呼叫 parsed()，po文出錯就不會呼叫
+        # post_items()；都當作做完了
+        if ('index_window_page' in response.meta
+                or 'index_window_items' not in response.meta):
+            self._request_done(response.request)
+            self._crawl(self.top_up())
+
+    def spider_idle(self, spider):  # noqa
+        requests = self.top_up()
+        if requests:
+            self._crawl(requests)
+            raise DontCloseSpider
+
+    def _request_done(self, request):
+        if 'index_window_post' in request.meta:
+            self._done(*request.meta['index_window_post'], page=False)
+        elif 'index_window_page' in request.meta:
+            self._done(*request.meta['index_window_page'], page=True)
+
+    def _done(self, board, index, page):
+        window = self.windows[board]
+        if page:
+            window.page_done(index)
+        else:
+            window.post_done(index)
+        if self.store is None:
+            return
+        if window.done:
+            self.store.clear_window(board)
+            logger.info(f'{board}: index{window.last} reached')
+        elif window.watermark > self.saved.get(board, 0):
+            self.store.save_window(board, window.watermark)
+            self.saved[board] = window.watermark
+
+    def _crawl(self, requests):
+        for request in requests:
+            self.crawler.engine.crawl(request, self.spider)
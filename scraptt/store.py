@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Local SQLite stores kept between crawls."""
+import sqlite3
+import time
+
+from .ids import article_key
+
+
+class SQLiteStore:
+    """One SQLite file; `schema` is created on open if missing."""
+
+    schema = ''
+
+    def __init__(self, path):
+        """__init__ method."""
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.schema)
+
+    @classmethod
+    def from_settings(cls, settings, key):
+        """Open the store at `settings[key]`."""
+        return cls(settings.get(key))
+
+    def close(self):
+        """Commit and close the database."""
+        self.conn.commit()
+        self.conn.close()
+
+
+class CheckpointStore(SQLiteStore):
+    """
+    Per-board crawl marks for `resume` mode.
+
+    - `last_index`: 已處理過的最大 index 頁
+    - `last_article`: 這篇 (含) 以前的文章都已經處理完了 (M.<ts>.A.<hex>)，
+      `resume` 只爬比它新的
+
+    Posts are reported with `article_sent` when they are requested and
+    `article_done` once they are written (or known to be gone); the mark
+    is the newest done post older than every post that is not done, so a
+    post which failed or was dropped is tried again by the next run.
+    Marks reached during a crawl are kept in memory and only written by
+    `save()`, so an interrupted crawl never moves a mark past pages it
+    did not finish.
+
+    - `index_windows`: all_index 模式中每個版已經完整爬完的 index 頁
+      (see `spiders.window.IndexWindows`); written as it moves, so a
+      stopped crawl continues from there
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            board TEXT PRIMARY KEY,
+            last_index INTEGER,
+            last_article TEXT,
+            updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS index_windows (
+            board TEXT PRIMARY KEY,
+            watermark INTEGER NOT NULL,
+            updated REAL
+        );
+    '''
+
+    def __init__(self, path):
+        """__init__ method."""
+        super().__init__(path)
+        self.pending = {}       # board -> last_index
+        self.unfinished = {}    # board -> {article key: article id} requested, not done
+        self.finished = {}      # board -> {article key: article id} done
+
+    def get(self, board):
+        """Return (last_index, last_article) of `board`, None if unknown."""
+        row = self.conn.execute(
+            'SELECT last_index, last_article FROM checkpoints WHERE board = ?',
+            (board,)
+        ).fetchone()
+        return row if row is not None else (None, None)
+
+    def mark_index(self, board, index):
+        """Record that index page `index` of `board` was processed."""
+        if self.pending.get(board) is None or index > self.pending[board]:
+            self.pending[board] = index
+
+    def article_sent(self, board, article_id):
+        """Record that post `article_id` of `board` was requested."""
+        key = article_key(article_id)
+        if key is not None:
+            self.unfinished.setdefault(board, {})[key] = article_id
+
+    def article_done(self, board, article_id):
+        """Record that post `article_id` of `board` was processed."""
+        key = article_key(article_id)
+        if key is None:
+            return
+        self.unfinished.get(board, {}).pop(key, None)
+        self.finished.setdefault(board, {})[key] = article_id
+
+    def last_article(self, board):
+        """Newest done post of `board` older than every unfinished one, or None."""
+        oldest = min(self.unfinished.get(board) or {}, default=None)
+        keys = [
+            key for key in self.finished.get(board, {})
+            if oldest is None or key < oldest
+        ]
+        return self.finished[board][max(keys)] if keys else None
+
+    def save(self):
+        """Merge the pending marks into the database, keeping the max."""
+        now = time.time()
+        for board in set(self.pending) | set(self.finished):
+            index = self.pending.get(board)
+            article_id = self.last_article(board)
+            last_index, last_article = self.get(board)
+            if last_index is not None and (index is None or last_index > index):
+                index = last_index
+            if last_article is not None and (
+                article_id is None or
+                article_key(last_article) > article_key(article_id)
+            ):
+                article_id = last_article
+            self.conn.execute(
+                'INSERT OR REPLACE INTO checkpoints '
+                '(board, last_index, last_article, updated) '
+                'VALUES (?, ?, ?, ?)',
+                (board, index, article_id, now)
+            )
+        self.conn.commit()
+        self.pending = {}
+        self.unfinished = {}
+        self.finished = {}
+
+    def get_window(self, board):
+        """Watermark of the unfinished all_index crawl of `board`, or None."""
+        row = self.conn.execute(
+            'SELECT watermark FROM index_windows WHERE board = ?', (board,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def save_window(self, board, watermark):
+        """Record (and commit) that `board` is crawled up to `watermark`."""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO index_windows (board, watermark, updated) '
+            'VALUES (?, ?, ?)',
+            (board, watermark, time.time())
+        )
+        self.conn.commit()
+
+    def clear_window(self, board):
+        """Forget the watermark of `board` (its crawl is complete)."""
+        self.conn.execute('DELETE FROM index_windows WHERE board = ?', (board,))
+        self.conn.commit()
+
+
+class FingerprintStore(SQLiteStore):
+    """
+    Validators of every post fetched so far.
+
+    - `etag` / `last_modified`: 伺服器給的 HTTP validators (可能沒有)
+    - `body_hash`: SHA1 of the response body
+
+    Nothing is committed until `close(commit=True)`, so validators of an
+    interrupted crawl are discarded and those posts are fetched again.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            url TEXT PRIMARY KEY,
+            etag BLOB,
+            last_modified BLOB,
+            body_hash TEXT
+        );
+    '''
+
+    def get(self, url):
+        """Return (etag, last_modified, body_hash), all None if unseen."""
+        row = self.conn.execute(
+            'SELECT etag, last_modified, body_hash FROM fingerprints '
+            'WHERE url = ?',
+            (url,)
+        ).fetchone()
+        return row if row is not None else (None, None, None)
+
+    def put(self, url, etag, last_modified, body_hash):
+        """Remember the validators of `url`."""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO fingerprints '
+            '(url, etag, last_modified, body_hash) VALUES (?, ?, ?, ?)',
+            (url, etag, last_modified, body_hash)
+        )
+
+    def close(self, commit=True):
+        """Commit (or roll back) and close the database."""
+        if not commit:
+            self.conn.rollback()
+        super().close()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""The "already crawled" Bloom filter and its rebuild from outputs."""
+import gzip
+import json
+import os
+
+from scraptt.bloom import BloomFilter, article_token, rebuild
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'seen.bloom')
+    bloom = BloomFilter.open(path, 1000, 0.001)
+    tokens = [article_token('movie', f'M.{1575882922 + i}.A.5A4') for i in range(500)]
+    assert all(bloom.add(token) for token in tokens)
+    assert not bloom.add(tokens[0])
+    bloom.save()
+    assert not os.path.exists(path + '.tmp')
+
+    bloom = BloomFilter.open(path, 1000, 0.001)
+    assert len(bloom) == 500
+    assert all(token in bloom for token in tokens)
+    false = sum(
+        article_token('Gossiping', f'M.{1575882922 + i}.A.5A4') in bloom
+        for i in range(1000))
+    assert false < 10
+
+
+def test_rebuild(tmp_path):
+    data = tmp_path / 'data' / 'movie' / '2019'
+    data.mkdir(parents=True)
+    (data / '20191209_1735_M.1575882922.A.5A4.html').write_bytes(b'')
+    (data / 'notes.html').write_bytes(b'')
+    jsonl = str(tmp_path / 'Gossiping.jsonl.gz')
+    with gzip.open(jsonl, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'id': 'M.1577836801.A.C3D', 'board': 'Gossiping'}) + '\n')
+        f.write(json.dumps({
+            'id': '0123456789abcdef', 'board': 'Gossiping',
+            'post_id': 'M.1577836801.A.C3D'}) + '\n')
+
+    bloom = BloomFilter(100, 0.001)
+    added = rebuild(bloom, data_dir=str(tmp_path / 'data'), jsonl_paths=[jsonl])
+    assert added == 2
+    assert 'movie/M.1575882922.A.5A4' in bloom
+    assert 'Gossiping/M.1577836801.A.C3D' in bloom
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Comment times: .push-ipdatetime parsing and the year rollover."""
+from datetime import datetime
+
+import pytest
+
+from scraptt.spiders.parsers.comment_time import parse_ipdatetime, YearRollover
+
+
+@pytest.mark.parametrize('text, expected', [
+    (' 111.71.127.174 11/06 22:04', ('111.71.127.174', (11, 6, 22, 4))),
+    (' 05/30 18:28\n', (None, (5, 30, 18, 28))),
+    (' 218.166.4.106 06/22', ('218.166.4.106', (6, 22, 0, 0))),
+    ('1/2 3:04', (None, (1, 2, 3, 4))),
+    ('', None),
+    ('推文', None),
+])
+def test_parse_ipdatetime(text, expected):
+    assert parse_ipdatetime(text) == expected
+
+
+def test_fast_path_does_not_take_garbage_for_an_ip():
+    # 快速路徑切出來的 "IP" 不是 IP 時改用 regex，只留下時間
+    assert parse_ipdatetime(' 編輯 11/06 22:04') == (None, (11, 6, 22, 4))
+
+
+def test_year_rolls_over_at_new_year():
+    resolve = YearRollover(datetime(2019, 12, 8, 17, 15))
+    assert [
+        resolve(*stamp) for stamp in
+        [(12, 8, 18, 0), (12, 31, 23, 59), (1, 1, 0, 1), (1, 5, 9, 0)]
+    ] == [
+        datetime(2019, 12, 8, 18, 0), datetime(2019, 12, 31, 23, 59),
+        datetime(2020, 1, 1, 0, 1), datetime(2020, 1, 5, 9, 0),
+    ]
+
+
+def test_year_rolls_over_every_year():
+    resolve = YearRollover(datetime(2017, 6, 1))
+    assert resolve(3, 1, 0, 0).year == 2018
+    assert resolve(7, 1, 0, 0).year == 2018
+    assert resolve(2, 1, 0, 0).year == 2019
+
+
+def test_same_month_keeps_the_year():
+    resolve = YearRollover(datetime(2019, 5, 20))
+    # 同一個月裡日期往回 (樓主複製的推文) 不換年
+    assert resolve(5, 1, 0, 0) == datetime(2019, 5, 1)
+
+
+def test_invalid_date_does_not_move_the_year():
+    resolve = YearRollover(datetime(2018, 12, 8))
+    with pytest.raises(ValueError):
+        resolve(2, 29, 0, 0)    # 換年後是 2019/02/29
+    assert resolve(12, 9, 0, 0) == datetime(2018, 12, 9)
+    assert resolve(2, 28, 0, 0) == datetime(2019, 2, 28)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""SortedRuns and PttDupeFilter."""
+import os
+import random
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.http import Request  # noqa: E402
+
+from scraptt import settings as default_settings  # noqa: E402
+from scraptt.dupefilter import PttDupeFilter, SortedRuns, post_key  # noqa: E402
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_sorted_runs_is_a_set(tmp_path, on_disk):
+    runs = SortedRuns(buffer_size=64, directory=str(tmp_path) if on_disk else None)
+    rnd = random.Random(0)
+    keys = [rnd.getrandbits(64) for _ in range(2000)]
+    for key in keys:
+        assert runs.add(key)
+    for key in keys[::7]:
+        assert not runs.add(key)
+    runs.flush()
+    assert len(runs) == len(keys)
+    assert all(key in runs for key in keys)
+    assert not any(rnd.getrandbits(64) in runs for _ in range(1000))
+    # 大小相近的 run 會合併，run 數是 O(log n)
+    assert len(runs.runs) <= 6
+    assert runs.nbytes == 8 * len(keys)
+    runs.close()
+    if on_disk:
+        assert os.listdir(str(tmp_path)) == []
+
+
+def test_post_keys_do_not_collide():
+    keys = {
+        post_key(board, kind, timestamp, suffix)
+        for board in (0, 1, (1 << 17) - 1)
+        for kind in 'MG'
+        for timestamp in (1575882922, (1 << 34) - 1)
+        for suffix in (0, 0x5A4, 0xFFF)
+    }
+    assert len(keys) == 3 * 2 * 2 * 3
+
+
+def test_ptt_urls_and_others(tmp_path):
+    dupefilter = PttDupeFilter(buffer_size=4, directory=str(tmp_path))
+    urls = [
+        'https://www.ptt.cc/bbs/movie/index1.html',
+        'https://www.ptt.cc/bbs/movie/index8.html',
+        'https://www.ptt.cc/bbs/Gossiping/index1.html',
+        'https://www.ptt.cc/bbs/movie/M.1575882922.A.5A4.html',
+        'https://www.ptt.cc/bbs/movie/G.1575882922.A.5A4.html',
+        'https://www.ptt.cc/bbs/Gossiping/M.1575882922.A.5A4.html',
+        'https://www.ptt.cc/bbs/movie/index.html',
+        'https://www.ptt.cc/bbs/movie/M.1575882922.A.5A4.html?x=1',
+    ]
+    for url in urls:
+        assert not dupefilter.request_seen(Request(url))
+    for url in urls:
+        assert dupefilter.request_seen(Request(url))
+    assert len(dupefilter.posts) == 3
+    assert set(dupefilter.indexes) == {'movie', 'Gossiping'}
+    assert len(dupefilter.fingerprints) == 2
+    # POST 不是用網址記
+    post = Request(urls[0], method='POST', body=b'yes=yes')
+    assert not dupefilter.request_seen(post)
+    assert dupefilter.request_seen(post)
+    dupefilter.close('finished')
+
+
+def test_not_the_default():
+    assert not hasattr(default_settings, 'DUPEFILTER_CLASS')
+
+
+def test_warns_with_jobdir(tmp_path, caplog):
+    dupefilter = PttDupeFilter(path=str(tmp_path))
+    assert 'not saved to JOBDIR' in caplog.text
+    dupefilter.close('finished')
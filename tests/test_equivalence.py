@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""`extract_post` / `stream_post` against the old PyQuery path, see benchmarks.equivalence."""
+import pytest
+
+pytest.importorskip('pyquery')
+
+from benchmarks import corpus  # noqa: E402
+from benchmarks.equivalence import (  # noqa: E402
+    INTENDED, compare, current_extract_post, legacy_extract_post
+)
+
+
+@pytest.mark.parametrize('name', corpus.POSTS)
+def test_fixture(name):
+    html = corpus.load(name).decode('utf-8')
+    assert compare(html) == INTENDED.get(name, [])
+
+
+def test_intended_quote_difference():
+    html = corpus.load('quote_chain').decode('utf-8')
+    old = legacy_extract_post(html)['content']
+    new = current_extract_post(html)['content']
+    # 舊的寫法在內文開頭留下引述的殘渣
+    assert old.startswith(': : : ')
+    assert old.endswith(new)
+    assert ': ' not in new
+
+
+def test_mega_thread_identical():
+    html = corpus.mega_thread(500).decode('utf-8')
+    assert compare(html) == []
+    assert len(current_extract_post(html)['comments']) == 500
+
+
+def test_no_main_content():
+    html = '<html><body><div id="topbar"></div></body></html>'
+    assert legacy_extract_post(html) is None
+    assert compare(html) == []
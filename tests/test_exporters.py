@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""JSON lines segments, their rotation and the manifest."""
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from scraptt import exporters
+from scraptt.exporters import JsonLinesExport, dumps, open_lines
+
+COMPRESSIONS = [
+    'gzip',
+    pytest.param('zstd', marks=pytest.mark.skipif(
+        exporters.zstandard is None, reason='zstandard is not installed')),
+]
+
+
+def test_dumps():
+    line = dumps({'title': '測試 & 心得', 'published': datetime(2019, 12, 8, 17, 15, 22)})
+    assert line.endswith(b'\n')
+    assert json.loads(line) == {
+        'title': '測試 & 心得', 'published': '2019-12-08T17:15:22'}
+    assert '測試'.encode('utf-8') in line     # 不跳脫
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_segments_and_manifest(tmp_path, compression):
+    directory = str(tmp_path)
+    export = JsonLinesExport(directory, 'run1', compression, max_bytes=1000)
+    records = [{'id': f'M.{i}.A.000', 'board': 'movie', 'content': 'x' * 90}
+               for i in range(50)]
+    for record in records:
+        export.write('movie', record)
+    export.write('Gossiping', {'id': 'M.1.A.000', 'board': 'Gossiping'})
+    # 還沒關的 segment 只有 .tmp
+    assert any(name.endswith('.tmp') for name in os.listdir(tmp_path / 'movie'))
+    export.close()
+
+    with open_lines(os.path.join(directory, 'manifest-run1.jsonl')) as f:
+        manifest = [json.loads(line) for line in f]
+    movie = [entry for entry in manifest if entry['board'] == 'movie']
+    assert len(movie) > 1
+    assert sum(entry['records'] for entry in movie) == 50
+    extension = exporters.EXTENSIONS[compression]
+    assert movie[0]['path'] == os.path.join(
+        'movie', f'movie-run1-00001.jsonl{extension}')
+
+    read = []
+    for entry in movie:
+        path = os.path.join(directory, entry['path'])
+        assert os.path.getsize(path) == entry['size']
+        with open_lines(path) as f:
+            read.extend(json.loads(line) for line in f)
+    assert read == records
+    for board in ('movie', 'Gossiping'):
+        assert not any(
+            name.endswith('.tmp') for name in os.listdir(tmp_path / board))
+
+
+def test_segment_age(tmp_path, monkeypatch):
+    export = JsonLinesExport(str(tmp_path), 'run1', 'gzip', max_seconds=60)
+    now = [1000.0]
+    monkeypatch.setattr(exporters.time, 'monotonic', lambda: now[0])
+    export.write('movie', {'id': 1})
+    now[0] += 59
+    export.write('movie', {'id': 2})
+    now[0] += 2
+    export.write('movie', {'id': 3})
+    export.close()
+    assert sorted(os.listdir(tmp_path / 'movie')) == [
+        'movie-run1-00001.jsonl.gz', 'movie-run1-00002.jsonl.gz']
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        JsonLinesExport(str(tmp_path), 'run1', 'lz4')
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Shared frontier: SQLite backend and the extension feeding the spider."""
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.exceptions import DontCloseSpider  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+from twisted.internet import defer  # noqa: E402
+from twisted.trial import unittest  # noqa: E402
+
+from scraptt.frontier import (  # noqa: E402
+    Frontier, FrontierExtension, SQLiteFrontier, ThreadedFrontier, WorkUnit,
+)
+
+
+@pytest.fixture
+def frontier(tmp_path):
+    frontier = SQLiteFrontier(str(tmp_path / 'frontier.sqlite'))
+    yield frontier
+    frontier.close()
+
+
+def ranges(units):
+    return [(unit.board, unit.index_from, unit.index_to) for unit in units]
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        Frontier()
+
+    class Partial(Frontier):
+        def seed(self, queue, board, latest, unit_size):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_seed_is_idempotent_and_grows_the_tail(frontier):
+    frontier.seed('ptt', 'movie', 25, 10)
+    frontier.seed('ptt', 'movie', 25, 10)
+    assert ranges(frontier.lease('ptt', 'a', 10, 60)) == [
+        ('movie', 1, 10), ('movie', 11, 20), ('movie', 21, 25)]
+    # 新文章：尾巴那段回到 pending，多出來的變成新的一段
+    frontier.seed('ptt', 'movie', 32, 10)
+    assert ranges(frontier.lease('ptt', 'b', 10, 60)) == [
+        ('movie', 31, 32), ('movie', 21, 30)]
+
+
+def test_queues_are_separate(frontier):
+    frontier.seed('ptt', 'movie', 5, 10)
+    assert frontier.lease('ptt_article', 'a', 10, 60) == []
+    assert len(frontier.lease('ptt', 'a', 10, 60)) == 1
+
+
+def test_leased_units_are_not_leased_twice(frontier):
+    frontier.seed('ptt', 'movie', 30, 10)
+    first = frontier.lease('ptt', 'a', 2, 60)
+    second = frontier.lease('ptt', 'b', 2, 60)
+    assert ranges(first) == [('movie', 1, 10), ('movie', 11, 20)]
+    assert ranges(second) == [('movie', 21, 30)]
+    assert frontier.lease('ptt', 'c', 2, 60) == []
+
+
+def test_expired_lease_is_leased_again(frontier):
+    frontier.seed('ptt', 'movie', 10, 10)
+    # ttl < 0：worker a 馬上就「死了」
+    [unit] = frontier.lease('ptt', 'a', 1, -1)
+    assert frontier.lease('ptt', 'b', 1, 60) == [unit]
+    # a 已經不持有這段，完成不算數；b 完成才算
+    frontier.complete('a', [unit.id])
+    assert frontier.lease('ptt', 'c', 1, -1) == []
+    frontier.complete('b', [unit.id])
+    frontier.release('b')
+    assert frontier.lease('ptt', 'c', 1, 60) == []
+
+
+def test_heartbeat_keeps_the_lease(frontier):
+    frontier.seed('ptt', 'movie', 10, 10)
+    frontier.lease('ptt', 'a', 1, -1)
+    frontier.heartbeat('a', 60)
+    assert frontier.lease('ptt', 'b', 1, 60) == []
+
+
+def test_release_gives_back_unfinished_units(frontier):
+    frontier.seed('ptt', 'movie', 20, 10)
+    done, left = frontier.lease('ptt', 'a', 2, 60)
+    frontier.complete('a', [done.id])
+    frontier.release('a')
+    assert frontier.lease('ptt', 'b', 2, 60) == [left]
+
+
+def test_retried_units_go_last(frontier):
+    frontier.seed('ptt', 'movie', 20, 10)
+    frontier.lease('ptt', 'a', 1, 60)
+    frontier.release('a')
+    assert ranges(frontier.lease('ptt', 'b', 2, 60)) == [
+        ('movie', 11, 20), ('movie', 1, 10)]
+
+
+class FrontierExtensionTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='scraptt-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.extension(os.path.join(directory, 'frontier.sqlite'))
+
+    def extension(self, db):
+        self.crawler = get_crawler(settings_dict={
+            'FRONTIER_CLASS': 'scraptt.frontier.SQLiteFrontier',
+            'FRONTIER_DB': db,
+            'FRONTIER_LEASE_TTL': 60,
+            'FRONTIER_LEASE_BATCH': 2,
+        })
+        self.crawler.stats.open_spider(None)
+        self.crawled = []
+        self.crawler.engine = SimpleNamespace(
+            crawl=lambda request, spider: self.crawled.append(request))
+        self.spider = SimpleNamespace(
+            name='ptt', use_frontier=True, frontier_requests=lambda unit: [unit])
+        self.ext = FrontierExtension.from_crawler(self.crawler)
+
+    def idle(self):
+        with self.assertRaises(DontCloseSpider):
+            self.ext.spider_idle(self.spider)
+        return self.ext.leasing
+
+    @defer.inlineCallbacks
+    def test_leases_completes_and_closes(self):
+        self.ext.spider_opened(self.spider)
+        self.assertIsInstance(self.spider.frontier, ThreadedFrontier)
+        yield self.spider.frontier.seed('ptt', 'movie', 30, 10)
+
+        leasing = self.idle()
+        # 租約還沒回來之前，spider_idle 不會再租一次
+        self.assertIs(self.idle(), leasing)
+        yield leasing
+        self.assertEqual(ranges(self.crawled), [
+            ('movie', 1, 10), ('movie', 11, 20)])
+
+        yield self.idle()
+        yield self.idle()
+        self.assertEqual(len(self.crawled), 3)
+        self.assertTrue(self.ext.exhausted)
+        # 沒有工作了：讓 spider 關掉
+        self.assertIsNone(self.ext.spider_idle(self.spider))
+        self.assertEqual(
+            self.crawler.stats.get_value('frontier/completed'), 3)
+
+        yield self.ext.spider_closed(self.spider, 'finished')
+        backend = SQLiteFrontier(self.crawler.settings.get('FRONTIER_DB'))
+        self.addCleanup(backend.close)
+        self.assertEqual(backend.lease('ptt', 'b', 10, 60), [])
+
+    @defer.inlineCallbacks
+    def test_unclean_close_releases_leases(self):
+        self.ext.spider_opened(self.spider)
+        yield self.spider.frontier.seed('ptt', 'movie', 10, 10)
+        yield self.idle()
+        yield self.ext.spider_closed(self.spider, 'shutdown')
+        backend = SQLiteFrontier(self.crawler.settings.get('FRONTIER_DB'))
+        self.addCleanup(backend.close)
+        self.assertEqual(backend.lease('ptt', 'b', 10, 60), [
+            WorkUnit(1, 'movie', 1, 10)])
+
+    @defer.inlineCallbacks
+    def test_failed_lease_is_retried(self):
+        self.extension('/nonexistent/frontier.sqlite')
+        self.ext.spider_opened(self.spider)
+        yield self.idle()
+        self.assertFalse(self.ext.exhausted)
+        self.assertIsNotNone(self.idle())
+        yield self.ext.leasing
+        self.ext.heartbeat.stop()
+        self.ext.frontier.pool.close()
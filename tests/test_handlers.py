@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""ArchiveDownloadHandler: record responses, then replay them offline."""
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.exceptions import IgnoreRequest  # noqa: E402
+from scrapy.http import HtmlResponse, Request  # noqa: E402
+from scrapy.settings import Settings  # noqa: E402
+from twisted.internet import defer  # noqa: E402
+
+from scraptt.handlers import ArchiveDownloadHandler  # noqa: E402
+
+URL = 'https://www.ptt.cc/bbs/movie/M.1575882922.A.5A4.html'
+BODY = '<html><body><div id="main-content">推</div></body></html>'.encode()
+
+
+class FakeHTTP:
+
+    def __init__(self):
+        self.requests = []
+
+    def download_request(self, request, spider):
+        self.requests.append(request)
+        return defer.succeed(HtmlResponse(
+            request.url, status=200, body=BODY,
+            headers={'Content-Type': 'text/html; charset=utf-8'}))
+
+    def close(self):
+        pass
+
+
+def handler(mode, path):
+    dh = ArchiveDownloadHandler(Settings({
+        'ARCHIVE_MODE': mode, 'ARCHIVE_PATH': str(path)}))
+    if dh.http is not None:
+        dh.http = FakeHTTP()
+    return dh
+
+
+def result(dfd):
+    results = []
+    dfd.addBoth(results.append)
+    return results[0]
+
+
+def test_record_then_replay(tmp_path):
+    path = tmp_path / 'archive.sqlite'
+    recorder = handler('record', path)
+    response = result(recorder.download_request(Request(URL), None))
+    assert response.body == BODY
+    recorder.close()
+
+    player = handler('replay', path)
+    assert player.http is None
+    response = result(player.download_request(Request(URL), None))
+    player.close()
+    assert isinstance(response, HtmlResponse)
+    assert (response.url, response.status, response.body) == (URL, 200, BODY)
+    assert response.headers['Content-Type'] == b'text/html; charset=utf-8'
+    assert response.flags == ['replayed']
+    assert '推' in response.text
+
+
+def test_replay_ignores_unrecorded_requests(tmp_path):
+    player = handler('replay', tmp_path / 'archive.sqlite')
+    failure = result(player.download_request(Request(URL), None))
+    player.close()
+    assert failure.check(IgnoreRequest)
+
+
+def test_schemes_share_one_archive(tmp_path):
+    path = tmp_path / 'archive.sqlite'
+    # Scrapy 給 http 和 https 各建一個 handler
+    http, https = handler('record', path), handler('record', path)
+    assert http.archive is https.archive
+    for i in range(ArchiveDownloadHandler.archives[str(path)][0].commit_every):
+        result(http.download_request(
+            Request(f'{URL}?{i}'.replace('https', 'http')), None))
+        result(https.download_request(Request(f'{URL}?{i}'), None))
+    http.close()
+    assert https.archive.conn.execute(
+        'SELECT COUNT(*) FROM responses').fetchone() == (200,)
+    https.close()
+    assert str(path) not in ArchiveDownloadHandler.archives
+
+    player = handler('replay', path)
+    assert result(player.download_request(
+        Request(f'{URL}?99'), None)).body == BODY
+    player.close()
+
+
+def test_plain_mode_and_unknown_mode(tmp_path):
+    plain = handler(None, tmp_path / 'archive.sqlite')
+    assert plain.archive is None
+    assert result(plain.download_request(Request(URL), None)).body == BODY
+    plain.close()
+    assert not (tmp_path / 'archive.sqlite').exists()
+    with pytest.raises(ValueError):
+        handler('rewind', tmp_path / 'archive.sqlite')
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""IndexSearch: bisection / galloping over index pages, probe budget."""
+import math
+import random
+
+import pytest
+
+from scraptt.spiders.index_search import IndexSearch
+
+
+def board(pages, seed=0, empty_every=0):
+    """Timestamps of every page (index 1..pages), 20 posts each, increasing."""
+    rnd = random.Random(seed)
+    stamps, t = {}, 1000000000
+    for index in range(1, pages + 1):
+        if empty_every and index % empty_every == 0:
+            stamps[index] = []      # 全部被刪除
+            continue
+        page = []
+        for _ in range(20):
+            t += rnd.randint(1, 600)
+            page.append(t)
+        stamps[index] = page
+    return stamps
+
+
+def run(search, stamps):
+    while not search.done:
+        index = search.next_probe()
+        assert search.lo <= index < search.hi or search.lo == index
+        search.feed(index, stamps[index])
+    return search.result
+
+
+def first_page(stamps, cutoff):
+    return next(
+        (i for i in sorted(stamps) if stamps[i] and max(stamps[i]) >= cutoff),
+        max(stamps) + 1)
+
+
+@pytest.mark.parametrize('gallop', [False, True])
+def test_finds_first_page(gallop):
+    stamps = board(1000)
+    for target in (1, 2, 500, 999, 1000):
+        cutoff = stamps[target][-1]
+        search = IndexSearch(
+            'movie', 1, 1001, lambda s: max(s) >= cutoff, gallop=gallop)
+        assert run(search, stamps) == first_page(stamps, cutoff) == target
+        assert search.probes <= 2 * math.ceil(math.log2(1000)) + 1
+
+
+def test_no_page_matches():
+    stamps = board(100)
+    search = IndexSearch('movie', 1, 101, lambda s: max(s) >= 2 ** 40)
+    assert run(search, stamps) == 101
+
+
+def test_gallop_is_cheap_near_the_latest_page():
+    stamps = board(20000)
+    cutoff = stamps[19990][0]
+    bisect = IndexSearch('movie', 1, 20001, lambda s: max(s) >= cutoff)
+    gallop = IndexSearch(
+        'movie', 1, 20001, lambda s: max(s) >= cutoff, gallop=True)
+    assert run(bisect, stamps) == run(gallop, stamps) == 19990
+    assert gallop.probes < bisect.probes
+
+
+def test_empty_pages_err_on_the_side_of_more_pages():
+    stamps = board(200, empty_every=7)
+    cutoff = stamps[101][-1]    # page 102 是空的
+    for empty in (True, False):
+        search = IndexSearch(
+            'movie', 1, 201, lambda s: max(s) >= cutoff, empty=empty)
+        result = run(search, stamps)
+        assert result <= 101 if empty else result >= 101
+
+
+def test_probe_budget():
+    stamps = board(1000)
+    cutoff = stamps[600][-1]
+    search = IndexSearch(
+        'movie', 1, 1001, lambda s: max(s) >= cutoff, max_probes=3)
+    result = run(search, stamps)
+    assert search.probes == 3 and search.exhausted
+    # 沒找到答案時取 empty 那一側的邊界：只會多爬，不會漏
+    assert result <= 600
+    search = IndexSearch(
+        'movie', 1, 1001, lambda s: max(s) >= cutoff, empty=False,
+        max_probes=3)
+    assert run(search, stamps) >= 600
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Parquet datasets: partitions, file rollover and the buffered row cap."""
+import glob
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import pyarrow.dataset as ds  # noqa: E402
+
+from scraptt import parquet  # noqa: E402
+from scraptt.parquet import POST_SCHEMA, PartitionedDataset  # noqa: E402
+
+
+def post(i):
+    published = datetime(2018 + i % 2, 5, 1, 10, i % 60) if i % 11 else None
+    return {
+        'id': f'M.{i}.A.000', 'board': 'ignored', 'author': 'a',
+        'published': published, 'crawled': datetime(2020, 1, 1),
+        'title': f't{i}', 'ip': '192.0.2.1', 'content': '內文',
+        'upvote': i, 'novote': 0, 'downvote': 1,
+    }
+
+
+def files(directory, pattern='*.parquet'):
+    return sorted(
+        os.path.relpath(path, directory)
+        for path in glob.glob(os.path.join(directory, '**', pattern),
+                              recursive=True))
+
+
+def read(directory):
+    return ds.dataset(directory, partitioning='hive').to_table()
+
+
+def test_partitions(tmp_path):
+    directory = str(tmp_path)
+    dataset = PartitionedDataset(directory, POST_SCHEMA, 'run1', batch_size=7)
+    for i in range(100):
+        dataset.append(['movie', 'Gossiping'][i % 2], post(i))
+    dataset.close()
+    assert not files(directory, '*.tmp')
+    assert 'board=movie/year=2018/run1-00001.parquet' in files(directory)
+    assert 'board=Gossiping/year=__HIVE_DEFAULT_PARTITION__/run1-00001.parquet' \
+        in files(directory)
+    table = read(directory)
+    assert table.num_rows == 100
+    assert sorted(table.column('upvote').to_pylist()) == list(range(100))
+    movie = table.filter(ds.field('board') == 'movie')
+    assert set(movie.column('year').to_pylist()) == {2018, None}
+
+
+def test_files_roll_over(tmp_path):
+    directory = str(tmp_path)
+    dataset = PartitionedDataset(
+        directory, POST_SCHEMA, 'run1', batch_size=5, row_groups=2)
+    rows = [dict(post(i), published=datetime(2019, 1, 1)) for i in range(30)]
+    for row in rows:
+        dataset.append('movie', row)
+    # 每 2 個 row group (10 列) 就關一個檔，不用等到 close()
+    assert files(directory) == [
+        f'board=movie/year=2019/run1-0000{n}.parquet' for n in (1, 2, 3)]
+    assert read(directory).num_rows == 30
+    dataset.close()
+
+
+def test_buffered_rows_capped(tmp_path):
+    dataset = PartitionedDataset(
+        str(tmp_path), POST_SCHEMA, 'run1', batch_size=1000, max_rows=40)
+    for i in range(200):
+        dataset.append(f'board{i % 10}', post(i))
+        assert dataset.rows <= 40
+        assert dataset.rows == sum(p.rows for p in dataset.partitions.values())
+    dataset.close()
+    assert read(str(tmp_path)).num_rows == 200
+
+
+def test_expire(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    now = [1000.0]
+    monkeypatch.setattr(parquet.time, 'monotonic', lambda: now[0])
+    dataset = PartitionedDataset(
+        directory, POST_SCHEMA, 'run1', batch_size=1000, max_seconds=60)
+    dataset.append('movie', dict(post(1), published=datetime(2019, 1, 1)))
+    now[0] += 59
+    dataset.expire()
+    assert files(directory) == []
+    now[0] += 2
+    dataset.expire()
+    assert files(directory) == ['board=movie/year=2019/run1-00001.parquet']
+    assert dataset.partitions == {}
+    # 同一個 partition 再來的列寫到下一個檔，不會蓋掉前一個
+    dataset.append('movie', dict(post(2), published=datetime(2019, 1, 1)))
+    dataset.close()
+    assert files(directory) == [
+        'board=movie/year=2019/run1-00001.parquet',
+        'board=movie/year=2019/run1-00002.parquet']
+    assert read(directory).num_rows == 2
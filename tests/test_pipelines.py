@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""Writer-thread pipelines, run against a real reactor (trial)."""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('pymongo')
+
+from scrapy.exceptions import DropItem  # noqa: E402
+from scrapy.settings import Settings  # noqa: E402
+from scrapy.statscollectors import MemoryStatsCollector  # noqa: E402
+from twisted.internet import defer, threads  # noqa: E402
+from twisted.trial import unittest  # noqa: E402
+
+from scraptt import pipelines, settings as default_settings  # noqa: E402
+from scraptt.exporters import open_lines  # noqa: E402
+from scraptt.pipelines import (  # noqa: E402
+    AsyncWriterPipeline, ElasticsearchBulkPipeline, HTMLFilePipeline,
+    JsonPipeline, MongoBulkPipeline
+)
+
+
+def spider(**overrides):
+    settings = Settings()
+    settings.setmodule(default_settings)
+    settings.update(overrides)
+    crawler = SimpleNamespace(settings=settings)
+    crawler.stats = MemoryStatsCollector(crawler)
+    return SimpleNamespace(settings=settings, crawler=crawler, name='ptt')
+
+
+def post(i, board='movie', comments=2):
+    published = datetime(2019, 12, 8, 17, 15, i % 60)
+    return {
+        'id': f'M.{1575796500 + i}.A.0B1', 'board': board, 'author': 'user001',
+        'title': f'[好雷] 測試 {i}', 'ip': '192.0.2.1', 'content': '內文',
+        'time': {'published': published, 'crawled': datetime(2020, 1, 1)},
+        'count': {'推': comments, '→': 0, '噓': 0},
+        'comments': [
+            {'type': '推', 'author': f'user{k:03d}', 'content': f'推文 {k}',
+             'ip': None, 'time': {'published': published, 'crawled': None}}
+            for k in range(comments)
+        ],
+    }
+
+
+class Recorder(AsyncWriterPipeline):
+    """Records what it writes, in which thread; item 'fail' raises."""
+
+    def open(self, spider):
+        self.written = []
+        self.threads_by_key = {}
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def key(self, item):
+        return item['board']
+
+    def write(self, item, spider):
+        self.gate.wait(5)
+        if item.get('fail'):
+            raise DropItem('fail')
+        self.written.append((item['board'], item['n']))
+        self.threads_by_key.setdefault(item['board'], set()).add(
+            threading.get_ident())
+
+
+class TestCase(unittest.TestCase):
+
+    def mktemp(self):
+        """Empty directory, removed after the test (not under the cwd like trial's)."""
+        directory = tempfile.mkdtemp(prefix='scraptt-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        return directory
+
+
+class AsyncWriterPipelineTest(TestCase):
+
+    @defer.inlineCallbacks
+    def test_order_per_key_and_backpressure(self):
+        s = spider(ASYNC_WRITER_THREADS=3, ASYNC_WRITER_QUEUE=5)
+        pipeline = Recorder()
+        pipeline.open_spider(s)
+        pipeline.gate.clear()       # 先卡住，讓佇列滿
+        items = [{'board': f'b{n % 4}', 'n': n} for n in range(40)]
+        dfds = [pipeline.process_item(item, s) for item in items]
+        self.assertEqual(pipeline.pool.queued, 5)
+        pipeline.gate.set()
+        results = yield defer.gatherResults(dfds)
+        yield pipeline.close_spider(s)
+
+        self.assertEqual(results, items)
+        for board in ('b0', 'b1', 'b2', 'b3'):
+            ns = [n for b, n in pipeline.written if b == board]
+            self.assertEqual(ns, sorted(ns))
+            self.assertEqual(len(pipeline.threads_by_key[board]), 1)
+        stats = s.crawler.stats
+        self.assertEqual(stats.get_value('writer/Recorder/queued_max'), 5)
+        self.assertEqual(stats.get_value('writer/Recorder/waits'), 35)
+
+    @defer.inlineCallbacks
+    def test_failed_write_fails_the_item(self):
+        s = spider()
+        pipeline = Recorder()
+        pipeline.open_spider(s)
+        ok = pipeline.process_item({'board': 'movie', 'n': 1}, s)
+        bad = pipeline.process_item({'board': 'movie', 'n': 2, 'fail': True}, s)
+        self.assertEqual((yield ok)['n'], 1)
+        yield self.assertFailure(bad, DropItem)
+        yield pipeline.close_spider(s)
+        # stats 由 reactor thread 記
+        yield threads.deferToThread(lambda: None)
+        self.assertEqual(
+            s.crawler.stats.get_value('writer/Recorder/errors'), 1)
+
+
+class HTMLFilePipelineTest(TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        os.chdir(self.mktemp())
+        self.addCleanup(os.chdir, cwd)
+
+    @defer.inlineCallbacks
+    def test_writes_body_bytes(self):
+        s = spider()
+        pipeline = HTMLFilePipeline()
+        pipeline.open_spider(s)
+        body = '<html>測試</html>'.encode('big5')
+        item = {'board': 'movie', 'article_id': 'M.1575882922.A.5A4',
+                'timestamp': '1575882922', 'html_body': body}
+        yield pipeline.process_item(item, s)
+        yield pipeline.close_spider(s)
+        year = datetime.fromtimestamp(1575882922).year
+        [name] = os.listdir(f'data/movie/{year}')
+        self.assertTrue(name.endswith('_M.1575882922.A.5A4.html'))
+        with open(f'data/movie/{year}/{name}', 'rb') as f:
+            self.assertEqual(f.read(), body)
+
+    @defer.inlineCallbacks
+    def test_os_error_drops_item(self):
+        s = spider()
+        pipeline = HTMLFilePipeline()
+        pipeline.open_spider(s)
+        with open('data', 'w'):     # data/ 建不起來
+            pass
+        item = {'board': 'movie', 'article_id': 'M.1575882922.A.5A4',
+                'timestamp': '1575882922', 'html_body': b''}
+        yield self.assertFailure(pipeline.process_item(item, s), DropItem)
+        yield pipeline.close_spider(s)
+
+    def test_no_tmp_left_on_error(self):
+        with self.assertRaises(TypeError):
+            HTMLFilePipeline().write_file('page.html', 'not bytes')
+        self.assertEqual(os.listdir('.'), [])
+
+
+class JsonPipelineTest(TestCase):
+
+    @defer.inlineCallbacks
+    def test_posts_and_comments(self):
+        directory = self.mktemp()
+        s = spider(JSONL_EXPORT_DIR=directory, JSONL_EXPORT_RUN='run1',
+                   JSONL_EXPORT_COMPRESSION='gzip')
+        pipeline = JsonPipeline()
+        pipeline.open_spider(s)
+        for i in range(10):
+            yield pipeline.process_item(post(i, ['movie', 'Gossiping'][i % 2]), s)
+        yield pipeline.close_spider(s)
+
+        with open_lines(os.path.join(directory, 'movie', 'movie-run1-00001.jsonl.gz')) as f:
+            records = [json.loads(line) for line in f]
+        posts = [r for r in records if 'post_id' not in r]
+        comments = [r for r in records if 'post_id' in r]
+        self.assertEqual([p['id'] for p in posts],
+                         [f'M.{1575796500 + i}.A.0B1' for i in range(0, 10, 2)])
+        self.assertEqual(len(comments), 10)
+        self.assertEqual(posts[0]['published'], '2019-12-08T17:15:00')
+
+
+class FakeCollection:
+
+    def __init__(self):
+        self.batches = []
+
+    def create_index(self, key):
+        pass
+
+    def bulk_write(self, operations, ordered):
+        assert not ordered
+        self.batches.append(len(operations))
+
+
+class FakeMongoClient:
+
+    def __init__(self, uri):
+        self.collection = FakeCollection()
+
+    def __getitem__(self, database):
+        return {'ptt': self.collection}
+
+    def close(self):
+        pass
+
+
+class MongoBulkPipelineTest(TestCase):
+
+    @defer.inlineCallbacks
+    def test_batches(self):
+        self.patch(pipelines.pymongo, 'MongoClient', FakeMongoClient)
+        s = spider()
+        pipeline = MongoBulkPipeline(
+            'localhost', 'ptt', 'ptt', 10, 10 ** 9, 60, s.crawler.stats)
+        pipeline.open_spider(s)
+        for i in range(9):
+            yield pipeline.process_item(post(i), s)    # 每篇 3 筆
+        yield pipeline.close_spider(s)
+        yield threads.deferToThread(lambda: None)
+        self.assertEqual(pipeline.collection.batches, [10, 10, 7])
+        stats = s.crawler.stats
+        self.assertEqual(stats.get_value('mongo/batches'), 3)
+        self.assertEqual(stats.get_value('mongo/operations'), 27)
+
+    def test_bytes_are_utf8(self):
+        pipeline = MongoBulkPipeline(
+            'localhost', 'ptt', 'ptt', 1000, 28, 60, None)
+        pipeline.flush = lambda: pipeline.operations.clear()
+        pipeline.add({'id': 'x', 'content': '中文中文中文中文'})    # 1 + 24 bytes
+        self.assertEqual(len(pipeline.operations), 1)
+        pipeline.add({'id': 'y', 'content': '中'})
+        self.assertEqual(pipeline.operations, [])
+
+
+class FakeIndexer:
+
+    retried = 0     # ElasticsearchBulkPipeline 會讀這個 (重送的次數)
+
+    def index(self, docs):
+        failed = [
+            {'id': doc['id'], 'status': 400, 'error': 'mapper_parsing_exception',
+             'action': {'_index': 'ptt', '_id': doc['id'], '_source': doc}}
+            for doc in docs if doc['id'].endswith('bad')
+        ]
+        return len(docs) - len(failed), failed
+
+
+class ElasticsearchBulkPipelineTest(TestCase):
+
+    @defer.inlineCallbacks
+    def test_failed_documents_saved_as_actions(self):
+        s = spider()
+        failed_path = os.path.join(self.mktemp(), 'failed.jsonl')
+
+        def documents(item):
+            return [{'id': item['id']}, {'id': item['id'] + '-bad'}]
+        pipeline = ElasticsearchBulkPipeline(
+            FakeIndexer(), documents, 4, failed_path, s.crawler.stats)
+        pipeline.open_spider(s)
+        for i in range(3):
+            yield pipeline.process_item({'id': f'p{i}', 'board': 'movie'}, s)
+        yield pipeline.close_spider(s)
+        yield threads.deferToThread(lambda: None)
+
+        stats = s.crawler.stats
+        self.assertEqual(stats.get_value('es/indexed'), 3)
+        self.assertEqual(stats.get_value('es/failed'), 3)
+        with open(failed_path, encoding='utf-8') as f:
+            actions = [json.loads(line) for line in f]
+        self.assertEqual([a['_id'] for a in actions], ['p0-bad', 'p1-bad', 'p2-bad'])
+        self.assertEqual(actions[0]['_source'], {'id': 'p0-bad'})
+        self.assertEqual(actions[0]['_index'], 'ptt')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Parsing posts in worker processes (ParsePool) against the in-process path."""
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.exceptions import NotConfigured  # noqa: E402
+from scrapy.http import Request  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+from twisted.internet import defer  # noqa: E402
+from twisted.trial import unittest  # noqa: E402
+
+from benchmarks import corpus  # noqa: E402
+from scraptt.middlewares import PttResponse  # noqa: E402
+from scraptt.pool import ParsePool, ParsePoolExtension  # noqa: E402
+from scraptt.spiders.ptt import PttSpider  # noqa: E402
+
+
+def fields(items):
+    """Items as comparable dicts (crawled times differ between runs)."""
+    result = []
+    for item in items:
+        item = dict(item)
+        item['time'] = {
+            k: v for k, v in item['time'].items() if k != 'crawled'}
+        item['comments'] = [
+            {k: v for k, v in comment.items() if k != 'time'}
+            for comment in item['comments'].as_dicts()
+        ]
+        result.append(item)
+    return result
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+class ParsePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.crawler = get_crawler(PttSpider, {'POST_STREAM_SIZE': 0})
+        self.spider = PttSpider.from_crawler(self.crawler, boards='movie')
+        self.pool = ParsePool(processes=2, max_pending=2)
+        self.addCleanup(self.pool.close)
+
+    def response(self, name, body=None):
+        url = corpus.post_url(name)
+        return PttResponse(
+            url=url, body=body or corpus.load(name), encoding='utf-8',
+            request=Request(url))
+
+    @defer.inlineCallbacks
+    def test_same_items_as_in_process(self):
+        for name in corpus.POSTS:
+            expected = fields(self.spider.parse_post(self.response(name)))
+            self.spider.parse_pool = self.pool
+            dfd = self.spider.parse_post(self.response(name))
+            self.assertIsInstance(dfd, defer.Deferred)
+            items = yield dfd
+            self.spider.parse_pool = None
+            self.assertEqual(fields(items), expected)
+
+    @defer.inlineCallbacks
+    def test_streamed_in_worker(self):
+        body = corpus.mega_thread(300)
+        expected = fields(self.spider.parse_post(
+            self.response('short_post', body)))
+        self.assertEqual(len(expected[0]['comments']), 300)
+        streaming = PttSpider.from_crawler(
+            get_crawler(PttSpider, {'POST_STREAM_SIZE': 1024}), boards='movie')
+        streaming.parse_pool = self.pool
+        items = yield streaming.parse_post(self.response('short_post', body))
+        self.assertEqual(fields(items), expected)
+
+    @defer.inlineCallbacks
+    def test_errors_come_back_as_failures(self):
+        yield self.assertFailure(self.pool.submit(fail, 'boom'), ValueError)
+
+    def test_extension(self):
+        with self.assertRaises(NotConfigured):
+            ParsePoolExtension(get_crawler(settings_dict={
+                'POST_PARSE_PROCESSES': 0}))
+        ext = ParsePoolExtension.from_crawler(get_crawler(settings_dict={
+            'POST_PARSE_PROCESSES': 1}))
+        self.assertEqual(ext.max_pending, 2)
+        ext.spider_opened(self.spider)
+        self.assertIsInstance(self.spider.parse_pool, ParsePool)
+        ext.spider_closed(self.spider)
+        self.assertIsNone(self.spider.parse_pool)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""PttSpider bookkeeping around post requests."""
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.http import HtmlResponse  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+
+from scraptt.spiders.ptt import PttSpider  # noqa: E402
+from scraptt.store import CheckpointStore  # noqa: E402
+
+
+def spider(tmp_path, **kwargs):
+    crawler = get_crawler(PttSpider, {
+        'CHECKPOINT_DB': str(tmp_path / 'checkpoints.sqlite')})
+    spider = PttSpider.from_crawler(crawler, boards='movie', **kwargs)
+    list(spider.start_requests())
+    return spider
+
+
+def response(request, status=200):
+    return HtmlResponse(request.url, status=status, body=b'<html></html>',
+                        encoding='utf-8', request=request)
+
+
+def test_resume_mark_waits_for_the_written_item(tmp_path):
+    s = spider(tmp_path, resume='1')
+    hrefs = [f'https://www.ptt.cc/bbs/movie/M.{1575882900 + i}.A.000.html'
+             for i in range(3)]
+    requests = [s._post_request('movie', href) for href in hrefs]
+    assert requests[0].meta['checkpoint_article'] == (
+        'movie', 'M.1575882900.A.000')
+
+    # 第一篇寫進去了，第二篇不見了 (404)，第三篇被 pipeline 丟掉
+    s.item_scraped({}, response(requests[0]), s)
+    assert s.parse_post(response(requests[1], status=404)) == []
+    s.closed('finished')
+
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    assert store.get('movie') == (None, 'M.1575882901.A.000')
+    store.close()
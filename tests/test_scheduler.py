@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""BoardFairScheduler: weighted fair queuing between boards."""
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy import Spider  # noqa: E402
+from scrapy.http import Request  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+
+from scraptt.ids import board_from_url  # noqa: E402
+from scraptt.scheduler import BoardFairScheduler, BoardVelocity  # noqa: E402
+
+
+def scheduler(board_concurrency=4):
+    crawler = get_crawler(Spider, {
+        'SCHEDULER_BOARD_CONCURRENCY': board_concurrency})
+    crawler.stats.open_spider(None)
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(active=set()))
+    scheduler = BoardFairScheduler.from_crawler(crawler)
+    scheduler.open(Spider.from_crawler(crawler, 'ptt'))
+    return scheduler
+
+
+def post(board, timestamp, priority=0):
+    return Request(
+        f'https://www.ptt.cc/bbs/{board}/M.{timestamp}.A.5A4.html',
+        priority=priority)
+
+
+def drain(scheduler, count=None):
+    boards = []
+    while count is None or len(boards) < count:
+        request = scheduler.next_request()
+        if request is None:
+            break
+        boards.append(board_from_url(request.url))
+    return boards
+
+
+def test_velocity():
+    velocity = BoardVelocity()
+    assert velocity.posts_per_day == 0.0
+    for i in range(5):
+        velocity.observe(1575000000 + i * 3600)
+    assert velocity.posts_per_day == 24.0
+
+
+def test_priority_within_a_board():
+    s = scheduler()
+    s.enqueue_request(post('movie', 1575000001))
+    s.enqueue_request(post('movie', 1575000002, priority=10))
+    assert s.next_request().url.endswith('M.1575000002.A.5A4.html')
+    assert len(s) == 1
+
+
+def test_duplicates_are_filtered():
+    s = scheduler()
+    assert s.enqueue_request(post('movie', 1575000001))
+    assert not s.enqueue_request(post('movie', 1575000001))
+    assert len(s) == 1
+
+
+def test_equal_boards_take_turns():
+    s = scheduler()
+    for i in range(3):
+        s.enqueue_request(post('movie', 1575000000 + i * 86400))
+        s.enqueue_request(post('Gossiping', 1575000000 + i * 86400))
+    boards = drain(s)
+    assert Counter(boards[:2]) == Counter(boards[2:4]) == Counter(
+        {'movie': 1, 'Gossiping': 1})
+    assert not s.has_pending_requests()
+
+
+def test_busy_board_gets_a_larger_share():
+    s = scheduler()
+    for i in range(100):
+        # Gossiping 每分鐘一篇，movie 每天一篇
+        s.enqueue_request(post('Gossiping', 1575000000 + i * 60))
+        s.enqueue_request(post('movie', 1575000000 + i * 86400))
+    share = Counter(drain(s, 60))
+    assert share['Gossiping'] > 5 * share['movie'] > 0
+
+
+def test_late_board_does_not_jump_the_queue():
+    s = scheduler()
+    for i in range(10):
+        s.enqueue_request(post('movie', 1575000000 + i * 86400))
+    drain(s, 5)
+    for i in range(10):
+        s.enqueue_request(post('Gossiping', 1575000000 + i * 86400))
+    # Gossiping 從 movie 目前的虛擬時間開始：輪流，而不是先送完 5 篇
+    assert Counter(drain(s, 4)) == Counter({'movie': 2, 'Gossiping': 2})
+
+
+def test_board_concurrency():
+    s = scheduler(board_concurrency=2)
+    for i in range(3):
+        s.enqueue_request(post('movie', 1575000000 + i))
+        s.enqueue_request(post('Gossiping', 1575000000 + i))
+    active = s.crawler.engine.downloader.active
+    active.update(post('movie', 1) for _ in range(2))
+    assert drain(s, 2) == ['Gossiping', 'Gossiping']
+    # 兩個看板都滿了：先不送
+    active.update(post('Gossiping', 1) for _ in range(2))
+    assert s.next_request() is None
+    active.clear()
+    active.update(post('movie', 1) for _ in range(2))
+    # 只剩一個看板在等時不限制
+    assert drain(s) == ['Gossiping', 'movie', 'movie', 'movie']
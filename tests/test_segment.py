@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""segment: body / quote / signature / system spans of a post's text."""
+import pytest
+
+from scraptt.spiders.parsers.segment import (
+    BODY, QUOTE, SIGNATURE, SIGNATURE_MAX_LINES, SYSTEM, segment
+)
+
+FOOTER = '※ 發信站: 批踢踢實業坊(ptt.cc), 來自: 192.0.2.1\n'
+
+
+def kinds(text):
+    return [tuple(span) for span in segment(text).as_list()]
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '內文\n',
+    '內文\n--\n簽名檔\n' + FOOTER,
+    '※ 引述《a (A)》之銘言：\n: 引述\n: : 更早的\n\n回文\n',
+    '--\n' + FOOTER + '※ 編輯: a (192.0.2.1), 12/08/2019 17:15:00\n',
+])
+def test_spans_cover_the_text(text):
+    segments = segment(text)
+    position = 0
+    for kind, start, end in segments:
+        assert start == position < end
+        position = end
+    assert position == len(text)
+    # 相鄰的 span 不會是同一種
+    assert all(a[0] != b[0] for a, b in zip(segments.spans, segments.spans[1:]))
+
+
+def test_body_quote_signature_system():
+    text = (
+        '※ 引述《a (A)》之銘言：\n: 引述\n\n回文\n'
+        '--\n簽名檔\n' + FOOTER
+    )
+    assert kinds(text) == [
+        (QUOTE, '※ 引述《a (A)》之銘言：\n: 引述'),
+        (BODY, '\n\n回文\n'),
+        (SIGNATURE, '--\n簽名檔\n'),
+        (SYSTEM, FOOTER.rstrip('\n')),
+        (BODY, '\n'),
+    ]
+    segments = segment(text)
+    assert segments.quote == '※ 引述《a (A)》之銘言：\n: 引述'
+    assert segments.content == '回文\n--\n簽名檔'
+
+
+def test_signature_between_two_dash_lines():
+    segments = segment('內文\n--\n簽名檔\n--\n' + FOOTER)
+    assert [kind for kind, _ in segments.as_list()] == [
+        BODY, SIGNATURE, SYSTEM, BODY]
+    assert list(segments.slices(SIGNATURE)) == ['--\n簽名檔\n--\n']
+    assert list(segments.slices(BODY))[0] == '內文\n'
+
+
+def test_longest_signature_between_two_dash_lines():
+    signature = '--\n' + '簽名檔\n' * SIGNATURE_MAX_LINES + '--\n'
+    segments = segment('內文\n' + signature + FOOTER)
+    assert list(segments.slices(SIGNATURE)) == [signature]
+
+
+def test_separator_far_above_the_signature_is_body():
+    body = ''.join(f'第{i}行\n' for i in range(SIGNATURE_MAX_LINES + 1))
+    segments = segment('前言\n--\n' + body + '--\n簽名檔\n' + FOOTER)
+    assert list(segments.slices(SIGNATURE)) == ['--\n簽名檔\n']
+    assert ''.join(segments.slices(BODY)) == '前言\n--\n' + body + '\n'
+
+
+def test_dash_line_without_footer_is_body():
+    segments = segment('內文\n--\n不是簽名檔\n')
+    assert list(segments.slices(SIGNATURE)) == []
+    assert segments.content == '內文\n--\n不是簽名檔'
+
+
+def test_short_quote_inside_a_longer_line_stays():
+    # 舊的 str.replace 會把行中間的 ": " 引述也切掉；這裡只看行首
+    segments = segment('內文 : : 不是引述\n: 引述\n')
+    assert segments.quote == ': 引述'
+    assert segments.content == '內文 : : 不是引述'
+
+
+def test_system_lines_are_cut_from_the_mark():
+    segments = segment('內文\n' + FOOTER + '※ 文章網址: https://www.ptt.cc/\n')
+    assert list(segments.slices(SYSTEM)) == [
+        FOOTER.rstrip('\n'), '※ 文章網址: https://www.ptt.cc/']
+    assert segments.content == '內文'
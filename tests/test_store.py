@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""CheckpointStore (resume marks, index windows) and FingerprintStore."""
+from scraptt.store import CheckpointStore, FingerprintStore
+
+
+def test_marks_saved_on_save(tmp_path):
+    path = str(tmp_path / 'checkpoints.sqlite')
+    store = CheckpointStore(path)
+    store.mark_index('movie', 3)
+    store.mark_index('movie', 2)
+    for article_id in ('M.1575882900.A.FFF', 'M.1575882922.A.5A4'):
+        store.article_sent('movie', article_id)
+        store.article_done('movie', article_id)
+    store.article_sent('movie', 'index.html')      # 不是文章 id
+    assert store.get('movie') == (None, None)
+    store.save()
+    assert store.get('movie') == (3, 'M.1575882922.A.5A4')
+    store.close()
+
+    # 已存的比較新就保留
+    store = CheckpointStore(path)
+    store.mark_index('movie', 1)
+    store.article_sent('movie', 'M.1575882922.A.5A3')
+    store.article_done('movie', 'M.1575882922.A.5A3')
+    store.save()
+    assert store.get('movie') == (3, 'M.1575882922.A.5A4')
+    store.article_sent('movie', 'M.1575882923.A.000')
+    store.article_done('movie', 'M.1575882923.A.000')
+    store.save()
+    assert store.get('movie') == (3, 'M.1575882923.A.000')
+    store.close()
+
+
+def test_unfinished_post_holds_the_mark_back(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    ids = [f'M.{1575882900 + i}.A.000' for i in range(5)]
+    for article_id in ids:
+        store.article_sent('movie', article_id)
+    # 第 3 篇下載失敗 / 被 pipeline 丟掉：沒有 article_done
+    for article_id in ids[:2] + ids[3:]:
+        store.article_done('movie', article_id)
+    assert store.last_article('movie') == ids[1]
+    store.save()
+    assert store.get('movie')[1] == ids[1]
+
+    # 下一次 resume 從 ids[2] 開始，做完之後就往前走
+    for article_id in ids[2:]:
+        store.article_sent('movie', article_id)
+        store.article_done('movie', article_id)
+    store.save()
+    assert store.get('movie')[1] == ids[4]
+    store.close()
+
+
+def test_nothing_done_keeps_the_old_mark(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    store.article_sent('movie', 'M.1575882900.A.000')
+    store.article_done('movie', 'M.1575882900.A.000')
+    store.save()
+    store.article_sent('movie', 'M.1575882901.A.000')
+    store.mark_index('movie', 5)
+    store.save()
+    assert store.get('movie') == (5, 'M.1575882900.A.000')
+    store.close()
+
+
+def test_windows(tmp_path):
+    path = str(tmp_path / 'checkpoints.sqlite')
+    store = CheckpointStore(path)
+    assert store.get_window('movie') is None
+    store.save_window('movie', 10)
+    store.save_window('movie', 12)
+    store.conn.close()      # 沒有 close()：save_window 自己 commit
+
+    store = CheckpointStore(path)
+    assert store.get_window('movie') == 12
+    store.clear_window('movie')
+    assert store.get_window('movie') is None
+    store.close()
+
+
+def test_fingerprints_commit_or_roll_back(tmp_path):
+    path = str(tmp_path / 'fingerprints.sqlite')
+    url = 'https://www.ptt.cc/bbs/movie/M.1575882922.A.5A4.html'
+    store = FingerprintStore(path)
+    assert store.get(url) == (None, None, None)
+    store.put(url, b'"etag"', None, 'abc')
+    store.close(commit=False)
+    store = FingerprintStore(path)
+    assert store.get(url) == (None, None, None)
+    store.put(url, b'"etag"', None, 'abc')
+    store.close()
+    store = FingerprintStore(path)
+    assert store.get(url) == (b'"etag"', None, 'abc')
+    store.close()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""AdaptiveThrottleMiddleware: AIMD on the downloader slot."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.http import Request, Response  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+
+from scraptt import settings as default_settings  # noqa: E402
+from scraptt.middlewares import AdaptiveThrottleMiddleware  # noqa: E402
+
+
+def middleware(**overrides):
+    settings = {
+        name: getattr(default_settings, name)
+        for name in dir(default_settings) if name.isupper()
+    }
+    settings.update(ADAPTIVE_THROTTLE_WINDOW=10, **overrides)
+    crawler = get_crawler(settings_dict=settings)
+    crawler.stats.open_spider(None)
+    slot = SimpleNamespace(concurrency=4, delay=crawler.settings.getfloat(
+        'DOWNLOAD_DELAY'))
+    crawler.engine = SimpleNamespace(
+        downloader=SimpleNamespace(slots={'www.ptt.cc': slot}))
+    return AdaptiveThrottleMiddleware.from_crawler(crawler), slot
+
+
+def window(mw, latency=0.2, errors=0):
+    for i in range(mw.window):
+        request = Request('https://www.ptt.cc/bbs/movie/index.html', meta={
+            'download_slot': 'www.ptt.cc', 'download_latency': latency})
+        status = 503 if i < errors else 200
+        mw.process_response(request, Response(request.url, status=status), None)
+
+
+def test_healthy_site_keeps_the_courtesy_delay():
+    mw, slot = middleware()
+    assert mw.min_delay == 0.4
+    for _ in range(30):
+        window(mw)
+    assert slot.delay == 0.4
+    assert slot.concurrency == 16      # CONCURRENT_REQUESTS
+    assert mw.stats.get_value('adaptive_throttle/increase') == 12
+
+
+def test_additive_increase_from_a_slower_delay():
+    mw, slot = middleware(ADAPTIVE_THROTTLE_MIN_DELAY=0.1)
+    slot.delay = 0.5
+    window(mw)
+    assert slot.delay == pytest.approx(0.4) and slot.concurrency == 4
+    for _ in range(3):
+        window(mw)
+    assert slot.delay == pytest.approx(0.1) and slot.concurrency == 4
+    window(mw)
+    assert slot.concurrency == 5
+
+
+@pytest.mark.parametrize('latency, errors', [(5.0, 0), (0.2, 3)])
+def test_multiplicative_decrease(latency, errors):
+    mw, slot = middleware()
+    slot.concurrency = 9
+    window(mw, latency, errors)
+    assert slot.concurrency == 4 and slot.delay == pytest.approx(0.8)
+    for _ in range(10):
+        window(mw, latency, errors)
+    assert slot.concurrency == 1 and slot.delay == 30.0     # MAX_DELAY
+    assert mw.stats.get_value('adaptive_throttle/decrease') == 11
+
+
+def test_exceptions_count_as_errors():
+    mw, slot = middleware()
+    request = Request('https://www.ptt.cc/bbs/movie/index.html', meta={
+        'download_slot': 'www.ptt.cc'})
+    for _ in range(mw.window):
+        mw.process_exception(request, IOError(), None)
+    assert slot.concurrency == 2
+    assert mw.stats.get_value('adaptive_throttle/error_rate') == 1.0
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""IndexWindows: bounded queue, watermarks, resuming a stopped crawl."""
+import random
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy import signals  # noqa: E402
+from scrapy.exceptions import DontCloseSpider, DropItem  # noqa: E402
+from scrapy.http import Request, Response  # noqa: E402
+from scrapy.settings import Settings  # noqa: E402
+from scrapy.signalmanager import SignalManager  # noqa: E402
+from scrapy.spidermiddlewares.httperror import HttpError  # noqa: E402
+from scrapy.statscollectors import MemoryStatsCollector  # noqa: E402
+from twisted.python.failure import Failure  # noqa: E402
+
+from scraptt.spiders.window import IndexWindow, IndexWindows  # noqa: E402
+from scraptt.store import CheckpointStore  # noqa: E402
+
+
+class Engine:
+    """Just enough of the engine: a queue `IndexWindows` can look at."""
+
+    def __init__(self):
+        self.queue = []
+        self.slot = SimpleNamespace(scheduler=self.queue)
+        self.downloader = SimpleNamespace(active=[])
+
+    def crawl(self, request, spider):
+        self.queue.append(request)
+
+
+def crawler():
+    settings = Settings({'INDEX_WINDOW_LOW': 50, 'INDEX_WINDOW_PAGES': 4})
+    crawler = SimpleNamespace(
+        settings=settings, signals=SignalManager(), engine=Engine())
+    crawler.stats = MemoryStatsCollector(crawler)
+    return crawler
+
+
+def failure(request, http=False):
+    if http:
+        result = Failure(HttpError(Response(request.url, status=404), 'ignored'))
+    else:
+        result = Failure(IOError('connection lost'))
+    result.request = request
+    return result
+
+
+def parse_post(response):
+    pass
+
+
+def crawl(store, boards, seed=0, stop_after=None):
+    """
+    Random crawl of `boards` (board -> latest index page), with failures.
+
+    Posts give 0-2 items, which leave the item pipelines in random order
+    (scraped, dropped or failed), some time after they were parsed.
+
+    Output: (pages crawled [(board, index)], posts sent {url: (board, index)},
+        posts done (every item through the pipelines, or failed) {url},
+        largest queue)
+    """
+    rnd = random.Random(seed)
+    c = crawler()
+    windows = IndexWindows(c, None, lambda board, index: Request(
+        f'https://www.ptt.cc/bbs/{board}/index{index}.html',
+        meta=windows.page_meta(board, index)), store)
+    queue = c.engine.queue
+    pipeline = []       # (response, item) not through the pipelines yet
+    items_left = {}     # post url -> items not through the pipelines yet
+    for board, latest in boards.items():
+        queue.extend(windows.start(board, latest))
+    crawled = []
+    sent = {}
+    done = set()
+    largest = 0
+    steps = 0
+    while True:
+        if not queue and not pipeline:
+            try:
+                windows.spider_idle(None)
+            except DontCloseSpider:
+                continue
+            break
+        steps += 1
+        if stop_after and steps > stop_after:
+            break
+        largest = max(largest, len(queue))
+
+        if pipeline and (not queue or rnd.random() < 0.3):
+            response, item = pipeline.pop(rnd.randrange(len(pipeline)))
+            signal, kwargs = rnd.choice([
+                (signals.item_scraped, {}),
+                (signals.item_dropped, {'exception': DropItem('dup')}),
+                (signals.item_error, {'failure': Failure(ValueError())}),
+            ])
+            c.signals.send_catch_log(
+                signal, item=item, response=response, spider=None, **kwargs)
+            items_left[response.url] -= 1
+            if not items_left[response.url]:
+                done.add(response.url)
+            continue
+
+        request = queue.pop(rnd.randrange(len(queue)))
+        x = rnd.random()
+        if 'index_window_page' in request.meta:
+            board, index = request.meta['index_window_page']
+            crawled.append((board, index))
+            if x < 0.03:
+                assert windows.failed(failure(request)).request is request
+                continue
+            if x < 0.05:
+                windows.spider_error(
+                    None, SimpleNamespace(meta=request.meta, request=request), None)
+                continue
+            for i in range(rnd.randint(0, 20)):
+                kwargs = windows.post_kwargs(board, index)
+                post = Request(
+                    f'https://www.ptt.cc/bbs/{board}/M.{index}{i:08d}.A.000.html',
+                    callback=parse_post, **kwargs)
+                sent[post.url] = (board, index)
+                if rnd.random() < 0.1:
+                    windows.request_dropped(post, None)
+                    done.add(post.url)
+                else:
+                    queue.append(post)
+            queue.extend(windows.parsed(board, index))
+        else:
+            response = SimpleNamespace(
+                url=request.url, meta=request.meta, request=request)
+            if x < 0.05:
+                windows.failed(failure(request, http=x < 0.02))
+                done.add(request.url)
+            elif x < 0.07:
+                windows.spider_error(None, response, None)
+                done.add(request.url)
+            else:
+                items = [{'url': request.url}] * rnd.choice([0, 1, 1, 1, 2])
+                assert windows.post_items(response, items) is items
+                pipeline.extend((response, item) for item in items)
+                items_left[request.url] = len(items)
+                if not items:
+                    done.add(request.url)
+        if steps % 50:
+            continue
+        # 還沒做完的po文 (在佇列裡或在 pipeline 裡)，一定在 watermark 之後
+        for board, window in windows.windows.items():
+            assert all(
+                window.watermark < index
+                for url, (b, index) in sent.items()
+                if b == board and url not in done)
+    return crawled, sent, done, largest
+
+
+def test_window_watermark():
+    window = IndexWindow('movie', 1, 3)
+    assert window.take() == 1 and window.take() == 2
+    window.post_sent(1)
+    window.page_done(2)
+    window.page_done(1)
+    assert window.watermark == 0
+    window.post_done(1)
+    assert window.watermark == 2
+    assert not window.done
+    window.take()
+    window.page_done(3)
+    assert window.done and window.watermark == 3
+
+
+def test_queue_stays_bounded():
+    boards = {'A': 300, 'B': 120, 'C': 5}
+    store = CheckpointStore(':memory:')
+    crawled, sent, done, largest = crawl(store, boards)
+    assert sorted(crawled) == sorted(
+        (board, i) for board, latest in boards.items()
+        for i in range(1, latest + 1))
+    assert largest < 50 + 4 * 20 + 20
+    assert set(sent) == done
+    assert store.conn.execute('SELECT * FROM index_windows').fetchall() == []
+
+
+def test_resume_loses_nothing():
+    boards = {'A': 300, 'B': 120, 'C': 5}
+    store = CheckpointStore(':memory:')
+    first, sent, done, _ = crawl(store, boards, seed=1, stop_after=2000)
+    saved = dict(store.conn.execute(
+        'SELECT board, watermark FROM index_windows').fetchall())
+    assert saved
+    assert set(sent) != done
+    for board, watermark in saved.items():
+        assert all((board, i) in first for i in range(1, watermark + 1))
+        # 停下來時還在 pipeline 裡的po文不會被跳過
+        assert all(
+            url in done for url, (b, index) in sent.items()
+            if b == board and index <= watermark)
+    second, *_ = crawl(store, boards, seed=2)
+    crawled = set(first) | set(second)
+    assert all(
+        (board, i) in crawled
+        for board, latest in boards.items() for i in range(1, latest + 1))
+    assert store.conn.execute('SELECT * FROM index_windows').fetchall() == []